@@ -1,10 +1,37 @@
 import pandas as pd
-import pandas_ta as ta
-import yfinance as yf
-import pyupbit
-import streamlit as st
 from datetime import datetime
+from functools import partial
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+import hashlib
+import heapq
+import importlib
+import itertools
+import math
+import multiprocessing
+import os
+import pickle
+import threading
+import time
 import numpy as np
+import d1_arena
+import d1_store
+
+class _LazyModule:
+    # 처음 속성을 쓸 때 import: 배치 CLI/작업자가 쓰지 않는 무거운 외부 모듈 로드 비용을 미룬다
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        if attr.startswith("__"): raise AttributeError(attr)
+        return getattr(importlib.import_module(self._name), attr)
+
+ta = _LazyModule("pandas_ta")
+yf = _LazyModule("yfinance")
+pyupbit = _LazyModule("pyupbit")
+requests = _LazyModule("requests")
 
 # --- 설정 ---
 ASSET_LIST = [
@@ -27,37 +54,565 @@ FEE_RATES = {
     "yahoo_future": 0.0005 # 0.05% (선물/CFD 등 가정)
 }
 
-# --- 데이터 수집 함수 (캐싱 적용) ---
-@st.cache_data(ttl=3600, show_spinner=False)
-def get_data(ticker, source, interval_str):
-    df = pd.DataFrame()
+# --- 단계별 시간 측정 (끄면 단계마다 thread-local 조회 한 번뿐) ---
+PROFILE_COLUMNS = ['asset', 'interval', 'strategy', 'stage', 'seconds', 'bars', 'bytes']
+_PROFILE = threading.local()
+_NO_PROFILE = nullcontext()
+
+class _StageTimer:
+    __slots__ = ("profiler", "record", "t0")
+
+    def __init__(self, profiler, record):
+        self.profiler = profiler
+        self.record = record
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self.record
+
+    def __exit__(self, *exc):
+        self.record["seconds"] = time.perf_counter() - self.t0
+        self.profiler.add(self.record)
+        return False
+
+class StageProfiler:
+    def __init__(self):
+        self.records = []
+        self.wall_seconds = None
+        self._lock = threading.Lock()
+
+    def stage(self, stage, bars=0, nbytes=0, **labels):
+        record = {"asset": None, "interval": None, "strategy": None, **labels,
+                  "stage": stage, "seconds": 0.0, "bars": bars, "bytes": nbytes}
+        return _StageTimer(self, record)
+
+    def add(self, record):
+        with self._lock:
+            self.records.append(record)
+
+    def extend(self, records, **labels):
+        # 프로세스 풀 작업자에서 돌아온 기록에 자산/봉 길이 라벨을 붙여 합친다
+        with self._lock:
+            self.records.extend({**r, **labels} for r in records)
+
+    def report(self):
+        report = pd.DataFrame(self.records, columns=PROFILE_COLUMNS)
+        report.attrs["wall_seconds"] = self.wall_seconds
+        return report
+
+@contextmanager
+def profiling_scope(profiler, **labels):
+    # 이 스레드에서 실행되는 profile_stage 호출을 profiler 에 기록 (라벨은 바깥 범위에 덧붙는다)
+    prev_profiler = getattr(_PROFILE, "profiler", None)
+    prev_labels = getattr(_PROFILE, "labels", None)
+    _PROFILE.profiler = profiler
+    _PROFILE.labels = {**(prev_labels or {}), **labels}
     try:
-        upbit_int_map = {"5분":"minute5", "15분":"minute15", "30분":"minute30", "1시간":"minute60", "4시간":"minute240", "1일":"day"}
-        yahoo_int_map = {"5분":"5m", "15분":"15m", "30분":"30m", "1시간":"1h", "4시간":"1h", "1일":"1d"}
-        
-        req_count = 2000 
-        
-        if source == "upbit":
-            target_interval = upbit_int_map.get(interval_str, "day")
-            df = pyupbit.get_ohlcv(ticker, interval=target_interval, count=req_count)
-        
-        elif source == "yahoo":
-            target_interval = yahoo_int_map.get(interval_str, "1d")
-            target_period = "1mo" if target_interval in ["5m", "15m", "30m"] else "2y"
-            
+        yield profiler
+    finally:
+        _PROFILE.profiler = prev_profiler
+        _PROFILE.labels = prev_labels
+
+def profile_stage(stage, bars=0, nbytes=0):
+    profiler = getattr(_PROFILE, "profiler", None)
+    if profiler is None: return _NO_PROFILE
+    return profiler.stage(stage, bars, nbytes, **_PROFILE.labels)
+
+def _scope(profiler, **labels):
+    return profiling_scope(profiler, **labels) if profiler is not None else _NO_PROFILE
+
+def summarize_timing(report):
+    # "시간이 어디로 갔나" 표: 단계별 합계와 비중 (병렬 실행이면 합계가 전체 경과 시간보다 클 수 있음)
+    if report is None or report.empty:
+        return pd.DataFrame(columns=['stage', 'calls', 'seconds', 'share', 'bars', 'bytes', 'bars_per_sec'])
+    summary = report.groupby('stage', sort=False).agg(
+        calls=('seconds', 'size'), seconds=('seconds', 'sum'), bars=('bars', 'sum'), bytes=('bytes', 'sum')).reset_index()
+    summary['share'] = summary['seconds'] / summary['seconds'].sum() * 100
+    summary['bars_per_sec'] = summary['bars'].where(summary['bars'] > 0) / summary['seconds'].where(summary['seconds'] > 0)
+    return summary[['stage', 'calls', 'seconds', 'share', 'bars', 'bytes', 'bars_per_sec']].sort_values('seconds', ascending=False, ignore_index=True)
+
+# --- 데이터 수집 함수 (로컬 봉 저장소 + 증분 갱신) ---
+UPBIT_INT_MAP = {"5분":"minute5", "15분":"minute15", "30분":"minute30", "1시간":"minute60", "4시간":"minute240", "1일":"day"}
+YAHOO_INT_MAP = {"5분":"5m", "15분":"15m", "30분":"30m", "1시간":"1h", "4시간":"1h", "1일":"1d"}
+INTERVAL_DELTAS = {"5분": pd.Timedelta(minutes=5), "15분": pd.Timedelta(minutes=15), "30분": pd.Timedelta(minutes=30),
+                   "1시간": pd.Timedelta(hours=1), "4시간": pd.Timedelta(hours=4), "1일": pd.Timedelta(days=1)}
+
+REQ_COUNT = 2000
+YAHOO_INTRADAY_DAYS = 55  # 야후 분봉은 최근 60일까지만 제공
+
+BAR_STORE = d1_store.BarStore()
+
+def _now_like(ts):
+    # 저장된 타임스탬프와 같은 기준(업비트는 KST 벽시계, 야후는 tz 포함)의 현재 시각
+    if ts.tz is not None: return pd.Timestamp.now(tz=ts.tz)
+    return pd.Timestamp.now(tz="Asia/Seoul").tz_localize(None)
+
+def _upbit_since(fetch, ticker, interval_str, since):
+    # since(마지막 저장 봉) 이후 전부: 갱신이 오래 밀렸어도 개수를 자르지 않는다 (get_ohlcv 가 200개씩 나눠 받음)
+    delta = INTERVAL_DELTAS.get(interval_str, pd.Timedelta(days=1))
+    count = int((_now_like(since) - since) / delta) + 2
+    df = fetch(ticker, interval=UPBIT_INT_MAP.get(interval_str, "day"), count=count)
+    if df is None or df.empty: return pd.DataFrame()
+    if df.index[0] > since:
+        # 일부만 받았다 → 그대로 붙이면 저장소 중간에 빈 구간이 생기므로 저장하지 않고 오류로 알린다
+        raise RuntimeError(f"{ticker} {interval_str}: {since} 이후 봉을 다 받지 못함 (첫 봉 {df.index[0]})")
+    return df
+
+def _yahoo_incremental(interval_str, since):
+    # 마지막 봉 이후만 받을 수 있는지 (야후 분봉은 최근 YAHOO_INTRADAY_DAYS 일 안쪽만 제공)
+    intraday = YAHOO_INT_MAP.get(interval_str, "1d") in ["5m", "15m", "30m"]
+    return since is not None and (not intraday or _now_like(since) - since < pd.Timedelta(days=YAHOO_INTRADAY_DAYS))
+
+def save_bars(source, ticker, interval_str, df, since=None, store=None):
+    # 새로 받은 봉 저장. 증분으로 받을 수 없을 만큼 오래된 야후 분봉은 이어 붙이면 빈 구간이 생기므로 새 봉으로 교체
+    if store is None: store = BAR_STORE
+    if df is None or df.empty: return 0
+    if source == "yahoo" and since is not None and not _yahoo_incremental(interval_str, since):
+        store.delete(source, ticker, interval_str)
+    return store.append(source, ticker, interval_str, df)
+
+def fetch_bars(ticker, source, interval_str, since=None):
+    # since 가 주어지면 그 이후(마지막 봉 포함) 봉만 받아온다
+    df = pd.DataFrame()
+    if source == "upbit":
+        if since is not None:
+            df = _upbit_since(pyupbit.get_ohlcv, ticker, interval_str, since)
+        else:
+            df = pyupbit.get_ohlcv(ticker, interval=UPBIT_INT_MAP.get(interval_str, "day"), count=REQ_COUNT)
+
+    elif source == "yahoo":
+        target_interval = YAHOO_INT_MAP.get(interval_str, "1d")
+        target_period = "1mo" if target_interval in ["5m", "15m", "30m"] else "2y"
+
+        if _yahoo_incremental(interval_str, since):
+            df = yf.download(ticker, start=since.normalize(), interval=target_interval, progress=False, auto_adjust=False)
+        else:
             df = yf.download(ticker, period=target_period, interval=target_interval, progress=False, auto_adjust=False)
-            if not df.empty:
-                if isinstance(df.columns, pd.MultiIndex):
-                    df.columns = [c[0].lower() if isinstance(c, tuple) else c.lower() for c in df.columns]
+        if df is not None and not df.empty:
+            df = _yahoo_columns(df)
+
+    return df if df is not None else pd.DataFrame()
+
+# --- 멀티 타임프레임 (가장 짧은 봉만 받아 저장하고 상위 봉은 로컬에서 합성) ---
+BASE_INTERVAL = "5분"
+DERIVED_INTERVALS = ["15분", "30분", "1시간", "4시간"]
+DAY_NS = 86400 * 10**9
+UPBIT_CANDLE_ORIGIN_NS = 9 * 3600 * 10**9  # 업비트 분봉 경계는 UTC 자정(= KST 09시) 기준
+
+YAHOO_HOURLY_INTERVALS = ["1시간", "4시간"]  # 야후 5분봉은 최근 60일뿐 → 1시간봉(2년)을 받아 합성
+
+def source_interval(interval_str, source):
+    # 저장소/API 에서 실제로 받아오는 봉 길이
+    if source == "yahoo" and interval_str in YAHOO_HOURLY_INTERVALS: return "1시간"
+    return BASE_INTERVAL if interval_str in DERIVED_INTERVALS else interval_str
+
+def history_span(interval_str):
+    # 봉 길이별로 저장소가 갖춰야 할 기간 (합성 봉도 REQ_COUNT 개를 만들 수 있게)
+    return REQ_COUNT * INTERVAL_DELTAS.get(interval_str, pd.Timedelta(days=1))
+
+def history_spans(jobs):
+    # jobs: [(ticker, source, interval_str)] → {(ticker, source, 기준 봉 길이): 가장 긴 봉 길이가 필요로 하는 기간}
+    spans = {}
+    for ticker, source, interval_str in jobs:
+        key = (ticker, source, source_interval(interval_str, source))
+        spans[key] = max(spans.get(key, pd.Timedelta(0)), history_span(interval_str))
+    return spans
+
+def _index_ns(index):
+    # 같은 df 안에서 비교용 정수 시각 (tz 있으면 UTC, 없으면 벽시계)
+    return pd.DatetimeIndex(index).as_unit("ns").asi8
+
+def _bucket_offsets(index, step):
+    # 각 봉이 속한 상위 봉 번호와, 봉 시각에서 상위 봉 시작까지의 거리(ns)
+    index = pd.DatetimeIndex(index)
+    if index.tz is None:
+        # 업비트 (KST 벽시계, 24시간): 거래소 캔들과 같은 고정 격자
+        wall = index.as_unit("ns").asi8 - UPBIT_CANDLE_ORIGIN_NS
+        return wall // step, wall % step
+    # 야후 (거래소 현지 시각): 날짜별 첫 봉(장 시작)을 기준으로 나누고 날짜를 넘겨 합치지 않는다
+    wall = index.tz_localize(None).as_unit("ns").asi8
+    day = wall // DAY_NS
+    first = np.r_[True, day[1:] != day[:-1]]
+    anchor = wall[np.flatnonzero(first)][np.cumsum(first) - 1]
+    return day * (DAY_NS // step + 1) + (wall - anchor) // step, (wall - anchor) % step
+
+def resample_ohlcv(df, interval_str):
+    # open=첫 봉, high=최대, low=최소, close=마지막 봉, volume 등 나머지 수치 컬럼은 합계. 라벨은 상위 봉 시작 시각
+    if df is None or df.empty: return pd.DataFrame() if df is None else df
+    df = df[df['close'].notna()]
+    step = INTERVAL_DELTAS[interval_str].value
+    bucket, offset = _bucket_offsets(df.index, step)
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    ends = np.r_[starts[1:], len(df)] - 1
+
+    out = {}
+    for c in df.columns:
+        if not pd.api.types.is_numeric_dtype(df[c]): continue
+        x = df[c].to_numpy(dtype=np.float64)
+        if c == 'open': out[c] = x[starts]
+        elif c == 'high': out[c] = np.maximum.reduceat(x, starts)
+        elif c == 'low': out[c] = np.minimum.reduceat(x, starts)
+        elif c == 'close': out[c] = x[ends]
+        else: out[c] = np.add.reduceat(x, starts)
+
+    labels = _index_ns(df.index)[starts] - offset[starts]
+    index = pd.DatetimeIndex(labels.view("M8[ns]"), name=df.index.name)
+    if df.index.tz is not None: index = index.tz_localize("UTC").tz_convert(df.index.tz)
+    return pd.DataFrame(out, index=index)
+
+def _calc_htf(df, func, interval, **params):
+    # 상위 봉에서 계산한 지표를 기준 봉에 펼친다. 기준 봉 i 에는 i 가 닫히는 시각까지 "완성된" 상위 봉의 값만
+    # (장 마감으로 잘린 상위 봉은 다음 장 첫 봉에서 보이게 되어 늦을 수는 있어도 미래를 보지는 않는다)
+    htf = resample_ohlcv(df, interval)
+    values = INDICATOR_FUNCS[func](htf, **params)
+    ts = _index_ns(df.index)
+    base = int(np.diff(ts).min()) if len(ts) > 1 else 0
+    done = _index_ns(htf.index) + INTERVAL_DELTAS[interval].value
+    k = np.searchsorted(done, ts + base, side="right") - 1
+    valid = k >= 0
+    out = {}
+    for key, arr in values.items():
+        arr = np.asarray(arr, dtype=np.float64)
+        aligned = np.full(len(ts), np.nan)
+        aligned[valid] = arr[k[valid]]
+        out[key] = aligned
+    return out
+
+def read_bars(source, ticker, interval_str, max_bars=None, store=None):
+    # 저장소에서 읽기, 합성 봉 길이면 기준 봉을 읽어서 로컬 리샘플
+    if store is None: store = BAR_STORE
+    base = source_interval(interval_str, source)
+    if base == interval_str:
+        return store.read(source, ticker, interval_str, max_bars=max_bars)
+    ratio = INTERVAL_DELTAS[interval_str] // INTERVAL_DELTAS[base]
+    df = store.read(source, ticker, base, max_bars=(max_bars + 1) * ratio if max_bars else None)
+    with profile_stage("resample", bars=len(df)):
+        df = resample_ohlcv(df, interval_str)
+    return df.iloc[-max_bars:] if max_bars else df
+
+def get_data(ticker, source, interval_str, refresh=True, max_bars=None, history=None):
+    # history: 업비트 저장소가 갖춰야 할 기간 (None 이면 interval_str 로 REQ_COUNT 개)
+    if refresh:
+        try:
+            fetch_interval = source_interval(interval_str, source)
+            if source == "upbit":
+                with profile_stage("fetch") as rec:
+                    added = sync_upbit_bars(ticker, fetch_interval, history or history_span(interval_str))
+                    if rec is not None: rec["bars"] = added
+            else:
+                since = BAR_STORE.last_timestamp(source, ticker, fetch_interval)
+                with profile_stage("fetch") as rec:
+                    new_bars = fetch_bars(ticker, source, fetch_interval, since)
+                    if rec is not None:
+                        rec["bars"] = len(new_bars)
+                        rec["bytes"] = int(new_bars.memory_usage(index=True).sum())
+                save_bars(source, ticker, fetch_interval, new_bars, since)
+        except Exception as e:
+            print(f"Error fetching {ticker}: {e}")
+
+    try:
+        with profile_stage("store_read") as rec:
+            df = read_bars(source, ticker, interval_str, max_bars=max_bars)
+            if rec is not None: rec["bars"] = len(df)
+        return df
+    except Exception as e:
+        print(f"Error reading {ticker}: {e}")
+        return pd.DataFrame()
+
+# --- 요청 속도 제한 (토큰 버킷) ---
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait_sec = (tokens - self._tokens) / self.rate
+            time.sleep(wait_sec)
+
+# 업비트 시세 API 는 초당 10회 제한 → 여유를 두고 초당 8회
+UPBIT_RATE_LIMITER = TokenBucket(rate=8, capacity=8)
+UPBIT_PAGE_SIZE = 200
+
+# --- 일괄 데이터 수집 (야후는 봉 길이별 한 번에, 업비트는 공용 세션으로 동시에) ---
+UPBIT_API_URL = "https://api.upbit.com/v1/candles"
+UPBIT_MARKET_URL = "https://api.upbit.com/v1/market/all"
+UPBIT_COLUMNS = {"opening_price": "open", "high_price": "high", "low_price": "low", "trade_price": "close",
+                 "candle_acc_trade_volume": "volume", "candle_acc_trade_price": "value"}
+
+class UpbitClient:
+    # 연결을 재사용하는 세션 + 공유 토큰 버킷, 429/5xx/네트워크 오류는 지수 백오프로 재시도
+    def __init__(self, limiter=None, pool_size=8, timeout=10, max_retries=4):
+        self.limiter = limiter or UPBIT_RATE_LIMITER
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.pool_size = pool_size
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        # 첫 요청 때 만든다 (모듈 import 만으로 requests 를 불러오지 않도록)
+        with self._session_lock:
+            if self._session is None:
+                self._session = requests.Session()
+                self._session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size))
+            return self._session
+
+    def _url(self, interval):
+        if interval.startswith("minute"): return f"{UPBIT_API_URL}/minutes/{interval[len('minute'):]}"
+        if interval in ("week", "month"): return f"{UPBIT_API_URL}/{interval}s"
+        return f"{UPBIT_API_URL}/days"
+
+    def _get(self, url, params):
+        error = None
+        for attempt in range(self.max_retries):
+            self.limiter.acquire()
+            try:
+                resp = self.session.get(url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            else:
+                if resp.status_code != 429 and resp.status_code < 500:
+                    resp.raise_for_status()  # 잘못된 마켓 등 4xx 는 재시도하지 않음
+                    return resp.json()
+                error = requests.HTTPError(f"HTTP {resp.status_code}", response=resp)
+            time.sleep(min(0.5 * 2 ** attempt, 10))
+        raise error
+
+    def get_markets(self, quote="KRW"):
+        # 거래 가능한 마켓 코드 목록 (예: KRW-BTC)
+        return [m["market"] for m in self._get(UPBIT_MARKET_URL, {"isDetails": "false"}) if m["market"].startswith(quote + "-")]
+
+    def get_ohlcv(self, ticker, interval="day", count=200, to=None):
+        # pyupbit.get_ohlcv 와 같은 모양 (KST 벽시계 인덱스), to 는 UTC 기준이며 해당 시각 미포함
+        url = self._url(interval)
+        if to is not None and getattr(to, "tzinfo", None) is not None:
+            to = pd.Timestamp(to).tz_convert("UTC").tz_localize(None)
+        rows = []
+        remaining = max(count, 1)
+        while remaining > 0:
+            params = {"market": ticker, "count": min(UPBIT_PAGE_SIZE, remaining)}
+            if to is not None: params["to"] = pd.Timestamp(to).strftime("%Y-%m-%d %H:%M:%S")
+            page = self._get(url, params)
+            if not page: break
+            rows.extend(page)
+            remaining -= len(page)
+            if len(page) < params["count"]: break
+            to = pd.Timestamp(page[-1]["candle_date_time_utc"])
+
+        index = pd.DatetimeIndex([r["candle_date_time_kst"] for r in rows])
+        df = pd.DataFrame([[r[c] for c in UPBIT_COLUMNS] for r in rows], columns=list(UPBIT_COLUMNS.values()),
+                          index=index, dtype=np.float64)
+        return df[~df.index.duplicated(keep="first")].sort_index()
+
+    def close(self):
+        self.session.close()
+
+UPBIT_CLIENT = UpbitClient()
+
+def _yahoo_columns(df):
+    if isinstance(df.columns, pd.MultiIndex):
+        df.columns = [c[0].lower() if isinstance(c, tuple) else c.lower() for c in df.columns]
+    else:
+        df.columns = [c.lower() for c in df.columns]
+    cols = ['open','high','low','close','volume']
+    return df[[c for c in cols if c in df.columns]]
+
+def _split_yahoo(raw, ticker):
+    # 여러 종목을 한 번에 받은 MultiIndex 컬럼에서 한 종목만 꺼낸다 (다른 종목 거래 시간의 빈 행 제거)
+    if raw is None or raw.empty: return None
+    if isinstance(raw.columns, pd.MultiIndex):
+        for level in range(raw.columns.nlevels):
+            if ticker in raw.columns.get_level_values(level):
+                df = raw.xs(ticker, axis=1, level=level).copy()
+                break
+        else:
+            return None
+    else:
+        df = raw.copy()
+    df = _yahoo_columns(df).dropna(how="all")
+    return df if not df.empty else None
+
+def fetch_yahoo_batch(tickers, interval_str, since=None, max_retries=3):
+    # 같은 봉 길이의 야후 종목을 yf.download 한 번으로 받고, 빈 종목만 골라 재시도
+    # 반환: ({ticker: df}, {ticker: 오류 메시지})
+    since = since or {}
+    target_interval = YAHOO_INT_MAP.get(interval_str, "1d")
+    intraday = target_interval in ["5m", "15m", "30m"]
+    target_period = "1mo" if intraday else "2y"
+
+    def incremental(t):
+        return _yahoo_incremental(interval_str, since.get(t))
+
+    frames, errors = {}, {}
+    todo = list(tickers)
+    for attempt in range(max_retries):
+        # 증분 갱신 가능한 종목끼리(가장 오래된 마지막 봉부터), 나머지는 기간 전체로 각각 한 번씩 요청
+        failed = []
+        for group, is_incremental in (([t for t in todo if incremental(t)], True), ([t for t in todo if not incremental(t)], False)):
+            if not group: continue
+            try:
+                if is_incremental:
+                    raw = yf.download(group, start=min(since[t] for t in group).normalize(), interval=target_interval,
+                                      progress=False, auto_adjust=False, group_by="ticker")
                 else:
-                    df.columns = [c.lower() for c in df.columns]
-                cols = ['open','high','low','close','volume']
-                df = df[[c for c in cols if c in df.columns]]
-                
+                    raw = yf.download(group, period=target_period, interval=target_interval, progress=False,
+                                      auto_adjust=False, group_by="ticker")
+                batch_error = None
+            except Exception as e:
+                raw, batch_error = None, str(e)
+            yf_errors = getattr(getattr(yf, "shared", None), "_ERRORS", None) or {}
+
+            for t in group:
+                df = _split_yahoo(raw, t)
+                if df is None:
+                    failed.append(t)
+                    errors[t] = batch_error or yf_errors.get(t) or "데이터 없음"
+                    continue
+                if since.get(t) is not None: df = df[df.index >= since[t]]
+                frames[t] = df
+                errors.pop(t, None)
+
+        todo = failed
+        if not todo: break
+        if attempt + 1 < max_retries: time.sleep(min(0.5 * 2 ** attempt, 10))
+    return frames, errors
+
+def _refresh_yahoo(tickers, interval_str, max_retries=3):
+    try:
+        since = {t: BAR_STORE.last_timestamp("yahoo", t, interval_str) for t in tickers}
+        with profile_stage("fetch") as rec:
+            frames, errors = fetch_yahoo_batch(tickers, interval_str, since, max_retries)
+            if rec is not None:
+                rec["bars"] = sum(len(df) for df in frames.values())
+                rec["bytes"] = int(sum(df.memory_usage(index=True).sum() for df in frames.values()))
+        for t, df in frames.items():
+            try:
+                save_bars("yahoo", t, interval_str, df, since[t])
+            except Exception as e:
+                errors[t] = str(e)
     except Exception as e:
-        print(f"Error fetching {ticker}: {e}")
-    
-    return df
+        return {(t, interval_str): str(e) for t in tickers}
+    return {(t, interval_str): msg for t, msg in errors.items()}
+
+def _refresh_upbit(client, ticker, interval_str, history=None):
+    try:
+        with profile_stage("fetch") as rec:
+            # 속도 제한/재시도는 client 가 직접 한다
+            added = sync_upbit_bars(ticker, interval_str, history, fetch=client.get_ohlcv, limiter=None)
+            if rec is not None: rec["bars"] = added
+    except Exception as e:
+        return {(ticker, interval_str): str(e)}
+    return {}
+
+def bulk_refresh_tasks(jobs, upbit_client=None, max_retries=3):
+    # jobs: [(ticker, source, interval_str)] → [(이 작업이 갱신하는 (ticker, interval_str) 목록, 실행 함수)]
+    # 합성 봉 길이는 기준 봉 길이로 바꿔서 한 번만 받는다 (업비트는 그중 가장 긴 봉 길이에 맞는 기간까지)
+    if upbit_client is None: upbit_client = UPBIT_CLIENT
+    yahoo_groups = {}
+    tasks = []
+    for (ticker, source, interval_str), span in history_spans(jobs).items():
+        if source == "yahoo":
+            yahoo_groups.setdefault(interval_str, []).append(ticker)
+        elif source == "upbit":
+            tasks.append(([(ticker, interval_str)], partial(_refresh_upbit, upbit_client, ticker, interval_str, span)))
+    for interval_str, tickers in yahoo_groups.items():
+        tasks.append(([(t, interval_str) for t in tickers], partial(_refresh_yahoo, tickers, interval_str, max_retries)))
+    return tasks
+
+def refresh_bars(jobs, upbit_client=None, max_workers=8, max_retries=3):
+    # 저장소를 최신 봉으로 갱신, 종목별 실패는 모아서 돌려준다 {(ticker, interval_str): 오류 메시지}
+    errors = {}
+    tasks = bulk_refresh_tasks(jobs, upbit_client, max_retries)
+    if not tasks: return errors
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for fut in [pool.submit(fn) for _, fn in tasks]:
+            errors.update(fut.result())
+    return errors
+
+def get_data_bulk(jobs, refresh=True, max_bars=None, max_workers=8):
+    # 반환: ({(ticker, interval_str): df}, {(ticker, interval_str): 오류 메시지})
+    errors = refresh_bars(jobs, max_workers=max_workers) if refresh else {}
+    frames = {}
+    for ticker, source, interval_str in jobs:
+        try:
+            frames[(ticker, interval_str)] = read_bars(source, ticker, interval_str, max_bars=max_bars)
+        except Exception as e:
+            errors[(ticker, interval_str)] = str(e)
+            frames[(ticker, interval_str)] = pd.DataFrame()
+    return frames, errors
+
+# --- 업비트 과거 데이터 페이지 다운로드 (to= 커서로 과거 방향, 중단 후 이어받기) ---
+def download_upbit_history(ticker, interval_str, start, store=None, limiter=UPBIT_RATE_LIMITER, max_retries=5, progress_callback=None, fetch=None):
+    # limiter=None: fetch 가 직접 속도를 제한하는 경우 (UpbitClient.get_ohlcv)
+    if store is None: store = BAR_STORE
+    if fetch is None: fetch = pyupbit.get_ohlcv  # get_ohlcv(ticker, interval=, count=, to=) 모양이면 무엇이든 (UpbitClient 등)
+    start = pd.Timestamp(start)  # 업비트 봉 시각과 같은 KST 기준
+    target_interval = UPBIT_INT_MAP.get(interval_str, "day")
+    delta = INTERVAL_DELTAS.get(interval_str, pd.Timedelta(days=1))
+
+    # 이어받기: 스테이징된 가장 오래된 봉, 없으면 저장소의 첫 봉부터 과거로
+    cursor = store.staged_first_timestamp("upbit", ticker, interval_str)
+    if cursor is None: cursor = store.first_timestamp("upbit", ticker, interval_str)
+
+    first_cursor = cursor if cursor is not None else _now_like(start)
+    total_pages = max(int((first_cursor - start) / delta) // UPBIT_PAGE_SIZE + 1, 1)
+    pages = 0
+
+    while cursor is None or cursor > start:
+        error = None
+        for attempt in range(max_retries):
+            if limiter is not None: limiter.acquire()
+            # 업비트 API 의 to 는 UTC 기준 (해당 시각 미포함)
+            to = None if cursor is None else cursor.tz_localize("Asia/Seoul").tz_convert("UTC").to_pydatetime()
+            try:
+                page = fetch(ticker, interval=target_interval, count=UPBIT_PAGE_SIZE, to=to)
+                break
+            except Exception as e:  # 네트워크 오류/429 등 실제 오류만 재시도
+                error = e
+                time.sleep(min(0.5 * 2 ** attempt, 10))
+        else:
+            # 받은 페이지는 스테이징에 남아 있으므로 다시 호출하면 이어서 받는다
+            raise RuntimeError(f"{ticker} {interval_str}: {cursor} 이전 페이지 수신 실패 (재시도 {max_retries}회)") from error
+        # 상장 이전까지 도달 (pyupbit 는 빈 응답에 None 을 돌려준다) → 받은 만큼 커밋
+        # (pyupbit 가 삼킨 일시 오류였다면 다시 호출할 때 저장소의 첫 봉부터 이어서 받는다)
+        if page is None or page.empty: break
+
+        store.stage_append("upbit", ticker, interval_str, page)
+        cursor = page.index[0]
+        pages += 1
+        if progress_callback:
+            progress_callback(min(pages, total_pages), total_pages, f"[{ticker}] {interval_str} {cursor} 까지 수신")
+
+    return store.commit_staged("upbit", ticker, interval_str)
+
+def sync_upbit_bars(ticker, interval_str, history=None, fetch=None, limiter=UPBIT_RATE_LIMITER, store=None):
+    # 1) 마지막 저장 봉 이후 전부 2) 최근 history 기간만큼 과거가 없으면 (처음이거나 더 긴 봉 길이가 필요해짐) 첫 봉부터 과거로
+    # 반환: 새로 저장한 봉 수
+    if store is None: store = BAR_STORE
+    if fetch is None: fetch = pyupbit.get_ohlcv
+    if history is None: history = history_span(interval_str)
+    added = 0
+    since = store.last_timestamp("upbit", ticker, interval_str)
+    if since is not None:
+        added += store.append("upbit", ticker, interval_str, _upbit_since(fetch, ticker, interval_str, since))
+    start = pd.Timestamp.now(tz="Asia/Seoul").tz_localize(None) - history
+    first = store.first_timestamp("upbit", ticker, interval_str)
+    if first is None or first > start + INTERVAL_DELTAS.get(interval_str, pd.Timedelta(days=1)):
+        # 상장이 더 늦은 종목은 매번 빈 페이지 하나로 끝난다
+        added += download_upbit_history(ticker, interval_str, start, store=store, limiter=limiter, max_retries=3, fetch=fetch)
+    return added
 
 # --- 보조 함수: W패턴 확인 ---
 def check_double_bottom(series, idx, window=20, tolerance=0.005):
@@ -78,323 +633,1781 @@ def check_double_bottom(series, idx, window=20, tolerance=0.005):
             return False
     return False
 
-# --- [v1] 하일수 하이브리드 전략 (Basic) ---
-def run_hybrid_strategy_v1(df):
-    if df is None or df.empty or len(df) < 202: return None
-    df = df.copy()
-    
-    df['RSI'] = ta.rsi(df['close'], length=14)
-    bb = ta.bbands(df['close'], length=20, std=2)
-    
+# --- W패턴 일괄 계산 (check_double_bottom 과 같은 판정을 전체 구간에 대해) ---
+def double_bottom_flags(low, window=20, tolerance=0.005):
+    low = np.asarray(low, dtype=np.float64)
+    n = len(low)
+    flags = np.zeros(n, dtype=bool)
+    if n <= window: return flags
+
+    # 아직 닮은 저점을 찾지 못한 봉들만 남겨 가며 1봉씩 과거로 거슬러 올라간다
+    pos = np.arange(window, n)
+    current_low = low[pos]
+    middle_high = np.full(len(pos), np.nan)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for k in range(1, window + 1):
+            past_low = low[pos - k]
+            middle_high = np.fmax(middle_high, past_low)  # NaN 무시 (Series.max 와 동일)
+            hit = np.abs(past_low - current_low) / current_low <= tolerance
+            if hit.any():
+                flags[pos[hit]] = middle_high[hit] > current_low[hit] * 1.005
+                keep = ~hit
+                pos, current_low, middle_high = pos[keep], current_low[keep], middle_high[keep]
+                if len(pos) == 0: break
+    return flags
+
+# --- 전략 파라미터 (v1/v2/v3 차이는 상수뿐) ---
+HYBRID_V1_PARAMS = {
+    "target_profit": 0.01,
+    "stop_loss": 0.10,
+    "rsi_entry": 35, "rsi_entry_inclusive": False,   # RSI < 35
+    "rsi_exit": 70, "rsi_exit_inclusive": False,     # RSI > 70
+    "bb_mid_exit": False, "bb_mid_min_pnl": 0.005,
+    "w_pattern": False,
+    "sma202_support": False, "sma202_band": 0.015,
+}
+
+HYBRID_V2_PARAMS = {
+    **HYBRID_V1_PARAMS,
+    "rsi_entry": 30, "rsi_entry_inclusive": True,    # RSI <= 30
+    "rsi_exit_inclusive": True,                      # RSI >= 70
+    "bb_mid_exit": True,
+    "w_pattern": True,
+    "sma202_support": True,
+}
+
+HYBRID_V3_PARAMS = {**HYBRID_V2_PARAMS, "target_profit": 0.02}  # 목표 수익률 2%로 상향
+
+WARMUP_BARS = 202
+INITIAL_BALANCE = 1000000
+
+# --- 보조 지표 계산 (지표별 계산 함수: 이름 -> 배열 dict) ---
+def _calc_rsi(df, length=14):
+    return {"rsi": ta.rsi(df['close'], length=length).to_numpy(dtype=np.float64)}
+
+def _calc_bbands(df, length=20, std=2):
+    bb = ta.bbands(df['close'], length=length, std=std)
     bbu_col = [c for c in bb.columns if c.startswith('BBU')][0]
     bbl_col = [c for c in bb.columns if c.startswith('BBL')][0]
     bbm_col = [c for c in bb.columns if c.startswith('BBM')][0]
-    
-    df['BB_Upper'] = bb[bbu_col]
-    df['BB_Lower'] = bb[bbl_col]
-    df['BB_Mid'] = bb[bbm_col]
-    df['SMA_202'] = ta.sma(df['close'], length=202)
-
-    balance = 1000000
-    initial_balance = 1000000
-    position = None 
-    entry_price = 0
-    trades = []
-    equity_curve = [] 
-    
-    TARGET_PROFIT = 0.01 
-    STOP_LOSS = 0.10     
-    rescue_mode = False 
-    
-    for i in range(len(df)):
-        equity_curve.append({'time': df.index[i], 'balance': balance})
-        if i < 202: continue
-        
-        curr_close = df['close'].iloc[i]
-        prev_close = df['close'].iloc[i-1]
-        curr_time = str(df.index[i])
-        curr_rsi = df['RSI'].iloc[i]
-        bb_lower = df['BB_Lower'].iloc[i]
-        prev_bb_lower = df['BB_Lower'].iloc[i-1]
-        
-        # Exit
-        if position == 'long':
-            pnl = (curr_close - entry_price) / entry_price
-            is_close = False
-            reason = ""
-            
-            if pnl >= TARGET_PROFIT:
-                is_close = True; reason = "Target 1% Reached"; rescue_mode = False
-            elif pnl <= -STOP_LOSS:
-                is_close = True; reason = "Stop Loss (-10%)"; rescue_mode = False
-            elif curr_rsi > 70:
-                if pnl > 0: is_close = True; reason = "RSI > 70 Profit"; rescue_mode = False
-                else: rescue_mode = True
-            
-            if rescue_mode and pnl >= 0:
-                is_close = True; reason = "Rescue Exit (Breakeven)"; rescue_mode = False
-            
-            if is_close:
-                balance *= (1 + pnl)
-                trades.append({'time': curr_time, 'type': 'Exit', 'pnl': pnl, 'reason': reason, 'price': curr_close, 'balance': balance})
-                position = None
-                
-        # Entry
-        if position is None:
-            band_reversal = (prev_close < prev_bb_lower) and (curr_close > bb_lower)
-            rsi_condition = (curr_rsi < 35) 
-            
-            if band_reversal and rsi_condition:
-                position = 'long'
-                entry_price = curr_close
-                trades.append({'time': curr_time, 'type': 'Entry', 'reason': "Band Reversal + RSI < 35", 'price': curr_close, 'balance': balance})
-
-    total_exits = [t for t in trades if t['type'] == 'Exit']
-    win_trades = [t for t in total_exits if t['pnl'] > 0]
-    win_rate = (len(win_trades) / len(total_exits) * 100) if total_exits else 0
-    total_return = (balance - initial_balance) / initial_balance * 100
-    
     return {
-        "return": total_return,
-        "win_rate": win_rate,
-        "trades": len(total_exits),
-        "trade_history": trades,
-        "equity_curve": equity_curve,
-        "last_price": df['close'].iloc[-1]
+        "upper": bb[bbu_col].to_numpy(dtype=np.float64),
+        "lower": bb[bbl_col].to_numpy(dtype=np.float64),
+        "mid": bb[bbm_col].to_numpy(dtype=np.float64),
     }
 
-# --- [v2] 하일수 하이브리드 전략 (Optimized) ---
-def run_hybrid_strategy_v2(df):
-    if df is None or df.empty or len(df) < 202: return None
-    df = df.copy()
-    
-    df['RSI'] = ta.rsi(df['close'], length=14)
-    bb1 = ta.bbands(df['close'], length=20, std=2)
-    bbu1_col = [c for c in bb1.columns if c.startswith('BBU')][0]
-    bbl1_col = [c for c in bb1.columns if c.startswith('BBL')][0]
-    bbm1_col = [c for c in bb1.columns if c.startswith('BBM')][0]
-    
-    df['BB1_Upper'] = bb1[bbu1_col]
-    df['BB1_Lower'] = bb1[bbl1_col]
-    df['BB1_Mid'] = bb1[bbm1_col]
-    df['SMA_202'] = ta.sma(df['close'], length=202)
-
-    balance = 1000000
-    initial_balance = 1000000
-    position = None 
-    entry_price = 0
+def _calc_sma(df, length=202):
+    return {"sma": ta.sma(df['close'], length=length).to_numpy(dtype=np.float64)}
+
+def _calc_double_bottom(df, window=20, tolerance=0.005):
+    return {"flags": double_bottom_flags(df['low'], window, tolerance)}
+
+INDICATOR_FUNCS = {
+    "rsi": _calc_rsi,
+    "bbands": _calc_bbands,
+    "sma": _calc_sma,
+    "double_bottom": _calc_double_bottom,
+    "htf": _calc_htf,
+}
+
+def frame_fingerprint(df):
+    # 같은 봉 데이터면 같은 값 (종목/봉 길이 대신 내용으로 구분)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(len(df)).encode())
+    if isinstance(df.index, pd.DatetimeIndex):
+        # tz 가 있는 인덱스의 to_numpy() 는 object 배열(포인터)이라 ns 정수 + tz 이름으로
+        h.update(str(df.index.tz).encode())
+        h.update(np.ascontiguousarray(df.index.as_unit("ns").asi8).tobytes())
+    else:
+        h.update(np.ascontiguousarray(df.index.to_numpy()).tobytes())
+    for col in ['open', 'high', 'low', 'close', 'volume']:
+        if col in df.columns:
+            h.update(col.encode())
+            h.update(np.ascontiguousarray(df[col].to_numpy(dtype=np.float64)).tobytes())
+    return h.hexdigest()
+
+def _read_only(arr):
+    arr = np.asarray(arr)
+    arr.flags.writeable = False
+    return arr
+
+# --- 지표 캐시 (입력 지문 + 지표 파라미터 단위 메모이제이션, 메모리 한도 내 LRU) ---
+class IndicatorCache:
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, df, name, fingerprint=None, **params):
+        if fingerprint is None: fingerprint = frame_fingerprint(df)
+        key = (fingerprint, name, tuple(sorted(params.items())))
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        entry = {k: _read_only(v) for k, v in INDICATOR_FUNCS[name](df, **params).items()}
+        size = sum(v.nbytes for v in entry.values())
+
+        with self._lock:
+            if size <= self.max_bytes and key not in self._entries:
+                self._entries[key] = entry
+                self._nbytes += size
+                while self._nbytes > self.max_bytes:
+                    _, old = self._entries.popitem(last=False)
+                    self._nbytes -= sum(v.nbytes for v in old.values())
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def __len__(self):
+        return len(self._entries)
+
+INDICATOR_CACHE = IndicatorCache()
+
+def compute_hybrid_indicators(df, cache=None):
+    if cache is None: cache = INDICATOR_CACHE
+    fp = frame_fingerprint(df)
+    bb = cache.get(df, "bbands", fp, length=20, std=2)
+
+    return {
+        "close": _read_only(df['close'].to_numpy(dtype=np.float64)),
+        "low": _read_only(df['low'].to_numpy(dtype=np.float64)),
+        "rsi": cache.get(df, "rsi", fp, length=14)["rsi"],
+        "bb_upper": bb["upper"],
+        "bb_lower": bb["lower"],
+        "bb_mid": bb["mid"],
+        "sma_202": cache.get(df, "sma", fp, length=202)["sma"],
+        "w_pattern": cache.get(df, "double_bottom", fp, window=20, tolerance=0.005)["flags"],
+    }
+
+# --- 진입 신호 (포지션과 무관한 조건은 한 번에 벡터 계산) ---
+ENTRY_NONE, ENTRY_BAND, ENTRY_W, ENTRY_SMA202 = 0, 1, 2, 3
+
+def _entry_reasons(params):
+    op = "<=" if params["rsi_entry_inclusive"] else "<"
+    rsi_txt = f"RSI {op} {params['rsi_entry']:g}"
+    return {
+        ENTRY_BAND: f"Band Reversal + {rsi_txt}",
+        ENTRY_W: f"W-Pattern + {rsi_txt}",
+        ENTRY_SMA202: f"202 SMA Support + {rsi_txt}",
+    }
+
+# --- 자산 곡선 (봉별 dict 대신 타임스탬프 배열 + 잔고 변화 지점만 저장) ---
+class EquityCurve:
+    # 잔고는 청산 때만 바뀌므로 (변화 시작 위치, 잔고) 쌍으로 run-length 저장
+    def __init__(self, times, starts, levels, tz=None, is_datetime=True):
+        self.times = np.asarray(times, dtype=np.int64)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.levels = np.asarray(levels, dtype=np.float64)
+        self.tz = tz
+        self.is_datetime = is_datetime
+
+    @classmethod
+    def from_exits(cls, index, exit_bars, exit_balances, initial_balance=INITIAL_BALANCE):
+        # 각 봉의 잔고는 청산 처리 전 잔고 → 청산 봉 다음 봉부터 새 잔고
+        is_datetime = isinstance(index, pd.DatetimeIndex)
+        times = index.as_unit("ns").asi8 if is_datetime else np.arange(len(index), dtype=np.int64)
+        starts = [0] + [b + 1 for b in exit_bars]
+        levels = [initial_balance] + list(exit_balances)
+        # 마지막 봉에서 청산하면 반영될 봉이 없다
+        if starts[-1] >= len(times) and len(starts) > 1:
+            starts, levels = starts[:-1], levels[:-1]
+        return cls(times, starts, levels, str(index.tz) if is_datetime and index.tz is not None else None, is_datetime)
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def index(self):
+        if not self.is_datetime: return pd.RangeIndex(len(self.times))
+        index = pd.DatetimeIndex(self.times.view("M8[ns]"))
+        return index.tz_localize("UTC").tz_convert(self.tz) if self.tz else index
+
+    @property
+    def balance(self):
+        if len(self.times) == 0: return np.empty(0, dtype=np.float64)
+        return self.levels[np.searchsorted(self.starts, np.arange(len(self.times)), side="right") - 1]
+
+    @property
+    def nbytes(self):
+        return self.times.nbytes + self.starts.nbytes + self.levels.nbytes
+
+    def to_frame(self):
+        return pd.DataFrame({"balance": self.balance}, index=self.index.rename("time"))
+
+    def to_records(self):
+        # 예전 형식 [{'time': ..., 'balance': ...}, ...] 이 필요한 곳을 위한 변환
+        return [{'time': t, 'balance': b} for t, b in zip(self.index, self.balance.tolist())]
+
+    def downsample(self, max_points=1000):
+        # 차트용: 잔고가 바뀌기 직전/직후 봉만 남기면 계단 모양 그대로, 그래도 많으면 LTTB 로 max_points 개까지
+        n = len(self.times)
+        if n == 0: return self.to_frame()
+        idx = np.unique(np.r_[self.starts, self.starts[1:] - 1, n - 1])
+        balance = self.levels[np.searchsorted(self.starts, idx, side="right") - 1]
+        if len(idx) > max_points:
+            keep = lttb_indices(self.times[idx] - self.times[idx[0]], balance, max_points)
+            idx, balance = idx[keep], balance[keep]
+        if not self.is_datetime:
+            index = pd.Index(idx, name="time")
+        else:
+            index = pd.DatetimeIndex(self.times[idx].view("M8[ns]"), name="time")
+            if self.tz: index = index.tz_localize("UTC").tz_convert(self.tz)
+        return pd.DataFrame({"balance": balance}, index=index)
+
+def lttb_indices(x, y, n_out):
+    # Largest-Triangle-Three-Buckets: 처음/끝 점을 두고 가운데를 n_out-2 구간으로 나눠,
+    # 구간마다 (직전 선택 점, 다음 구간 평균) 과 만드는 삼각형이 가장 큰 점 하나를 고른다
+    n = len(x)
+    if n_out >= n or n_out < 3: return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    out = np.empty(n_out, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for k in range(n_out - 2):
+        lo, hi = edges[k], edges[k + 1]
+        nlo, nhi = hi, (edges[k + 2] if k + 2 < len(edges) else n)
+        cx, cy = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(area.argmax())
+        out[k + 1] = a
+    return out
+
+# --- 거래 테이블 (진입~청산 한 쌍이 한 행) ---
+LEDGER_COLUMNS = ['run_id', 'strategy', 'asset', 'interval', 'entry_ts', 'exit_ts', 'entry_price', 'exit_price', 'pnl', 'reason']
+
+def _wall_clock(index):
+    # 자산마다 tz 가 달라도 한 컬럼에 담을 수 있도록 현지 벽시계 시각(tz 없음)으로 통일
+    if not isinstance(index, pd.DatetimeIndex):
+        return pd.DatetimeIndex(np.full(len(index), np.datetime64("NaT", "ns")))
+    return index.tz_localize(None) if index.tz is not None else index
+
+def _trade_table(index, close, entry_bars, exit_bars, pnls, reasons):
+    # 마지막 진입이 청산되지 않았으면 exit 쪽은 NaT/NaN
+    n_open = len(entry_bars) - len(exit_bars)
+    entry_bars = np.asarray(entry_bars, dtype=np.int64)
+    exit_bars = np.asarray(list(exit_bars) + [-1] * n_open, dtype=np.int64)
+    closed = exit_bars >= 0
+    wall = _wall_clock(index).as_unit("ns")
+
+    exit_ts = np.full(len(exit_bars), np.datetime64("NaT", "ns"))
+    exit_ts[closed] = wall.values[exit_bars[closed]]
+    exit_price = np.full(len(exit_bars), np.nan)
+    exit_price[closed] = close[exit_bars[closed]]
+
+    return pd.DataFrame({
+        'entry_ts': wall.values[entry_bars],
+        'exit_ts': exit_ts,
+        'entry_price': close[entry_bars],
+        'exit_price': exit_price,
+        'pnl': np.asarray(list(pnls) + [np.nan] * n_open, dtype=np.float64),
+        'reason': list(reasons) + [None] * n_open,
+    })
+
+def build_trade_ledger(results):
+    # 모든 실행(run_id = results 내 위치)의 거래를 하나의 타입 고정 테이블로
+    frames = []
+    for run_id, res in enumerate(results):
+        table = res.get('trade_table')
+        if table is None or table.empty: continue
+        frames.append(table.assign(run_id=run_id, strategy=res['strategy'], asset=res['asset'], interval=res['interval']))
+
+    if frames:
+        ledger = pd.concat(frames, ignore_index=True)
+    else:
+        ledger = pd.DataFrame({
+            **{col: pd.Series([], dtype=object) for col in ['strategy', 'asset', 'interval', 'reason']},
+            'run_id': pd.Series([], dtype=np.int32),
+            'entry_ts': pd.Series([], dtype='datetime64[ns]'), 'exit_ts': pd.Series([], dtype='datetime64[ns]'),
+            **{col: pd.Series([], dtype=np.float64) for col in ['entry_price', 'exit_price', 'pnl']},
+        })
+    ledger['run_id'] = ledger['run_id'].astype(np.int32)
+    for col in ['strategy', 'asset', 'interval', 'reason']:
+        ledger[col] = ledger[col].astype('category')
+    return ledger[LEDGER_COLUMNS]
+
+# --- 집계 큐브 (전략/자산/봉 길이/청산 월 단위 로그 수익 합, 거래 수, 승 수) ---
+CUBE_COLUMNS = ['run_id', 'strategy', 'asset', 'interval', 'month', 'fee_rate', 'trades', 'wins', 'log_ret', 'log_ret_fee']
+
+def build_agg_cube(results, ledger=None):
+    # 로그 수익은 더하기만 하면 되므로 어떤 필터 조합이든 groupby/sum 으로 재조합 가능
+    # 수수료 반영: (1 + pnl) * (1 - fee)^2  →  log1p(pnl) + 2 * log1p(-fee)
+    if ledger is None: ledger = build_trade_ledger(results)
+    fee_rates = np.array([get_fee_rate(r.get('source', 'upbit'), r.get('category', '코인')) for r in results], dtype=np.float64)
+
+    exits = ledger[ledger['exit_ts'].notna()]
+    run_id = exits['run_id'].to_numpy()
+    pnl = exits['pnl'].to_numpy()
+    log_ret = np.log1p(pnl)
+    cube = pd.DataFrame({
+        'run_id': run_id,
+        'month': exits['exit_ts'].dt.strftime("%Y-%m").to_numpy(),
+        'trades': np.ones(len(pnl), dtype=np.int64),
+        'wins': (pnl > 0).astype(np.int64),
+        'log_ret': log_ret,
+        'log_ret_fee': log_ret + 2 * np.log1p(-fee_rates[run_id]) if len(run_id) else log_ret,
+    })
+    cube = cube.groupby(['run_id', 'month'], as_index=False, sort=True).sum()
+
+    run_ids = cube['run_id'].to_numpy()
+    for col in ['strategy', 'asset', 'interval']:
+        values = np.array([r[col] for r in results], dtype=object)
+        cube[col] = pd.Categorical(values[run_ids])
+    cube['month'] = cube['month'].astype('category')
+    cube['fee_rate'] = fee_rates[run_ids] if len(run_ids) else np.empty(0)
+    cube['run_id'] = cube['run_id'].astype(np.int32)
+    return cube[CUBE_COLUMNS]
+
+# --- 전략 명세 (지표 / 진입 조건 / 청산 규칙을 데이터로 선언) ---
+# indicators: 별칭 → (INDICATOR_FUNCS 이름, 파라미터[, 상위 봉 길이]). 출력이 하나면 별칭, 여럿이면 "별칭.키" 로 참조
+#   상위 봉 길이를 주면 같은 df 를 로컬 리샘플해서 계산하고, 완성된 상위 봉 값만 기준 봉에 펼친다
+#   예) "sma_1h": ("sma", {"length": 50}, "1시간") → 1시간봉 50 SMA 추세 필터 (추가 다운로드 없음)
+# entries: 우선순위 순서, 각 항목의 when 조건(봉 단위 술어)이 모두 참이면 진입
+# exits: 순서대로 처음 맞는 규칙 하나만 적용 (take_profit / stop_loss / signal)
+#   signal + profit_only: 이익이면 청산, 손실이면 구조대 모드로 전환
+#   signal + min_pnl: 수익률이 min_pnl 초과일 때만 청산
+# rescue: 구조대 모드에서 수익률이 level 이상으로 돌아오면 청산
+def _series(ind, name):
+    return np.asarray(ind[name], dtype=np.float64)
+
+def _pred_below(ind, series, level, inclusive=False):
+    x = _series(ind, series)
+    return x <= level if inclusive else x < level
+
+def _pred_above(ind, series, level, inclusive=False):
+    x = _series(ind, series)
+    return x >= level if inclusive else x > level
+
+def _pred_cross_above(ind, series, of="close"):
+    # 직전 봉은 기준선 아래, 이번 봉은 위 (밴드 회귀)
+    x = _series(ind, of)
+    s = _series(ind, series)
+    out = np.zeros(x.shape, dtype=bool)  # 시간 축은 0번 (스크리너는 (봉, 마켓) 행렬)
+    out[1:] = (x[:-1] < s[:-1]) & (x[1:] > s[1:])
+    return out
+
+def _pred_at_or_above(ind, series, of="close"):
+    return _series(ind, of) >= _series(ind, series)
+
+def _pred_within_above(ind, series, band, of="close"):
+    # 기준선 위 band 비율 이내 (지지선 근접)
+    s = _series(ind, series)
+    dist = (_series(ind, of) - s) / s
+    return (dist > 0) & (dist < band)
+
+def _pred_flag(ind, series):
+    return np.asarray(ind[series], dtype=bool)
+
+PREDICATES = {
+    "below": _pred_below,
+    "above": _pred_above,
+    "cross_above": _pred_cross_above,
+    "at_or_above": _pred_at_or_above,
+    "within_above": _pred_within_above,
+    "flag": _pred_flag,
+}
+
+def hybrid_spec(name, params, version=1):
+    op = "<=" if params["rsi_entry_inclusive"] else "<"
+    rsi_entry = ("below", {"series": "rsi", "level": params["rsi_entry"], "inclusive": params["rsi_entry_inclusive"]})
+    rsi_txt = f"RSI {op} {params['rsi_entry']:g}"
+
+    indicators = {"rsi": ("rsi", {"length": 14}), "bb": ("bbands", {"length": 20, "std": 2})}
+    entries = [{"when": [("cross_above", {"series": "bb.lower"}), rsi_entry], "reason": f"Band Reversal + {rsi_txt}"}]
+    if params["w_pattern"]:
+        indicators["w"] = ("double_bottom", {"window": 20, "tolerance": 0.005})
+        entries.append({"when": [("flag", {"series": "w"}), rsi_entry], "reason": f"W-Pattern + {rsi_txt}"})
+    if params["sma202_support"]:
+        indicators["sma_202"] = ("sma", {"length": 202})
+        entries.append({"when": [("within_above", {"series": "sma_202", "band": params["sma202_band"]}), rsi_entry],
+                        "reason": f"202 SMA Support + {rsi_txt}"})
+
+    exits = [
+        {"type": "take_profit", "level": params["target_profit"], "reason": f"Target {params['target_profit']*100:g}% Reached"},
+        {"type": "stop_loss", "level": params["stop_loss"], "reason": f"Stop Loss (-{params['stop_loss']*100:g}%)"},
+        {"type": "signal", "when": [("above", {"series": "rsi", "level": params["rsi_exit"], "inclusive": params["rsi_exit_inclusive"]})],
+         "profit_only": True, "reason": "RSI > 70 Profit"},
+    ]
+    if params["bb_mid_exit"]:
+        exits.append({"type": "signal", "when": [("at_or_above", {"series": "bb.mid"})], "min_pnl": params["bb_mid_min_pnl"],
+                      "reason": "BB Mid Touch Profit"})
+
+    return {
+        "name": name,
+        "version": version,
+        "min_bars": WARMUP_BARS,
+        "warmup": WARMUP_BARS,
+        "indicators": indicators,
+        "entries": entries,
+        "exits": exits,
+        "rescue": {"level": 0.0, "reason": "Rescue Exit (Breakeven)"},
+    }
+
+HYBRID_V1_SPEC = hybrid_spec("Hybrid v1", HYBRID_V1_PARAMS)
+HYBRID_V2_SPEC = hybrid_spec("Hybrid v2", HYBRID_V2_PARAMS)
+HYBRID_V3_SPEC = hybrid_spec("Hybrid v3 (2%)", HYBRID_V3_PARAMS)
+
+def compute_spec_indicators(df, spec, cache=None):
+    if cache is None: cache = INDICATOR_CACHE
+    fp = frame_fingerprint(df)
+    ind = {
+        "close": _read_only(df['close'].to_numpy(dtype=np.float64)),
+        "low": _read_only(df['low'].to_numpy(dtype=np.float64)),
+    }
+    for alias, (func_name, params, *timeframe) in spec["indicators"].items():
+        if timeframe:
+            out = cache.get(df, "htf", fp, func=func_name, interval=timeframe[0], **params)
+        else:
+            out = cache.get(df, func_name, fp, **params)
+        if len(out) == 1:
+            ind[alias] = next(iter(out.values()))
+        else:
+            for key, arr in out.items(): ind[f"{alias}.{key}"] = arr
+    return ind
+
+def _all_of(ind, predicates):
+    mask = None
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for name, kwargs in predicates:
+            m = PREDICATES[name](ind, **kwargs)
+            mask = m if mask is None else mask & m
+    return mask
+
+def compile_spec(spec, ind, warmup=None):
+    # 포지션과 무관한 조건을 전부 한 번에 배열로 계산
+    if warmup is None: warmup = spec.get("warmup", WARMUP_BARS)
+    n = len(ind["close"])
+    codes = np.zeros(n, dtype=np.int8)
+    if n > warmup:
+        # 우선순위 낮은 것부터 칠해서 높은 것이 덮어쓰게
+        for code in range(len(spec["entries"]), 0, -1):
+            codes[_all_of(ind, spec["entries"][code - 1]["when"])] = code
+        codes[:warmup] = 0
+
+    exit_masks = [_all_of(ind, rule["when"]) if rule["type"] == "signal" else None for rule in spec["exits"]]
+    return codes, exit_masks
+
+# 포지션 하나의 청산 봉을 찾을 때 한 번에 보는 봉 수 (못 찾으면 두 배씩 늘림)
+EXIT_SCAN_CHUNK = 64
+EXIT_SCAN_MAX_CHUNK = 1 << 16
+
+def _find_exit(close, entry_price, start, rules, exit_masks, rescue_level):
+    # 반환: (청산 봉, 규칙 번호 또는 -1=구조대), 청산 없으면 (-1, None)
+    n = len(close)
+    n_rules = len(rules)
+    armed = False
+    size = EXIT_SCAN_CHUNK
+    while start < n:
+        end = min(n, start + size)
+        with np.errstate(invalid='ignore'):
+            pnl = (close[start:end] - entry_price) / entry_price
+            first_rule = np.full(end - start, n_rules, dtype=np.int16)
+            for r in range(n_rules - 1, -1, -1):
+                kind, level, profit_only = rules[r]
+                if kind == 0: hit = pnl >= level
+                elif kind == 1: hit = pnl <= level
+                else:
+                    hit = exit_masks[r][start:end]
+                    if level is not None: hit = hit & (pnl > level)
+                first_rule[hit] = r
+
+            matched = first_rule < n_rules
+            arms = np.zeros(end - start, dtype=bool)
+            for r, (kind, _, profit_only) in enumerate(rules):
+                if profit_only: arms |= (first_rule == r) & ~(pnl > 0)
+            by_rule = matched & ~arms
+            armed_now = np.logical_or.accumulate(arms) | armed
+            rescue = armed_now & (pnl >= rescue_level) & ~by_rule if rescue_level is not None else np.zeros(end - start, dtype=bool)
+
+        hits = np.flatnonzero(by_rule | rescue)
+        if len(hits):
+            j = int(hits[0])
+            return start + j, (int(first_rule[j]) if by_rule[j] else -1)
+        armed = bool(armed_now[-1])
+        start = end
+        size = min(size * 2, EXIT_SCAN_MAX_CHUNK)
+    return -1, None
+
+def _exit_rules(spec):
+    # (종류, 기준값, 손실 시 구조대 여부): 0=익절 1=손절 2=신호
+    rules = []
+    for rule in spec["exits"]:
+        if rule["type"] == "take_profit": rules.append((0, rule["level"], False))
+        elif rule["type"] == "stop_loss": rules.append((1, -rule["level"], False))
+        else: rules.append((2, rule.get("min_pnl"), rule.get("profit_only", False)))
+    rescue = spec.get("rescue")
+    return rules, [rule["reason"] for rule in spec["exits"]], (rescue["level"] if rescue else None), (rescue["reason"] if rescue else None)
+
+def simulate_spec(spec, ind, index=None, warmup=None):
+    codes, exit_masks = compile_spec(spec, ind, warmup)
+    start = spec.get("warmup", WARMUP_BARS) if warmup is None else warmup
+    return simulate_compiled(spec, ind["close"], codes, exit_masks, index, start)
+
+def simulate_compiled(spec, close, codes, exit_masks, index=None, start=0):
+    # compile_spec 결과(전체 구간에서 한 번 계산)를 잘라서 구간별로 다시 돌릴 때도 쓰는 진입점
+    close = np.asarray(close, dtype=np.float64)
+    n = len(close)
+    if index is None: index = pd.RangeIndex(n)
+    entry_bars = np.flatnonzero(codes).tolist()
+    entry_reasons = [None] + [e["reason"] for e in spec["entries"]]
+    rules, exit_reasons_by_rule, rescue_level, rescue_reason = _exit_rules(spec)
+
+    close_l = close.tolist()
+    balance = INITIAL_BALANCE
     trades = []
-    equity_curve = [] 
-    
-    TARGET_PROFIT = 0.01 
-    STOP_LOSS = 0.10      
-    rescue_mode = False 
-    
-    for i in range(len(df)):
-        equity_curve.append({'time': df.index[i], 'balance': balance})
-        if i < 202: continue
-        
-        curr_close = df['close'].iloc[i]
-        prev_close = df['close'].iloc[i-1]
-        curr_time = str(df.index[i])
-        curr_rsi = df['RSI'].iloc[i]
-        bb1_lower = df['BB1_Lower'].iloc[i]
-        prev_bb1_lower = df['BB1_Lower'].iloc[i-1]
-        bb1_mid = df['BB1_Mid'].iloc[i]
-        sma_202 = df['SMA_202'].iloc[i]
-        
-        # Exit
-        if position == 'long':
-            pnl = (curr_close - entry_price) / entry_price
-            is_close = False; reason = ""
-            
-            if pnl >= TARGET_PROFIT:
-                is_close = True; reason = "Target 1% Reached"; rescue_mode = False 
-            elif pnl <= -STOP_LOSS:
-                is_close = True; reason = "Stop Loss (-10%)"; rescue_mode = False
-            elif curr_rsi >= 70:
-                if pnl > 0: is_close = True; reason = "RSI > 70 Profit"; rescue_mode = False
-                else: rescue_mode = True
-            elif curr_close >= bb1_mid and pnl > 0.005:
-                 is_close = True; reason = "BB Mid Touch Profit"; rescue_mode = False
-
-            if rescue_mode and pnl >= 0:
-                is_close = True; reason = "Rescue Exit (Breakeven)"; rescue_mode = False
-            
-            if is_close:
-                balance *= (1 + pnl)
-                trades.append({'time': curr_time, 'type': 'Exit', 'pnl': pnl, 'reason': reason, 'price': curr_close, 'balance': balance})
-                position = None
-                
-        # Entry
-        if position is None:
-            rsi_condition = (curr_rsi <= 30)
-            band_reversal = (prev_close < prev_bb1_lower) and (curr_close > bb1_lower)
-            w_pattern = check_double_bottom(df['low'], i)
-            dist_to_sma202 = (curr_close - sma_202) / sma_202
-            sma202_support = (dist_to_sma202 > 0) and (dist_to_sma202 < 0.015)
-            
-            entry_signal = False; entry_reason = ""
-            
-            if band_reversal and rsi_condition:
-                entry_signal = True; entry_reason = "Band Reversal + RSI <= 30"
-            elif w_pattern and rsi_condition:
-                entry_signal = True; entry_reason = "W-Pattern + RSI <= 30"
-            elif sma202_support and rsi_condition:
-                entry_signal = True; entry_reason = "202 SMA Support + RSI <= 30"
-
-            if entry_signal:
-                position = 'long'
-                entry_price = curr_close
-                trades.append({'time': curr_time, 'type': 'Entry', 'reason': entry_reason, 'price': curr_close, 'balance': balance})
-
-    total_exits = [t for t in trades if t['type'] == 'Exit']
-    win_trades = [t for t in total_exits if t['pnl'] > 0]
-    win_rate = (len(win_trades) / len(total_exits) * 100) if total_exits else 0
-    total_return = (balance - initial_balance) / initial_balance * 100
-    
+    entry_bars_taken = []
+    exit_bars = []
+    exit_balances = []
+    exit_pnls = []
+    exit_reasons = []
+    wins = 0
+
+    k = 0
+    i = start
+    while True:
+        # 다음 진입 봉으로 바로 이동 (청산 봉과 같은 봉에서도 진입 가능)
+        k = bisect_left(entry_bars, i, k)
+        if k >= len(entry_bars): break
+        i = entry_bars[k]
+        entry_price = close_l[i]
+        entry_bars_taken.append(i)
+        trades.append({'time': str(index[i]), 'type': 'Entry', 'reason': entry_reasons[int(codes[i])], 'price': entry_price, 'balance': balance})
+
+        j, rule = _find_exit(close, entry_price, i + 1, rules, exit_masks, rescue_level)
+        if j < 0: break
+
+        curr_close = close_l[j]
+        pnl = (curr_close - entry_price) / entry_price
+        reason = exit_reasons_by_rule[rule] if rule >= 0 else rescue_reason
+        balance *= (1 + pnl)
+        if pnl > 0: wins += 1
+        trades.append({'time': str(index[j]), 'type': 'Exit', 'pnl': pnl, 'reason': reason, 'price': curr_close, 'balance': balance})
+        exit_bars.append(j)
+        exit_balances.append(balance)
+        exit_pnls.append(pnl)
+        exit_reasons.append(reason)
+        i = j
+
+    equity_curve = EquityCurve.from_exits(index, exit_bars, exit_balances)
+
+    total_exits = len(exit_bars)
+    win_rate = (wins / total_exits * 100) if total_exits else 0
+    total_return = (balance - INITIAL_BALANCE) / INITIAL_BALANCE * 100
+
     return {
         "return": total_return,
         "win_rate": win_rate,
-        "trades": len(total_exits),
+        "trades": total_exits,
         "trade_history": trades,
         "equity_curve": equity_curve,
-        "last_price": df['close'].iloc[-1]
+        "trade_table": _trade_table(index, close, entry_bars_taken, exit_bars, exit_pnls, exit_reasons),
+        "last_price": close_l[-1] if n else None
     }
 
+def run_strategy_spec(spec, df, cache=None):
+    if df is None or df.empty or len(df) < spec.get("min_bars", WARMUP_BARS): return None
+    with profile_stage("indicators", bars=len(df)):
+        ind = compute_spec_indicators(df, spec, cache)
+    with profile_stage("simulation", bars=len(df)):
+        return simulate_spec(spec, ind, df.index)
+
+# --- 파라미터 딕셔너리 기반 진입점 (스윕/스트리밍과 같은 파라미터 형식) ---
+def simulate_hybrid(close, low, rsi, bb_lower, bb_mid, sma_202, index=None, params=HYBRID_V2_PARAMS, warmup=WARMUP_BARS, w_pattern=None):
+    if w_pattern is None and params["w_pattern"]: w_pattern = double_bottom_flags(low)
+    ind = {"close": close, "low": low, "rsi": rsi, "bb.lower": bb_lower, "bb.mid": bb_mid, "sma_202": sma_202, "w": w_pattern}
+    return simulate_spec(hybrid_spec("", params), ind, index, warmup)
+
+# --- [v1] 하일수 하이브리드 전략 (Basic) ---
+def run_hybrid_strategy_v1(df):
+    return run_strategy_spec(HYBRID_V1_SPEC, df)
+
+# --- [v2] 하일수 하이브리드 전략 (Optimized) ---
+def run_hybrid_strategy_v2(df):
+    return run_strategy_spec(HYBRID_V2_SPEC, df)
+
 # --- [v3] 하일수 하이브리드 전략 (Target 2%) ---
 def run_hybrid_strategy_v3(df):
-    if df is None or df.empty or len(df) < 202: return None
-    df = df.copy()
-    
-    df['RSI'] = ta.rsi(df['close'], length=14)
-    bb1 = ta.bbands(df['close'], length=20, std=2)
-    bbu1_col = [c for c in bb1.columns if c.startswith('BBU')][0]
-    bbl1_col = [c for c in bb1.columns if c.startswith('BBL')][0]
-    bbm1_col = [c for c in bb1.columns if c.startswith('BBM')][0]
-    
-    df['BB1_Upper'] = bb1[bbu1_col]
-    df['BB1_Lower'] = bb1[bbl1_col]
-    df['BB1_Mid'] = bb1[bbm1_col]
-    df['SMA_202'] = ta.sma(df['close'], length=202)
-
-    balance = 1000000
-    initial_balance = 1000000
-    position = None 
-    entry_price = 0
+    return run_strategy_spec(HYBRID_V3_SPEC, df)
+
+
+# --- 파라미터 스윕 (지표 1회 계산 + 파라미터 묶음 단위 동시 시뮬레이션) ---
+SWEEP_PARAM_NAMES = ["target_profit", "stop_loss", "rsi_entry", "rsi_exit", "sma202_band"]
+
+def get_fee_rate(source, category):
+    if source == 'upbit':
+        return FEE_RATES['upbit']
+    elif source == 'yahoo':
+        return FEE_RATES['yahoo_etf'] if category == 'ETF' else FEE_RATES['yahoo_future']
+    return 0.001 # 기본값
+
+def sweep_hybrid_params(df, grid, base_params=HYBRID_V2_PARAMS, fee_rate=FEE_RATES['upbit'], warmup=WARMUP_BARS):
+    # grid: {"target_profit": [...], "stop_loss": [...], ...} 의 모든 조합을 평가
+    if df is None or df.empty or len(df) <= warmup: return pd.DataFrame()
+    names = [k for k in SWEEP_PARAM_NAMES if k in grid]
+    unknown = set(grid) - set(SWEEP_PARAM_NAMES)
+    if unknown: raise ValueError(f"스윕할 수 없는 파라미터: {sorted(unknown)}")
+
+    combos = list(itertools.product(*[grid[k] for k in names]))
+    P = len(combos)
+    cols = {k: np.array([c[j] for c in combos], dtype=np.float64) for j, k in enumerate(names)}
+    p = {k: cols[k] if k in cols else np.full(P, float(base_params[k])) for k in SWEEP_PARAM_NAMES}
+
+    ind = compute_hybrid_indicators(df)
+    close, rsi, bb_lower, bb_mid, sma_202 = ind['close'], ind['rsi'], ind['bb_lower'], ind['bb_mid'], ind['sma_202']
+    n = len(close)
+
+    # 파라미터와 무관한 조건은 봉 단위로 한 번만
+    with np.errstate(invalid='ignore', divide='ignore'):
+        band_reversal = np.zeros(n, dtype=bool)
+        band_reversal[1:] = (close[:-1] < bb_lower[:-1]) & (close[1:] > bb_lower[1:])
+        w_pattern = ind['w_pattern'] if base_params["w_pattern"] else np.zeros(n, dtype=bool)
+        dist_to_sma202 = (close - sma_202) / sma_202
+        if not base_params["sma202_support"]: dist_to_sma202[:] = np.nan
+
+        # 어떤 파라미터로도 진입이 불가능한 봉은 포지션이 없으면 건너뛴다
+        max_entry = p["rsi_entry"].max()
+        rsi_maybe = (rsi <= max_entry) if base_params["rsi_entry_inclusive"] else (rsi < max_entry)
+        entry_maybe = rsi_maybe & (band_reversal | w_pattern | ((dist_to_sma202 > 0) & (dist_to_sma202 < p["sma202_band"].max())))
+
+    rsi_entry_inclusive = base_params["rsi_entry_inclusive"]
+    rsi_exit_inclusive = base_params["rsi_exit_inclusive"]
+    bb_mid_exit = base_params["bb_mid_exit"]
+    BB_MID_MIN_PNL = base_params["bb_mid_min_pnl"]
+    fee_factor = (1 - fee_rate) ** 2
+
+    in_pos = np.zeros(P, dtype=bool)
+    rescue = np.zeros(P, dtype=bool)
+    entry_price = np.ones(P)
+    balance = np.full(P, float(INITIAL_BALANCE))
+    balance_fee = np.full(P, float(INITIAL_BALANCE))
+    trades = np.zeros(P, dtype=np.int64)
+    wins = np.zeros(P, dtype=np.int64)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for i in range(warmup, n):
+            any_pos = in_pos.any()
+            if not any_pos and not entry_maybe[i]: continue
+            curr_close = close[i]; curr_rsi = rsi[i]
+
+            # Exit (simulate_hybrid 와 같은 우선순위: 목표 → 손절 → RSI → BB 중단 → 구조대)
+            if any_pos:
+                pnl = (curr_close - entry_price) / entry_price
+                target = in_pos & (pnl >= p["target_profit"])
+                stop = in_pos & ~target & (pnl <= -p["stop_loss"])
+                rsi_hit = (curr_rsi >= p["rsi_exit"]) if rsi_exit_inclusive else (curr_rsi > p["rsi_exit"])
+                rsi_hit = in_pos & ~target & ~stop & rsi_hit
+                rsi_profit = rsi_hit & (pnl > 0)
+                closing = target | stop | rsi_profit
+                if bb_mid_exit and curr_close >= bb_mid[i]:
+                    closing |= in_pos & ~target & ~stop & ~rsi_hit & (pnl > BB_MID_MIN_PNL)
+
+                rescue = np.where(closing, False, rescue | rsi_hit)
+                exits = closing | (rescue & (pnl >= 0))
+                if exits.any():
+                    growth = 1 + pnl[exits]
+                    balance[exits] *= growth
+                    balance_fee[exits] *= growth * fee_factor
+                    trades += exits
+                    wins += exits & (pnl > 0)
+                    in_pos &= ~exits
+                    rescue &= ~exits
+
+            # Entry (청산한 봉에서도 진입 가능)
+            if entry_maybe[i]:
+                rsi_ok = (curr_rsi <= p["rsi_entry"]) if rsi_entry_inclusive else (curr_rsi < p["rsi_entry"])
+                signal = band_reversal[i] | w_pattern[i] | ((dist_to_sma202[i] > 0) & (dist_to_sma202[i] < p["sma202_band"]))
+                entries = ~in_pos & rsi_ok & signal
+                if entries.any():
+                    in_pos |= entries
+                    entry_price[entries] = curr_close
+
+    result = pd.DataFrame({k: p[k] for k in SWEEP_PARAM_NAMES})
+    result["return"] = (balance - INITIAL_BALANCE) / INITIAL_BALANCE * 100
+    result["return_fee"] = (balance_fee - INITIAL_BALANCE) / INITIAL_BALANCE * 100
+    result["win_rate"] = np.where(trades > 0, wins / np.maximum(trades, 1) * 100, 0)
+    result["trades"] = trades
+    return result.sort_values("return_fee", ascending=False, kind="stable").reset_index(drop=True)
+
+# --- 프로세스 풀 ---
+# fork 는 다른 스레드(I/O 풀, streamlit)가 잡고 있던 잠금(requests 세션, 토큰 버킷, 저장소)까지 그대로 복사한다
+# → 스레드가 없는 forkserver(없으면 spawn) 프로세스에서 작업자를 만든다
+POOL_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+def process_pool(max_workers):
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(POOL_START_METHOD))
+
+# --- 워크포워드 (지표/신호는 전체 구간에서 한 번 계산, 구간별로 잘라서 병렬 평가) ---
+WALK_FORWARD_COLUMNS = ['window', 'strategy', 'segment', 'start', 'end', 'bars', 'trades', 'win_rate', 'return', 'return_fee', 'max_drawdown']
+
+def walk_forward_windows(n_bars, train_bars, test_bars, step=None, anchored=False, warmup=WARMUP_BARS):
+    # rolling: 학습 구간 길이 고정으로 step 씩 이동 / anchored: 학습 시작은 고정, 끝만 step 씩 늘어남
+    if step is None: step = test_bars
+    if test_bars <= 0 or step <= 0 or train_bars < 0:
+        raise ValueError("test_bars, step 은 1 이상, train_bars 는 0 이상이어야 합니다")
+    windows = []
+    k = 0
+    while True:
+        train_start = warmup if anchored else warmup + k * step
+        train_end = warmup + train_bars + k * step
+        test_end = train_end + test_bars
+        if test_end > n_bars: break
+        windows.append({"window": k, "train_start": train_start, "train_end": train_end,
+                        "test_start": train_end, "test_end": test_end})
+        k += 1
+    return windows
+
+def param_grid_specs(grid, base_params=HYBRID_V2_PARAMS, name="Hybrid"):
+    # 파라미터 조합마다 하이브리드 명세 하나 (워크포워드 후보 목록용)
+    names = list(grid)
+    specs = []
+    for combo in itertools.product(*[grid[k] for k in names]):
+        label = ", ".join(f"{k}={v}" for k, v in zip(names, combo))
+        specs.append(hybrid_spec(f"{name} ({label})", {**base_params, **dict(zip(names, combo))}))
+    return specs
+
+def _segment_stats(res, fee_rate):
+    pnls = res["trade_table"]["pnl"].dropna().to_numpy(dtype=np.float64)
+    trades = len(pnls)
+    growth_fee = np.cumprod((1 + pnls) * (1 - fee_rate) ** 2)
+    path = np.r_[1.0, growth_fee]
+    drawdown = 1 - path / np.maximum.accumulate(path)
+    return {
+        "trades": trades,
+        "win_rate": (pnls > 0).sum() / trades * 100 if trades else 0,
+        "return": res["return"],
+        "return_fee": (growth_fee[-1] - 1) * 100 if trades else 0.0,
+        "max_drawdown": drawdown.max() * 100,
+    }
+
+def _walk_forward_task(window, offset, close, index, compiled, fee_rate):
+    # 프로세스 풀 작업 단위: 한 구간(학습+검증)에 필요한 만큼만 잘라 받은 배열로 모든 후보 평가
+    rows = []
+    segments = (("train", window["train_start"], window["train_end"]), ("test", window["test_start"], window["test_end"]))
+    for segment, a, b in segments:
+        if b <= a: continue
+        sl = slice(a - offset, b - offset)
+        for spec, codes, exit_masks in compiled:
+            masks = [m[sl] if m is not None else None for m in exit_masks]
+            res = simulate_compiled(spec, close[sl], codes[sl], masks, index[sl], 0)
+            rows.append({"window": window["window"], "strategy": spec["name"], "segment": segment,
+                         "start": index[a - offset], "end": index[b - offset - 1], "bars": b - a,
+                         **_segment_stats(res, fee_rate)})
+    return rows
+
+def _walk_forward_shared(window, desc, specs, fee_rate):
+    # 공유 메모리 판: 전체 배열을 한 번만 올려 두고 구간마다 필요한 부분만 뷰로 잘라 쓴다
+    arrays = d1_arena.attach(desc)
+    lo, hi = window["train_start"], window["test_end"]
+    compiled = [(spec, arrays[f"codes.{i}"][lo:hi],
+                 [arrays[f"mask.{i}.{j}"][lo:hi] if f"mask.{i}.{j}" in arrays else None for j in range(len(spec["exits"]))])
+                for i, spec in enumerate(specs)]
+    index = d1_arena.index_view(arrays["ts"][lo:hi], desc["meta"])
+    return _walk_forward_task(window, lo, arrays["close"][lo:hi], index, compiled, fee_rate)
+
+def walk_forward(df, strategies=None, train_bars=2000, test_bars=500, step=None, anchored=False,
+                 fee_rate=FEE_RATES['upbit'], cpu_workers=None, select_by="return_fee", progress_callback=None):
+    # 반환: {"windows": 구간×전략×(train/test) 성과, "selected": 구간별 학습 성과 1위의 검증 성과, "summary": 전략별 검증 집계}
+    if strategies is None: strategies = STRATEGIES
+    if any("func" in s for s in strategies):
+        raise ValueError("워크포워드는 전략 명세(spec)만 지원합니다")
+    empty = {"windows": pd.DataFrame(columns=WALK_FORWARD_COLUMNS), "selected": pd.DataFrame(columns=WALK_FORWARD_COLUMNS),
+             "summary": pd.DataFrame()}
+    if df is None or df.empty: return empty
+
+    warmup = max(s.get("warmup", WARMUP_BARS) for s in strategies)
+    windows = walk_forward_windows(len(df), train_bars, test_bars, step, anchored, warmup)
+    if not windows: return empty
+
+    # 지표와 상태 없는 신호는 전체 구간에서 한 번만 (구간 경계의 직전 봉 참조도 그대로 유지)
+    close = compute_spec_indicators(df, strategies[0])["close"]
+    compiled = []
+    for spec in strategies:
+        codes, exit_masks = compile_spec(spec, compute_spec_indicators(df, spec))
+        compiled.append((spec, codes, exit_masks))
+
+    def task_args(w):
+        lo, hi = w["train_start"], w["test_end"]
+        sliced = [(spec, codes[lo:hi], [m[lo:hi] if m is not None else None for m in masks]) for spec, codes, masks in compiled]
+        return w, lo, close[lo:hi], df.index[lo:hi], sliced, fee_rate
+
+    rows = []
+    if cpu_workers is None: cpu_workers = max((os.cpu_count() or 1) - 1, 0)
+    if cpu_workers > 0:
+        # 구간이 겹치므로 잘라서 보내면 같은 봉이 여러 번 피클/복사된다 → 공유 메모리에 한 번만
+        arrays = {"ts": d1_store._to_ns(df.index), "close": close}
+        for i, (spec, codes, masks) in enumerate(compiled):
+            arrays[f"codes.{i}"] = codes
+            arrays.update({f"mask.{i}.{j}": m for j, m in enumerate(masks) if m is not None})
+        tz = df.index.tz
+        with d1_arena.SharedArena() as arena, process_pool(cpu_workers) as pool:
+            desc = arena.put_arrays(arrays, {"tz": str(tz) if tz is not None else None, "index_name": df.index.name})
+            specs = [spec for spec, _, _ in compiled]
+            futures = [pool.submit(_walk_forward_shared, w, desc, specs, fee_rate) for w in windows]
+            for done, fut in enumerate(futures, 1):
+                rows.extend(fut.result())
+                if progress_callback: progress_callback(done, len(windows), f"구간 {done}/{len(windows)} 완료")
+    else:
+        for done, w in enumerate(windows, 1):
+            rows.extend(_walk_forward_task(*task_args(w)))
+            if progress_callback: progress_callback(done, len(windows), f"구간 {done}/{len(windows)} 완료")
+
+    result = pd.DataFrame(rows, columns=WALK_FORWARD_COLUMNS)
+    test = result[result['segment'] == 'test']
+
+    # 학습 구간 성과가 가장 좋은 후보를 골라 바로 다음 검증 구간 성과로 평가
+    train = result[result['segment'] == 'train']
+    if not train.empty:
+        best = train.sort_values(['window', select_by], ascending=[True, False], kind="stable").groupby('window').head(1)
+        selected = test.merge(best[['window', 'strategy']], on=['window', 'strategy'])
+    else:
+        selected = test.iloc[0:0]
+
+    def summarize(group):
+        r = group['return_fee'].to_numpy()
+        return pd.Series({
+            "windows": len(group),
+            "trades": int(group['trades'].sum()),
+            "mean_return_fee": r.mean() if len(r) else np.nan,
+            "median_return_fee": np.median(r) if len(r) else np.nan,
+            "worst_return_fee": r.min() if len(r) else np.nan,
+            "positive_windows": (r > 0).mean() * 100 if len(r) else np.nan,
+            "compounded_return_fee": (np.prod(1 + r / 100) - 1) * 100,
+            "max_drawdown": group['max_drawdown'].max(),
+        })
+
+    # groupby.apply(include_groups=False) 는 pandas 2.2 이상에서만 → 그룹을 직접 돌면서 요약
+    summary = pd.DataFrame([summarize(group).rename(name) for name, group in test.groupby('strategy', sort=False)])
+    summary = summary.rename_axis('strategy').reset_index()
+    if not selected.empty:
+        summary = pd.concat([summary, summarize(selected).to_frame().T.assign(strategy="Walk-forward (학습 1위 선택)")],
+                            ignore_index=True)
+    if not summary.empty: summary[['windows', 'trades']] = summary[['windows', 'trades']].astype(int)
+    return {"windows": result, "selected": selected.reset_index(drop=True), "summary": summary}
+
+# --- 포트폴리오 (여러 자산을 한 계좌 잔고로, 합집합 시간축의 자산×시간 행렬 위에서) ---
+PORTFOLIO_TRADE_COLUMNS = ['asset', 'entry_ts', 'exit_ts', 'entry_price', 'exit_price', 'allocation', 'units',
+                           'pnl', 'pnl_krw', 'reason']
+PORTFOLIO_TZ = "Asia/Seoul"
+
+def _utc_ns(index):
+    # 업비트(naive KST 벽시계)와 야후(tz 포함)를 같은 UTC 시각 축으로
+    index = pd.DatetimeIndex(index)
+    if index.tz is None: index = index.tz_localize(PORTFOLIO_TZ)
+    return index.tz_convert("UTC").as_unit("ns").asi8
+
+def _ffill_columns(mat):
+    # 자산별로 마지막 봉 가격을 이후 시각에 이어 붙인다 (첫 봉 이전은 NaN 유지)
+    valid = ~np.isnan(mat)
+    idx = np.where(valid, np.arange(mat.shape[1]), 0)
+    np.maximum.accumulate(idx, axis=1, out=idx)
+    out = mat[np.arange(mat.shape[0])[:, None], idx]
+    out[np.cumsum(valid, axis=1) == 0] = np.nan
+    return out
+
+def simulate_portfolio(frames, spec=HYBRID_V2_SPEC, initial_balance=INITIAL_BALANCE, sizing=None, fee_rates=None):
+    # frames: {자산 이름: OHLCV df}, fee_rates: {자산 이름: 편도 수수료율}
+    # sizing: {"mode": "equal" (평가금/max_positions) | "fraction" (평가금×fraction) | "fixed" (amount 원),
+    #          "max_positions": 동시 보유 한도, "fraction": ..., "amount": ...}
+    sizing = {"mode": "equal", **(sizing or {})}
+    fee_rates = fee_rates or {}
+    names = [name for name, df in frames.items()
+             if df is not None and not df.empty and len(df) >= spec.get("min_bars", WARMUP_BARS)]
+    A = len(names)
+    max_positions = sizing.get("max_positions") or max(A, 1)
+    rules, exit_reason_by_rule, rescue_level, rescue_reason = _exit_rules(spec)
+
+    # 자산별 신호는 각자의 봉으로 계산 (지표는 자산마다 자기 시계열 기준)
+    assets = []
+    for name in names:
+        df = frames[name]
+        ind = compute_spec_indicators(df, spec)
+        codes, exit_masks = compile_spec(spec, ind)
+        assets.append({"close": np.asarray(ind["close"], dtype=np.float64), "codes": codes, "masks": exit_masks,
+                       "ts": _utc_ns(df.index), "fee": fee_rates.get(name, 0.0)})
+
+    union = np.unique(np.concatenate([a["ts"] for a in assets])) if assets else np.empty(0, dtype=np.int64)
+    T = len(union)
+    close_mat = np.full((A, T), np.nan)
+    entry_mat = np.zeros((A, T), dtype=np.int8)
+    for k, a in enumerate(assets):
+        a["col"] = np.searchsorted(union, a["ts"])
+        close_mat[k, a["col"]] = a["close"]
+        entry_mat[k, a["col"]] = a["codes"]
+    price_mat = _ffill_columns(close_mat)
+
+    # 이벤트 루프: 신호가 있는 시각과 청산 시각만 방문 (청산을 먼저 처리해 같은 시각 재진입 허용)
+    signal_cols = np.flatnonzero(entry_mat.any(axis=0)).tolist()
+    exits = []  # heap: (청산 열, 자산)
+    holding = np.zeros(A, dtype=bool)
+    units = np.zeros(A)
+    open_trade = [None] * A
+    cash = float(initial_balance)
     trades = []
-    equity_curve = [] 
-    
-    TARGET_PROFIT = 0.02 # 목표 수익률 2%로 상향
-    STOP_LOSS = 0.10      
-    rescue_mode = False 
-    
-    for i in range(len(df)):
-        equity_curve.append({'time': df.index[i], 'balance': balance})
-        if i < 202: continue
-        
-        curr_close = df['close'].iloc[i]
-        prev_close = df['close'].iloc[i-1]
-        curr_time = str(df.index[i])
-        curr_rsi = df['RSI'].iloc[i]
-        bb1_lower = df['BB1_Lower'].iloc[i]
-        prev_bb1_lower = df['BB1_Lower'].iloc[i-1]
-        bb1_mid = df['BB1_Mid'].iloc[i]
-        sma_202 = df['SMA_202'].iloc[i]
-        
-        # Exit
-        if position == 'long':
-            pnl = (curr_close - entry_price) / entry_price
-            is_close = False; reason = ""
-            
-            if pnl >= TARGET_PROFIT:
-                is_close = True; reason = "Target 2% Reached"; rescue_mode = False 
-            elif pnl <= -STOP_LOSS:
-                is_close = True; reason = "Stop Loss (-10%)"; rescue_mode = False
-            elif curr_rsi >= 70:
-                if pnl > 0: is_close = True; reason = "RSI > 70 Profit"; rescue_mode = False
-                else: rescue_mode = True
-            elif curr_close >= bb1_mid and pnl > 0.005:
-                 is_close = True; reason = "BB Mid Touch Profit"; rescue_mode = False
-
-            if rescue_mode and pnl >= 0:
-                is_close = True; reason = "Rescue Exit (Breakeven)"; rescue_mode = False
-            
-            if is_close:
-                balance *= (1 + pnl)
-                trades.append({'time': curr_time, 'type': 'Exit', 'pnl': pnl, 'reason': reason, 'price': curr_close, 'balance': balance})
-                position = None
-                
-        # Entry
-        if position is None:
-            rsi_condition = (curr_rsi <= 30)
-            band_reversal = (prev_close < prev_bb1_lower) and (curr_close > bb1_lower)
-            w_pattern = check_double_bottom(df['low'], i)
-            dist_to_sma202 = (curr_close - sma_202) / sma_202
-            sma202_support = (dist_to_sma202 > 0) and (dist_to_sma202 < 0.015)
-            
-            entry_signal = False; entry_reason = ""
-            
-            if band_reversal and rsi_condition:
-                entry_signal = True; entry_reason = "Band Reversal + RSI <= 30"
-            elif w_pattern and rsi_condition:
-                entry_signal = True; entry_reason = "W-Pattern + RSI <= 30"
-            elif sma202_support and rsi_condition:
-                entry_signal = True; entry_reason = "202 SMA Support + RSI <= 30"
-
-            if entry_signal:
-                position = 'long'
-                entry_price = curr_close
-                trades.append({'time': curr_time, 'type': 'Entry', 'reason': entry_reason, 'price': curr_close, 'balance': balance})
-
-    total_exits = [t for t in trades if t['type'] == 'Exit']
-    win_trades = [t for t in total_exits if t['pnl'] > 0]
-    win_rate = (len(win_trades) / len(total_exits) * 100) if total_exits else 0
-    total_return = (balance - initial_balance) / initial_balance * 100
-    
+    unit_delta = np.zeros((A, T + 1))
+    cash_delta = np.zeros(T + 1)
+    skipped = 0
+
+    def close_position(k, col, bar, rule):
+        nonlocal cash
+        a = assets[k]
+        t = open_trade[k]
+        exit_price = a["close"][bar]
+        proceeds = t["units"] * exit_price * (1 - a["fee"])
+        cash += proceeds
+        cash_delta[col] += proceeds
+        unit_delta[k, col] -= t["units"]
+        trades.append({**t, "exit_col": col, "exit_price": exit_price, "pnl": (exit_price - t["entry_price"]) / t["entry_price"],
+                       "pnl_krw": proceeds - t["allocation"],
+                       "reason": exit_reason_by_rule[rule] if rule >= 0 else rescue_reason})
+        holding[k] = False
+        units[k] = 0.0
+        open_trade[k] = None
+
+    s = 0
+    while s < len(signal_cols) or exits:
+        col = min(signal_cols[s] if s < len(signal_cols) else T, exits[0][0] if exits else T)
+        while exits and exits[0][0] == col:
+            _, k, bar, rule = heapq.heappop(exits)
+            close_position(k, col, bar, rule)
+        if s < len(signal_cols) and signal_cols[s] == col:
+            s += 1
+            codes_t = entry_mat[:, col]
+            candidates = np.flatnonzero((codes_t > 0) & ~holding)
+            # 진입 우선순위(명세 entries 순서) → 자산 순서
+            candidates = candidates[np.argsort(codes_t[candidates], kind="stable")]
+            prices = price_mat[:, col]
+            equity = cash + np.nansum(units[holding] * prices[holding])
+            for k in candidates.tolist():
+                if holding.sum() >= max_positions:
+                    skipped += 1
+                    continue
+                if sizing["mode"] == "fraction": alloc = equity * sizing.get("fraction", 0.1)
+                elif sizing["mode"] == "fixed": alloc = sizing["amount"]
+                else: alloc = equity / max_positions
+                alloc = min(alloc, cash)
+                if alloc <= 0:
+                    skipped += 1
+                    continue
+                a = assets[k]
+                bar = int(np.searchsorted(a["col"], col))
+                entry_price = a["close"][bar]
+                u = alloc * (1 - a["fee"]) / entry_price
+                cash -= alloc
+                cash_delta[col] -= alloc
+                unit_delta[k, col] += u
+                holding[k] = True
+                units[k] = u
+                open_trade[k] = {"asset": names[k], "entry_col": col, "entry_price": entry_price, "allocation": alloc, "units": u}
+                j, rule = _find_exit(a["close"], entry_price, bar + 1, rules, a["masks"], rescue_level)
+                if j >= 0: heapq.heappush(exits, (int(a["col"][j]), k, j, rule))
+
+    # 자산 곡선: 보유 수량 행렬 × 가격 행렬 + 현금 (전 구간 배열 연산)
+    units_mat = np.cumsum(unit_delta[:, :T], axis=1)
+    invested = np.nansum(units_mat * price_mat, axis=0)
+    cash_curve = initial_balance + np.cumsum(cash_delta[:T])
+    equity_curve = cash_curve + invested
+    times = pd.DatetimeIndex(union, tz="UTC").tz_convert(PORTFOLIO_TZ)
+    equity = pd.DataFrame({"equity": equity_curve, "cash": cash_curve, "invested": invested,
+                           "positions": (units_mat > 0).sum(axis=0)}, index=times)
+
+    for k in np.flatnonzero(holding).tolist():
+        t = open_trade[k]
+        trades.append({**t, "exit_col": -1, "exit_price": np.nan, "pnl": np.nan, "pnl_krw": np.nan, "reason": None})
+    trade_table = pd.DataFrame(trades)
+    if trade_table.empty:
+        trade_table = pd.DataFrame(columns=PORTFOLIO_TRADE_COLUMNS)
+    else:
+        trade_table['entry_ts'] = times[trade_table['entry_col'].to_numpy()]
+        exit_cols = trade_table['exit_col'].to_numpy()
+        trade_table['exit_ts'] = pd.DatetimeIndex(np.where(exit_cols >= 0, union[np.maximum(exit_cols, 0)], np.iinfo(np.int64).min)
+                                                  .view("M8[ns]"), tz="UTC").tz_convert(PORTFOLIO_TZ)
+        trade_table = trade_table.sort_values(['entry_col', 'asset'], kind="stable", ignore_index=True)[PORTFOLIO_TRADE_COLUMNS]
+
+    final = equity_curve[-1] if T else float(initial_balance)
+    peak = np.maximum.accumulate(equity_curve) if T else np.empty(0)
+    closed = trade_table['pnl'].dropna()
     return {
-        "return": total_return,
-        "win_rate": win_rate,
-        "trades": len(total_exits),
-        "trade_history": trades,
-        "equity_curve": equity_curve,
-        "last_price": df['close'].iloc[-1]
+        "return": (final - initial_balance) / initial_balance * 100,
+        "final_balance": final,
+        "max_drawdown": ((1 - equity_curve / peak).max() * 100) if T else 0.0,
+        "trades": len(closed),
+        "win_rate": (closed > 0).mean() * 100 if len(closed) else 0,
+        "skipped_signals": skipped,
+        "exposure": (invested / equity_curve).mean() * 100 if T else 0.0,
+        "equity": equity,
+        "trade_table": trade_table,
     }
 
-def get_d1_analysis(progress_callback=None):
+def run_portfolio(interval="5분", spec=HYBRID_V2_SPEC, assets=None, sizing=None, initial_balance=INITIAL_BALANCE, refresh=True):
+    # ASSET_LIST 전체를 한 계좌로 (자산별 수수료율은 get_fee_rate 기준)
+    if assets is None: assets = ASSET_LIST
+    frames, errors = get_data_bulk([(a['ticker'], a['source'], interval) for a in assets], refresh=refresh)
+    for (ticker, _), msg in errors.items():
+        print(f"Error fetching {ticker}: {msg}")
+    return simulate_portfolio({a['name']: frames[(a['ticker'], interval)] for a in assets}, spec, initial_balance, sizing,
+                              {a['name']: get_fee_rate(a['source'], a['category']) for a in assets})
+
+# --- 유니버스 스크리너 (전체 KRW 마켓의 최근 봉만으로 진입 조건을 한 번에 판정) ---
+# 시장별 최근 봉을 오른쪽 정렬한 (시간 × 마켓) 행렬을 만들고, 명세의 진입 조건을 마지막 두 봉(교차 판정용)에 대해서만 계산
+SCREEN_BARS = 400        # 마켓당 읽는 봉 수 (SMA-202 + RSI 가 충분히 수렴할 만큼)
+SCREEN_TAIL = 2          # 판정에 쓰는 마지막 봉 수 (직전 봉 → 이번 봉 교차)
+SCREEN_STALE = pd.Timedelta(hours=1)  # 가장 최근 봉보다 이만큼 오래된 마켓은 거래 정지/상폐로 보고 제외
+SCREEN_COLUMNS = ['ticker', 'reason', 'rank', 'rsi', 'close', 'bb_lower', 'sma_202', 'value_24h', 'last_time', 'bars']
+
+def _windows(x, length, tail):
+    # 마지막 tail 봉 각각의 길이 length 창: (tail, 마켓, length)
+    return np.lib.stride_tricks.sliding_window_view(x[-(length + tail - 1):], length, axis=0)
+
+def _screen_sma(close, low, tail, length=202):
+    return {"sma": _windows(close, length, tail).mean(axis=-1)}  # 창에 NaN 이 있으면 NaN (min_periods=length)
+
+def _screen_bbands(close, low, tail, length=20, std=2):
+    w = _windows(close, length, tail)
+    mid = w.mean(axis=-1)
+    dev = w.std(axis=-1)  # ddof=0 (pandas_ta bbands 와 같음)
+    return {"upper": mid + std * dev, "lower": mid - std * dev, "mid": mid}
+
+def _screen_rsi(close, low, tail, length=14):
+    # pandas_ta rsi = ewm(alpha=1/length, adjust=True) 평균: 봉 t 의 값은 t 까지 관측값의 (1-alpha)^(t-i) 가중 평균
+    diff = np.full(close.shape, np.nan)
+    diff[1:] = close[1:] - close[:-1]
+    pos = np.where(diff < 0, 0.0, diff)
+    neg = np.where(diff > 0, 0.0, diff)
+    obs = ~np.isnan(diff)
+    T = len(close)
+    out = np.full((tail, close.shape[1]), np.nan)
+    for r, t in enumerate(range(T - tail, T)):
+        w = (1 - 1.0 / length) ** np.arange(t, -1, -1, dtype=np.float64)
+        wsum = w @ obs[:t + 1]
+        pos_avg = w @ np.nan_to_num(pos[:t + 1]) / wsum
+        neg_avg = w @ np.nan_to_num(neg[:t + 1]) / wsum
+        denom = pos_avg + np.abs(neg_avg)
+        rsi = np.where(denom != 0, 100 * pos_avg / np.where(denom != 0, denom, 1), np.nan)
+        rsi[obs[:t + 1].sum(axis=0) < length] = np.nan
+        out[r] = rsi
+    return {"rsi": out}
+
+def _screen_double_bottom(close, low, tail, window=20, tolerance=0.005):
+    # double_bottom_flags 와 같은 판정을 마지막 tail 봉 × 전체 마켓에 대해
+    cur = low[-tail:]
+    flags = np.zeros(cur.shape, dtype=bool)
+    middle_high = np.full(cur.shape, np.nan)
+    pending = np.ones(cur.shape, dtype=bool)
+    T = len(low)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for k in range(1, window + 1):
+            past = low[T - tail - k:T - k]
+            middle_high = np.fmax(middle_high, past)
+            hit = pending & (np.abs(past - cur) / cur <= tolerance)
+            flags[hit] = middle_high[hit] > cur[hit] * 1.005
+            pending &= ~hit
+    return {"flags": flags}
+
+SCREEN_FUNCS = {
+    "rsi": _screen_rsi,
+    "bbands": _screen_bbands,
+    "sma": _screen_sma,
+    "double_bottom": _screen_double_bottom,
+}
+
+def screen_frames(frames, spec=HYBRID_V2_SPEC, bars=SCREEN_BARS, stale=SCREEN_STALE):
+    # frames: {ticker: OHLCV df} → 마지막 봉에서 진입 조건이 맞는 마켓 (진입 우선순위 → RSI 낮은 순 → 거래대금 큰 순)
+    min_bars = max(spec.get("min_bars", WARMUP_BARS), spec.get("warmup", WARMUP_BARS) + 1)  # compile_spec 과 같은 웜업
+    names = [t for t, df in frames.items() if df is not None and len(df) >= min_bars]
+    if not names:
+        return pd.DataFrame(columns=SCREEN_COLUMNS)
+    last_times = pd.DatetimeIndex([frames[t].index[-1] for t in names])
+    fresh = last_times >= last_times.max() - stale
+    names = [t for t, ok in zip(names, fresh) if ok]
+    last_times = last_times[fresh]
+
+    # 오른쪽 정렬 행렬 (짧은 마켓은 앞쪽이 NaN)
+    M = len(names)
+    T = max(min(bars, max(len(frames[t]) for t in names)), min_bars)
+    close = np.full((T, M), np.nan)
+    low = np.full((T, M), np.nan)
+    value = np.zeros(M)
+    for m, t in enumerate(names):
+        df = frames[t].iloc[-T:]
+        close[T - len(df):, m] = df['close'].to_numpy(dtype=np.float64)
+        low[T - len(df):, m] = df['low'].to_numpy(dtype=np.float64)
+        if 'value' in df.columns:
+            recent = df['value'][df.index > df.index[-1] - pd.Timedelta(days=1)]
+            value[m] = float(np.nansum(recent.to_numpy(dtype=np.float64)))
+
+    with profile_stage("screen", bars=T * M):
+        ind = {"close": close[-SCREEN_TAIL:], "low": low[-SCREEN_TAIL:]}
+        for alias, (func_name, params, *timeframe) in spec["indicators"].items():
+            if timeframe or func_name not in SCREEN_FUNCS:
+                raise ValueError(f"스크리너에서 지원하지 않는 지표: {alias}")
+            out = SCREEN_FUNCS[func_name](close, low, SCREEN_TAIL, **params)
+            if len(out) == 1:
+                ind[alias] = next(iter(out.values()))
+            else:
+                for key, arr in out.items(): ind[f"{alias}.{key}"] = arr
+
+        # 우선순위 낮은 것부터 칠해서 높은 것이 덮어쓰게 (compile_spec 과 같은 규칙)
+        codes = np.zeros(M, dtype=np.int8)
+        for code in range(len(spec["entries"]), 0, -1):
+            codes[_all_of(ind, spec["entries"][code - 1]["when"])[-1]] = code
+
+    hit = np.flatnonzero(codes)
+    rsi = ind["rsi"][-1] if "rsi" in ind else np.full(M, np.nan)
+    table = pd.DataFrame({
+        'ticker': [names[m] for m in hit],
+        'reason': [spec["entries"][codes[m] - 1]["reason"] for m in hit],
+        'code': codes[hit],
+        'rsi': rsi[hit],
+        'close': close[-1, hit],
+        'bb_lower': ind["bb.lower"][-1, hit] if "bb.lower" in ind else np.nan,
+        'sma_202': ind["sma_202"][-1, hit] if "sma_202" in ind else np.nan,
+        'value_24h': value[hit],
+        'last_time': last_times[hit],
+        'bars': [len(frames[names[m]]) for m in hit],
+    })
+    table = table.sort_values(['code', 'rsi', 'value_24h'], ascending=[True, True, False], kind="stable", ignore_index=True)
+    table['rank'] = np.arange(1, len(table) + 1)
+    return table[SCREEN_COLUMNS]
+
+def screen_upbit(interval="5분", spec=HYBRID_V2_SPEC, bars=SCREEN_BARS, top=20, refresh=True, backtest=True,
+                 client=None, max_workers=8, progress_callback=None):
+    # 1) KRW 마켓 전체의 최근 봉만 갱신/읽기 2) 한 번에 판정 3) 상위 top 개만 저장된 전체 봉으로 백테스트
+    # 반환: (순위표, 후보 백테스트 결과 목록)
+    if client is None: client = UPBIT_CLIENT
+    tickers = client.get_markets("KRW")
+    base = source_interval(interval, "upbit")
+
+    if refresh:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(_refresh_upbit, client, t, base, bars * INTERVAL_DELTAS[interval]) for t in tickers]
+            for k, fut in enumerate(futures):
+                for (ticker, _), msg in fut.result().items():
+                    print(f"Error fetching {ticker}: {msg}")
+                if progress_callback: progress_callback(k + 1, len(tickers), f"[{tickers[k]}] 최근 봉 갱신")
+
+    frames = {}
+    for t in tickers:
+        try:
+            frames[t] = read_bars("upbit", t, interval, max_bars=bars)
+        except Exception as e:
+            print(f"Error reading {t}: {e}")
+    shortlist = screen_frames(frames, spec, bars)
+    if top: shortlist = shortlist.head(top)
+    if not backtest or shortlist.empty:
+        return shortlist, []
+
+    assets = [{"name": t, "ticker": t, "source": "upbit", "category": "코인"} for t in shortlist['ticker']]
+    results = get_d1_analysis(assets=assets, intervals=[interval], strategies=[spec], refresh=False)
+    return shortlist, results
+
+# --- 스트리밍 모드 (새 봉 하나당 O(1) 로 지표/전략 상태 갱신) ---
+# pandas 의 rolling/ewm 온라인 알고리즘(보정항 포함)을 그대로 따라가 배치 계산과 같은 값을 낸다
+class _RollingMean:
+    def __init__(self, length):
+        self.length = length
+        self.window = deque()
+        self.nobs = 0
+        self.sum_x = 0.0
+        self.comp_add = 0.0
+        self.comp_remove = 0.0
+        self.neg_ct = 0
+        self.same_ct = 0
+        self.prev = None
+
+    def update(self, val):
+        if len(self.window) == self.length:
+            old = self.window.popleft()
+            if old == old:
+                self.nobs -= 1
+                y = -old - self.comp_remove
+                t = self.sum_x + y
+                self.comp_remove = t - self.sum_x - y
+                self.sum_x = t
+                if math.copysign(1.0, old) < 0: self.neg_ct -= 1
+        self.window.append(val)
+        if val == val:
+            self.nobs += 1
+            y = val - self.comp_add
+            t = self.sum_x + y
+            self.comp_add = t - self.sum_x - y
+            self.sum_x = t
+            if math.copysign(1.0, val) < 0: self.neg_ct += 1
+            self.same_ct = self.same_ct + 1 if val == self.prev else 1
+            self.prev = val
+
+        if self.nobs < self.length: return math.nan
+        result = self.sum_x / self.nobs
+        if self.same_ct >= self.nobs: result = self.prev
+        elif self.neg_ct == 0 and result < 0: result = 0.0
+        elif self.neg_ct == self.nobs and result > 0: result = 0.0
+        return result
+
+class _RollingVar:
+    def __init__(self, length, ddof=0):
+        self.length = length
+        self.ddof = ddof
+        self.window = deque()
+        self.nobs = 0
+        self.mean_x = 0.0
+        self.ssqdm_x = 0.0
+        self.comp_add = 0.0
+        self.comp_remove = 0.0
+        self.same_ct = 0
+        self.prev = None
+
+    def update(self, val):
+        if len(self.window) == self.length:
+            old = self.window.popleft()
+            if old == old:
+                self.nobs -= 1
+                if self.nobs:
+                    prev_mean = self.mean_x - self.comp_remove
+                    y = old - self.comp_remove
+                    t = y - self.mean_x
+                    self.comp_remove = t + self.mean_x - y
+                    self.mean_x -= t / self.nobs
+                    self.ssqdm_x -= (old - prev_mean) * (old - self.mean_x)
+                else:
+                    self.mean_x = 0.0
+                    self.ssqdm_x = 0.0
+        self.window.append(val)
+        if val == val:
+            self.same_ct = self.same_ct + 1 if val == self.prev else 1
+            self.prev = val
+            self.nobs += 1
+            prev_mean = self.mean_x - self.comp_add
+            y = val - self.comp_add
+            t = y - self.mean_x
+            self.comp_add = t + self.mean_x - y
+            self.mean_x += t / self.nobs
+            self.ssqdm_x += (val - prev_mean) * (val - self.mean_x)
+
+        if self.nobs < self.length or self.nobs <= self.ddof: return math.nan
+        if self.nobs == 1 or self.same_ct >= self.nobs: return 0.0
+        result = self.ssqdm_x / (self.nobs - self.ddof)
+        return result if result > 0 else 0.0
+
+class _Ewm:
+    # ewm(alpha, adjust=True, min_periods).mean() — pandas_ta 의 RMA (Wilder RSI)
+    def __init__(self, alpha, min_periods):
+        self.decay = 1 - alpha
+        self.min_periods = min_periods
+        self.weighted = None
+        self.old_wt = 1.0
+        self.nobs = 0
+
+    def update(self, cur):
+        is_obs = cur == cur
+        self.nobs += is_obs
+        if self.weighted is None:
+            self.weighted = cur
+        elif self.weighted == self.weighted:
+            if is_obs:
+                self.old_wt *= self.decay
+                if self.weighted != cur:
+                    self.weighted = (self.old_wt * self.weighted + cur) / (self.old_wt + 1.0)
+                self.old_wt += 1.0
+        elif is_obs:
+            self.weighted = cur
+        return self.weighted if self.nobs >= self.min_periods else math.nan
+
+class HybridStream:
+    # 봉이 하나 들어올 때마다 RSI/볼린저/SMA-202/W패턴과 포지션·구조대 상태를 갱신
+    # 같은 봉들을 차례로 넣으면 simulate_hybrid 배치 결과와 같은 거래가 나온다
+    def __init__(self, params=HYBRID_V2_PARAMS, warmup=WARMUP_BARS, w_window=20, w_tolerance=0.005):
+        self.params = params
+        self.warmup = warmup
+        self.w_window = w_window
+        self.w_tolerance = w_tolerance
+
+        self._rsi_pos = _Ewm(1.0 / 14, 14)
+        self._rsi_neg = _Ewm(1.0 / 14, 14)
+        self._bb_mid = _RollingMean(20)
+        self._bb_var = _RollingVar(20, ddof=0)
+        self._sma_202 = _RollingMean(202)
+        self._lows = deque(maxlen=w_window)
+
+        self.n_bars = 0
+        self.prev_close = math.nan
+        self.prev_bb_lower = math.nan
+
+        self.position = None
+        self.entry_price = 0
+        self.rescue_mode = False
+        self.balance = INITIAL_BALANCE
+        self.wins = 0
+        self.trades = []
+
+        self._entry_reasons = _entry_reasons(params)
+        self._target_reason = f"Target {params['target_profit']*100:g}% Reached"
+        self._stop_reason = f"Stop Loss (-{params['stop_loss']*100:g}%)"
+        self._times = []
+        self._closes = []
+        self._entry_bars = []
+        self._exit_bars = []
+        self._exit_balances = []
+        self._exit_pnls = []
+        self._exit_reasons = []
+
+    @classmethod
+    def from_frame(cls, df, **kwargs):
+        stream = cls(**kwargs)
+        for t, c, l in zip(df.index, df['close'].tolist(), df['low'].tolist()):
+            stream.update(t, c, l)
+        return stream
+
+    def _double_bottom(self, low):
+        # check_double_bottom 과 같은 판정 (직전 window 개 저점만 보관)
+        if self.n_bars < self.w_window or not low == low or low == 0: return False
+        past = self._lows
+        for k in range(len(past) - 1, -1, -1):
+            if abs(past[k] - low) / low <= self.w_tolerance:
+                middle_high = max((v for v in itertools.islice(past, k, None) if v == v), default=math.nan)
+                return middle_high > low * 1.005
+        return False
+
+    def update(self, time, close, low):
+        i = self.n_bars
+        p = self.params
+
+        diff = close - self.prev_close
+        pos_avg = self._rsi_pos.update(0.0 if diff < 0 else diff)
+        neg_avg = self._rsi_neg.update(0.0 if diff > 0 else diff)
+        denom = pos_avg + abs(neg_avg)
+        rsi = 100 * pos_avg / denom if denom != 0 else math.nan
+
+        bb_mid = self._bb_mid.update(close)
+        bb_var = self._bb_var.update(close)
+        bb_lower = bb_mid - 2.0 * math.sqrt(bb_var) if bb_var == bb_var else math.nan
+        sma_202 = self._sma_202.update(close)
+        w_pattern = self._double_bottom(low)
+
+        self._times.append(time)
+        self._closes.append(close)
+        events = []
+
+        if i >= self.warmup:
+            # Exit
+            if self.position == 'long':
+                pnl = (close - self.entry_price) / self.entry_price
+                is_close = False; reason = ""
+                rsi_exit = (rsi >= p["rsi_exit"]) if p["rsi_exit_inclusive"] else (rsi > p["rsi_exit"])
+
+                if pnl >= p["target_profit"]:
+                    is_close = True; reason = self._target_reason; self.rescue_mode = False
+                elif pnl <= -p["stop_loss"]:
+                    is_close = True; reason = self._stop_reason; self.rescue_mode = False
+                elif rsi_exit:
+                    if pnl > 0: is_close = True; reason = "RSI > 70 Profit"; self.rescue_mode = False
+                    else: self.rescue_mode = True
+                elif p["bb_mid_exit"] and close >= bb_mid and pnl > p["bb_mid_min_pnl"]:
+                    is_close = True; reason = "BB Mid Touch Profit"; self.rescue_mode = False
+
+                if self.rescue_mode and pnl >= 0:
+                    is_close = True; reason = "Rescue Exit (Breakeven)"; self.rescue_mode = False
+
+                if is_close:
+                    self.balance *= (1 + pnl)
+                    if pnl > 0: self.wins += 1
+                    events.append({'time': str(time), 'type': 'Exit', 'pnl': pnl, 'reason': reason, 'price': close, 'balance': self.balance})
+                    self._exit_bars.append(i)
+                    self._exit_balances.append(self.balance)
+                    self._exit_pnls.append(pnl)
+                    self._exit_reasons.append(reason)
+                    self.position = None
+
+            # Entry
+            if self.position is None:
+                rsi_condition = (rsi <= p["rsi_entry"]) if p["rsi_entry_inclusive"] else (rsi < p["rsi_entry"])
+                band_reversal = (self.prev_close < self.prev_bb_lower) and (close > bb_lower)
+                sma202_support = False
+                if p["sma202_support"] and sma_202 == sma_202 and sma_202 != 0:
+                    dist_to_sma202 = (close - sma_202) / sma_202
+                    sma202_support = (dist_to_sma202 > 0) and (dist_to_sma202 < p["sma202_band"])
+
+                code = ENTRY_NONE
+                if band_reversal and rsi_condition: code = ENTRY_BAND
+                elif p["w_pattern"] and w_pattern and rsi_condition: code = ENTRY_W
+                elif sma202_support and rsi_condition: code = ENTRY_SMA202
+
+                if code != ENTRY_NONE:
+                    self.position = 'long'
+                    self.entry_price = close
+                    self._entry_bars.append(i)
+                    events.append({'time': str(time), 'type': 'Entry', 'reason': self._entry_reasons[code], 'price': close, 'balance': self.balance})
+
+        self.trades.extend(events)
+        self._lows.append(low)
+        self.prev_close = close
+        self.prev_bb_lower = bb_lower
+        self.n_bars += 1
+
+        return {
+            'time': time, 'close': close, 'rsi': rsi, 'bb_lower': bb_lower, 'bb_mid': bb_mid,
+            'sma_202': sma_202, 'w_pattern': w_pattern, 'position': self.position,
+            'rescue_mode': self.rescue_mode, 'events': events,
+        }
+
+    def result(self):
+        # simulate_hybrid 와 같은 형식의 결과
+        index = pd.DatetimeIndex(self._times) if self._times and isinstance(self._times[0], (pd.Timestamp, datetime)) else pd.RangeIndex(len(self._times))
+        total_exits = len(self._exit_bars)
+        return {
+            "return": (self.balance - INITIAL_BALANCE) / INITIAL_BALANCE * 100,
+            "win_rate": (self.wins / total_exits * 100) if total_exits else 0,
+            "trades": total_exits,
+            "trade_history": list(self.trades),
+            "equity_curve": EquityCurve.from_exits(index, self._exit_bars, self._exit_balances),
+            "trade_table": _trade_table(index, np.asarray(self._closes, dtype=np.float64), self._entry_bars,
+                                        self._exit_bars, self._exit_pnls, self._exit_reasons),
+            "last_price": self._closes[-1] if self._closes else None
+        }
+
+# 전략 명세(dict) 목록, "func" 가 있는 항목은 df 를 받아 결과를 돌려주는 함수로 직접 실행
+STRATEGIES = [HYBRID_V1_SPEC, HYBRID_V2_SPEC, HYBRID_V3_SPEC]
+_CACHE_MISS = object()
+
+def _run_strategy(strat, df):
+    return strat["func"](df) if "func" in strat else run_strategy_spec(strat, df)
+
+def run_strategies(df, strategies=None):
+    # 한 자산/봉 길이에 대해 전략 실행 (프로세스 풀 작업 단위)
+    if strategies is None: strategies = STRATEGIES
+    if getattr(_PROFILE, "profiler", None) is None:
+        return [(strat["name"], _run_strategy(strat, df)) for strat in strategies]
     results = []
-    total_steps = len(ASSET_LIST) * len(INTERVALS)
+    for strat in strategies:
+        with profiling_scope(_PROFILE.profiler, strategy=strat["name"]):
+            results.append((strat["name"], _run_strategy(strat, df)))
+    return results
+
+def _run_strategies_job(df, strategies, profile):
+    # 프로세스 풀 작업 단위: 작업자 쪽에서 잰 단계 기록을 결과와 함께 돌려준다
+    if not profile: return run_strategies(df, strategies), []
+    profiler = StageProfiler()
+    with profiling_scope(profiler):
+        results = run_strategies(df, strategies)
+    return results, profiler.records
+
+def _run_strategies_shared(desc, strategies, profile):
+    # 작업자는 공유 메모리의 읽기 전용 뷰로 df 를 조립 (피클/복사 없음)
+    return _run_strategies_job(d1_arena.frame_view(desc), strategies, profile)
+
+def _refresh_job(profiler, interval, fn):
+    with _scope(profiler, interval=interval):
+        return fn()
+
+def _read_job(profiler, asset, interval):
+    with _scope(profiler, asset=asset['name'], interval=interval):
+        try:
+            with profile_stage("store_read") as rec:
+                df = read_bars(asset['source'], asset['ticker'], interval)
+                if rec is not None: rec["bars"] = len(df)
+            return df
+        except Exception as e:
+            print(f"Error reading {asset['ticker']}: {e}")
+            return pd.DataFrame()
+
+def _result_rows(asset, interval, strategy_results):
+    rows = []
+    for strategy_name, res in strategy_results:
+        if res:
+            rows.append({
+                "asset": asset['name'],
+                "ticker": asset['ticker'],
+                "source": asset['source'],
+                "category": asset['category'],
+                "interval": interval,
+                "strategy": strategy_name,
+                "timestamp": datetime.now().isoformat(),
+                **res
+            })
+    return rows
+
+# --- 결과 캐시 (봉 데이터 내용 + 전략 + 파라미터 + 수수료표 해시 단위, 로컬 디스크에 용량 한도 내 LRU) ---
+# 엔진 로직(simulate_hybrid 등)을 바꾸면 ENGINE_VERSION 을 올려서 예전 결과를 무효화
+ENGINE_VERSION = 2  # 2: tz 인덱스 지문 수정 (예전 키는 포인터 값이라 다시 쓸 수 없음)
+RESULT_CACHE_DIR = os.environ.get("D1_RESULT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".d1_backtest", "results"))
+
+def strategy_cache_key(fingerprint, strat, fee_rates=FEE_RATES):
+    # 명세 전략은 명세 내용 전체, 함수 전략은 함수 이름 + params 로 구분
+    func = strat.get("func", run_strategy_spec)
+    spec = {k: v for k, v in strat.items() if k not in ("func", "params")}
+    h = hashlib.blake2b(digest_size=20)
+    for part in (fingerprint, strat["name"], f"{func.__module__}.{func.__qualname__}", strat.get("version", 1),
+                 ENGINE_VERSION, sorted(strat.get("params", {}).items()), spec, sorted(fee_rates.items())):
+        h.update(repr(part).encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+class ResultCache:
+    # 항목 하나 = 파일 하나, 마지막 사용 시각은 파일 mtime 으로 관리 (적중하면 갱신)
+    def __init__(self, root=RESULT_CACHE_DIR, max_bytes=512 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key + ".pkl")
+
+    def get(self, key, default=None):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return default
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            # 깨진 항목은 지우고 없는 것으로 취급
+            self._remove(path)
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes: return
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        self._evict()
+
+    def _entries(self):
+        entries = []
+        if not os.path.isdir(self.root): return entries
+        for sub in os.listdir(self.root):
+            d = os.path.join(self.root, sub)
+            if not os.path.isdir(d): continue
+            for name in os.listdir(d):
+                if not name.endswith(".pkl"): continue
+                try:
+                    st_ = os.stat(os.path.join(d, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((st_.st_mtime, st_.st_size, os.path.join(d, name)))
+        return entries
+
+    def _evict(self):
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes: break
+                self._remove(path)
+                total -= size
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    @property
+    def nbytes(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def __len__(self):
+        return len(self._entries())
+
+    def clear(self):
+        with self._lock:
+            for _, _, path in self._entries():
+                self._remove(path)
+            self.hits = 0
+            self.misses = 0
+
+RESULT_CACHE = ResultCache()
+
+def lookup_strategies(df, cache, strategies=None):
+    # 반환: (지문, 캐시에 있던 결과 {전략 이름: 결과}, 다시 계산할 전략 목록)
+    if strategies is None: strategies = STRATEGIES
+    if cache is None or df is None or df.empty:
+        return None, {}, strategies
+    fingerprint = frame_fingerprint(df)
+    found, missing = {}, []
+    for strat in strategies:
+        res = cache.get(strategy_cache_key(fingerprint, strat), default=_CACHE_MISS)
+        if res is _CACHE_MISS: missing.append(strat)
+        else: found[strat["name"]] = res
+    return fingerprint, found, missing
+
+def store_strategies(cache, fingerprint, strategy_results, strategies=None):
+    if cache is None or fingerprint is None: return
+    by_name = {strat["name"]: strat for strat in (STRATEGIES if strategies is None else strategies)}
+    for name, res in strategy_results:
+        cache.put(strategy_cache_key(fingerprint, by_name[name]), res)
+
+def _merge_strategy_results(found, computed, strategies=None):
+    # 전략 목록 순서 유지
+    if strategies is None: strategies = STRATEGIES
+    computed = dict(computed)
+    return [(strat["name"], found[strat["name"]] if strat["name"] in found else computed.get(strat["name"]))
+            for strat in strategies if strat["name"] in found or strat["name"] in computed]
+
+# --- 파이프라인 모드: I/O 스레드가 미리 받아 두고, 도착한 데이터부터 프로세스 풀에서 백테스트 ---
+def _get_d1_analysis_pipelined(jobs, progress_callback, io_workers, cpu_workers, cache, profiler, strategies=None, refresh=True):
+    total_steps = len(jobs)
+    job_rows = [[] for _ in jobs]
+    done_steps = 0
+
+    # 같은 (종목, 봉 길이) 를 쓰는 작업 묶음: 야후는 봉 길이별 일괄 요청 하나, 업비트는 종목별 동시 요청
+    job_index = {}
+    for k, (asset, interval) in enumerate(jobs):
+        job_index.setdefault((asset['ticker'], source_interval(interval, asset['source'])), []).append(k)
+    tasks = bulk_refresh_tasks([(asset['ticker'], asset['source'], interval) for asset, interval in jobs]) if refresh else []
+
+    # 기본값: 코어 하나는 메인/I-O 스레드 몫으로 남기고, 단일 코어면 메인 스레드에서 바로 계산
+    if cpu_workers is None: cpu_workers = max((os.cpu_count() or 1) - 1, 0)
+    cpu_pool = process_pool(cpu_workers) if cpu_workers > 0 else None
+    arena = d1_arena.SharedArena()  # 작업자에게 보낼 봉은 공유 메모리에 한 번만 올리고 descriptor 만 넘긴다
+    try:
+        with ThreadPoolExecutor(max_workers=io_workers) as io_pool:
+            fetches = {io_pool.submit(_refresh_job, profiler, keys[0][1], fn): keys for keys, fn in tasks}
+            reads = {}
+            computes = {}
+            fetch_errors = {}
+            pending = set(fetches)
+            if not refresh:
+                # 갱신 없이 저장된 봉으로만
+                for k in range(len(jobs)):
+                    rf = io_pool.submit(_read_job, profiler, *jobs[k])
+                    reads[rf] = k
+                    pending.add(rf)
+
+            # 진행 콜백은 항상 호출한 스레드에서만 부른다 (Streamlit 위젯 갱신 제약)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    if fut in fetches:
+                        # 갱신이 끝난 종목은 저장소에서 읽기 (실패한 종목도 저장된 봉으로 계속 진행)
+                        for key, msg in fut.result().items():
+                            fetch_errors[key] = msg
+                            print(f"Error fetching {key[0]}: {msg}")
+                        for key in fetches[fut]:
+                            for k in job_index[key]:
+                                rf = io_pool.submit(_read_job, profiler, *jobs[k])
+                                reads[rf] = k
+                                pending.add(rf)
+                        continue
+
+                    if fut in reads:
+                        k = reads[fut]
+                        asset, interval = jobs[k]
+                        df = fut.result()
+                        with _scope(profiler, asset=asset['name'], interval=interval):
+                            with profile_stage("cache_lookup", bars=len(df)):
+                                fingerprint, found, missing = lookup_strategies(df, cache, strategies)
+                        if missing and cpu_pool is not None:
+                            with _scope(profiler, asset=asset['name'], interval=interval):
+                                with profile_stage("arena_put", bars=len(df)) as rec:
+                                    desc = arena.put_frame(df)
+                                    if rec is not None: rec["bytes"] = desc["nbytes"]
+                            cf = cpu_pool.submit(_run_strategies_shared, desc, missing, profiler is not None)
+                            computes[cf] = (k, fingerprint, found, desc)
+                            pending.add(cf)
+                            continue
+                        computed, records = _run_strategies_job(df, missing, profiler is not None) if missing else ([], [])
+                    else:
+                        k, fingerprint, found, desc = computes.pop(fut)
+                        asset, interval = jobs[k]
+                        computed, records = fut.result()
+                        arena.release(desc)
+
+                    with _scope(profiler, asset=asset['name'], interval=interval):
+                        if profiler is not None: profiler.extend(records, asset=asset['name'], interval=interval)
+                        with profile_stage("assembly"):
+                            store_strategies(cache, fingerprint, computed, strategies)
+                            job_rows[k] = _result_rows(asset, interval, _merge_strategy_results(found, computed, strategies))
+                    done_steps += 1
+                    if progress_callback:
+                        note = " (캐시)" if not computed else ""
+                        if (asset['ticker'], source_interval(interval, asset['source'])) in fetch_errors: note += " (수신 실패: 저장된 봉 사용)"
+                        progress_callback(done_steps, total_steps, f"[{asset['name']}] {interval} 분석 완료{note}")
+    finally:
+        if cpu_pool is not None:
+            cpu_pool.shutdown(cancel_futures=True)
+        arena.close()
+
+    if progress_callback:
+        progress_callback(total_steps, total_steps, "완료")
+
+    return [row for rows in job_rows for row in rows]
+
+def get_d1_analysis(progress_callback=None, pipelined=False, io_workers=4, cpu_workers=None, cache=RESULT_CACHE, profile=False,
+                    assets=None, intervals=None, strategies=None, refresh=True):
+    # cache=None 이면 결과 캐시를 쓰지 않고 항상 다시 계산
+    # profile=True 이면 (결과, 단계별 시간 기록 DataFrame) 을 돌려준다
+    # assets/intervals/strategies: 일부만 돌릴 때 (기본은 ASSET_LIST × INTERVALS × STRATEGIES), refresh=False 면 저장된 봉만 사용
+    if assets is None: assets = ASSET_LIST
+    if intervals is None: intervals = INTERVALS
+    jobs = [(asset, interval) for asset in assets for interval in intervals]
+    profiler = StageProfiler() if profile else None
+    t0 = time.perf_counter()
+    if pipelined:
+        results = _get_d1_analysis_pipelined(jobs, progress_callback, io_workers, cpu_workers, cache, profiler, strategies, refresh)
+    else:
+        results = _get_d1_analysis_serial(jobs, progress_callback, cache, profiler, strategies, refresh)
+
+    if profiler is None: return results
+    profiler.wall_seconds = time.perf_counter() - t0
+    return results, profiler.report()
+
+def _get_d1_analysis_serial(jobs, progress_callback, cache, profiler, strategies=None, refresh=True):
+    results = []
+    total_steps = len(jobs)
     current_step = 0
-    
-    strategies = [
-        {"name": "Hybrid v1", "func": run_hybrid_strategy_v1},
-        {"name": "Hybrid v2", "func": run_hybrid_strategy_v2},
-        {"name": "Hybrid v3 (2%)", "func": run_hybrid_strategy_v3}
-    ]
-    
-    for asset in ASSET_LIST:
-        for interval in INTERVALS:
-            if progress_callback:
-                progress_callback(current_step, total_steps, f"[{asset['name']}] {interval} 분석 중...")
-                
-            df = get_data(asset['ticker'], asset['source'], interval)
-            
-            for strat in strategies:
-                res = strat["func"](df)
-                if res:
-                    results.append({
-                        "asset": asset['name'],
-                        "ticker": asset['ticker'],
-                        "source": asset['source'],
-                        "category": asset['category'],
-                        "interval": interval,
-                        "strategy": strat["name"],
-                        "timestamp": datetime.now().isoformat(),
-                        **res
-                    })
-            current_step += 1
-            
+    refreshed = set()  # 같은 기준 봉을 쓰는 봉 길이는 한 번만 갱신 (그중 가장 긴 봉 길이에 맞는 기간까지)
+    spans = history_spans([(asset['ticker'], asset['source'], interval) for asset, interval in jobs])
+
+    for asset, interval in jobs:
+        if progress_callback:
+            progress_callback(current_step, total_steps, f"[{asset['name']}] {interval} 분석 중...")
+
+        with _scope(profiler, asset=asset['name'], interval=interval):
+            fetch_key = (asset['ticker'], asset['source'], source_interval(interval, asset['source']))
+            df = get_data(asset['ticker'], asset['source'], interval, refresh=refresh and fetch_key not in refreshed,
+                          history=spans[fetch_key])
+            refreshed.add(fetch_key)
+            with profile_stage("cache_lookup", bars=len(df)):
+                fingerprint, found, missing = lookup_strategies(df, cache, strategies)
+            computed = run_strategies(df, missing) if missing else []
+            with profile_stage("assembly"):
+                store_strategies(cache, fingerprint, computed, strategies)
+                rows = _result_rows(asset, interval, _merge_strategy_results(found, computed, strategies))
+        if not computed and progress_callback:
+            progress_callback(current_step, total_steps, f"[{asset['name']}] {interval} 캐시 결과 사용")
+        results.extend(rows)
+        current_step += 1
+
     if progress_callback:
         progress_callback(total_steps, total_steps, "완료")
-        
+
     return results
@@ -0,0 +1,123 @@
+import threading
+from collections import OrderedDict
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from d1_store import _to_ns, _from_ns
+
+# --- 설정 ---
+# 프로세스 풀에 DataFrame 을 넘기면 작업마다 피클로 전체 봉이 복사된다
+# 부모가 배열을 공유 메모리 세그먼트에 한 번만 올리고, 작업자는 작은 descriptor(dict) 만 받아 읽기 전용 뷰로 쓴다
+ALIGN = 64          # 배열 시작 위치 정렬 (캐시 라인)
+ATTACH_KEEP = 8     # 작업자 프로세스가 열어 둔 채로 재사용하는 세그먼트 수 (넘으면 오래된 것부터 닫음)
+TS_KEY = "__ts__"   # put_frame 의 인덱스(ns 정수) 배열 이름
+
+def _aligned(nbytes):
+    return -(-nbytes // ALIGN) * ALIGN
+
+def _close_quietly(shm):
+    # 아직 살아 있는 뷰가 있으면 닫지 못한다 → 매핑은 뷰가 사라질 때 같이 풀린다
+    try:
+        shm.close()
+    except BufferError:
+        pass
+
+# --- 부모 쪽: 세그먼트 소유/해제 ---
+class SharedArena:
+    def __init__(self):
+        self._segments = {}
+        self._lock = threading.Lock()
+
+    def put_arrays(self, arrays, meta=None):
+        # arrays: {이름: ndarray} → 세그먼트 하나에 이어 붙여 복사, 반환값(descriptor)은 피클로 보내도 작다
+        arrays = {key: np.ascontiguousarray(arr) for key, arr in arrays.items()}
+        fields = []
+        size = 0
+        for key, arr in arrays.items():
+            fields.append((key, arr.dtype.str, arr.shape, size))
+            size += _aligned(arr.nbytes)
+        shm = shared_memory.SharedMemory(create=True, size=max(size, ALIGN))
+        for key, dtype, shape, offset in fields:
+            if arrays[key].size:
+                np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)[...] = arrays[key]
+        with self._lock:
+            self._segments[shm.name] = shm
+        return {"name": shm.name, "fields": fields, "meta": dict(meta or {}), "nbytes": size}
+
+    def put_frame(self, df):
+        # OHLCV DataFrame (DatetimeIndex + 숫자 컬럼) → descriptor, 작업자는 frame_view 로 같은 모양의 df 를 받는다
+        columns = [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c])]
+        arrays = {TS_KEY: _to_ns(df.index)}
+        for c in columns:
+            arrays[c] = df[c].to_numpy(dtype=np.float64)
+        tz = pd.DatetimeIndex(df.index).tz
+        meta = {"columns": columns, "tz": str(tz) if tz is not None else None, "index_name": df.index.name}
+        return self.put_arrays(arrays, meta)
+
+    def release(self, desc):
+        with self._lock:
+            shm = self._segments.pop(desc["name"], None)
+        if shm is None: return
+        _close_quietly(shm)
+        shm.unlink()
+
+    def close(self):
+        with self._lock:
+            segments, self._segments = list(self._segments.values()), {}
+        for shm in segments:
+            _close_quietly(shm)
+            shm.unlink()
+
+    @property
+    def nbytes(self):
+        with self._lock:
+            return sum(shm.size for shm in self._segments.values())
+
+    def __len__(self):
+        return len(self._segments)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# --- 작업자 쪽: 읽기 전용 뷰 ---
+_ATTACHED = OrderedDict()
+_attach_lock = threading.Lock()
+
+def attach(desc):
+    # descriptor → {이름: 읽기 전용 ndarray} (복사 없음, 같은 프로세스에서 다시 열면 재사용)
+    name = desc["name"]
+    with _attach_lock:
+        shm = _ATTACHED.get(name)
+        if shm is None:
+            shm = shared_memory.SharedMemory(name=name)
+            _ATTACHED[name] = shm
+            while len(_ATTACHED) > ATTACH_KEEP:
+                _close_quietly(_ATTACHED.popitem(last=False)[1])
+        else:
+            _ATTACHED.move_to_end(name)
+    out = {}
+    for key, dtype, shape, offset in desc["fields"]:
+        arr = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+        arr.flags.writeable = False
+        out[key] = arr
+    return out
+
+def index_view(ts, meta):
+    # ns 정수 배열 → DatetimeIndex (tz 가 없으면 같은 버퍼를 그대로 본다)
+    return _from_ns(ts, meta)
+
+def frame_view(desc):
+    # put_frame 으로 올린 df 를 복사 없이 다시 조립 (값을 바꾸려 하면 오류: 전략은 입력을 수정하지 않는다)
+    arrays = attach(desc)
+    meta = desc["meta"]
+    return pd.DataFrame({c: arrays[c] for c in meta["columns"]}, index=index_view(arrays[TS_KEY], meta), copy=False)
+
+def detach_all():
+    with _attach_lock:
+        segments = list(_ATTACHED.values())
+        _ATTACHED.clear()
+    for shm in segments:
+        _close_quietly(shm)
@@ -0,0 +1,202 @@
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+# --- 설정 ---
+# Streamlit 없이 분석을 돌려 결과를 파일로 남기는 배치 실행기 (cron/작업자용), 대시보드는 이 결과를 읽기만 한다
+# pandas/분석기 모듈은 실제로 실행할 때 import 해서 --help 나 인자 오류는 바로 끝난다
+BATCH_DIR = os.environ.get("D1_BATCH_DIR", os.path.join(os.path.expanduser("~"), ".d1_backtest", "batch"))
+MANIFEST_FILE = "manifest.json"
+FORMATS = ["parquet", "json"]
+TABLES = ["results", "trades", "equity", "timing"]
+RESULT_COLUMNS = ['run_id', 'asset', 'ticker', 'source', 'category', 'interval', 'strategy', 'timestamp',
+                  'return', 'win_rate', 'trades', 'last_price', 'equity_tz']
+
+def _analyzer():
+    import d1_analyzer
+    return d1_analyzer
+
+def _pick(items, wanted, keys, what):
+    # 이름/티커 등으로 고르기 (대소문자 무시), 없는 이름은 오류
+    if not wanted: return None
+    out = []
+    for w in wanted:
+        match = [item for item in items if any(str(k(item)).lower() == w.lower() for k in keys)]
+        if not match: raise ValueError(f"알 수 없는 {what}: {w}")
+        out.extend(m for m in match if m not in out)
+    return out
+
+# --- 결과 → 표 ---
+def batch_tables(results):
+    # 결과 목록을 타입 고정 표 세 개로: 실행별 요약, 거래 원장, 자산 곡선(잔고가 바뀌는 점만)
+    import numpy as np
+    import pandas as pd
+    d1 = _analyzer()
+
+    rows = []
+    equity = []
+    for run_id, res in enumerate(results):
+        curve = res.get('equity_curve')
+        is_curve = isinstance(curve, d1.EquityCurve) and len(curve) > 0
+        rows.append({**{c: res.get(c) for c in RESULT_COLUMNS}, 'run_id': run_id,
+                     'equity_tz': curve.tz if is_curve else None})
+        if is_curve:
+            steps = curve.downsample(len(curve))
+            times = steps.index.as_unit("ns").asi8 if isinstance(steps.index, pd.DatetimeIndex) else steps.index.to_numpy(np.int64)
+            equity.append(pd.DataFrame({'run_id': np.full(len(steps), run_id, dtype=np.int32), 'time_ns': times,
+                                        'balance': steps['balance'].to_numpy()}))
+
+    summary = pd.DataFrame(rows, columns=RESULT_COLUMNS)
+    trades = d1.build_trade_ledger(results)
+    for col in ['strategy', 'asset', 'interval', 'reason']:
+        trades[col] = trades[col].astype(object)
+    equity = pd.concat(equity, ignore_index=True) if equity else pd.DataFrame(
+        {'run_id': pd.Series([], dtype=np.int32), 'time_ns': pd.Series([], dtype=np.int64), 'balance': pd.Series([], dtype=np.float64)})
+    return {"results": summary, "trades": trades, "equity": equity}
+
+def _write_table(df, path, fmt):
+    tmp = path + ".tmp"
+    if fmt == "parquet": df.to_parquet(tmp, index=False)
+    else: df.to_json(tmp, orient="table", index=False, date_unit="ns", force_ascii=False)
+    os.replace(tmp, path)
+
+def _read_table(path, fmt):
+    import pandas as pd
+    if fmt == "parquet": return pd.read_parquet(path)
+    return pd.read_json(path, orient="table", convert_dates=True)
+
+def write_batch(tables, out_dir=BATCH_DIR, fmt="parquet", meta=None):
+    # 표를 먼저 쓰고 manifest 를 마지막에 바꿔서, 읽는 쪽은 manifest 가 가리키는 완성된 파일만 본다
+    os.makedirs(out_dir, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    files = {}
+    for name, df in tables.items():
+        if df is None: continue
+        files[name] = f"{name}-{stamp}.{fmt}"
+        _write_table(df, os.path.join(out_dir, files[name]), fmt)
+
+    old = load_manifest(out_dir)
+    manifest = {**(meta or {}), "created_at": datetime.now().isoformat(), "format": fmt, "files": files,
+                "runs": len(tables["results"]), "trades": len(tables["trades"])}
+    tmp = os.path.join(out_dir, MANIFEST_FILE + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, os.path.join(out_dir, MANIFEST_FILE))
+
+    # 이전 실행의 파일 정리
+    if old:
+        for name in set(old.get("files", {}).values()) - set(files.values()):
+            try: os.remove(os.path.join(out_dir, name))
+            except FileNotFoundError: pass
+    return manifest
+
+def load_manifest(out_dir=BATCH_DIR):
+    try:
+        with open(os.path.join(out_dir, MANIFEST_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def read_batch(out_dir=BATCH_DIR):
+    # 반환: (manifest, 실행 요약 df (equity_curve 컬럼 포함), 거래 원장, 시간 기록 df 또는 None), 결과가 없으면 None
+    import numpy as np
+    d1 = _analyzer()
+    manifest = load_manifest(out_dir)
+    if manifest is None: return None
+    fmt = manifest["format"]
+    tables = {name: _read_table(os.path.join(out_dir, fname), fmt) for name, fname in manifest["files"].items()}
+
+    results = tables["results"]
+    equity = tables["equity"].sort_values(['run_id', 'time_ns'], kind="stable")
+    run_ids = equity['run_id'].to_numpy()
+    bounds = np.searchsorted(run_ids, results['run_id'].to_numpy(), side="left"), np.searchsorted(run_ids, results['run_id'].to_numpy(), side="right")
+    times = equity['time_ns'].to_numpy(np.int64)
+    balance = equity['balance'].to_numpy(np.float64)
+    curves = []
+    for lo, hi, tz in zip(*bounds, results['equity_tz']):
+        if hi == lo:
+            curves.append(None)
+            continue
+        # 잔고가 바뀌는 점만 저장했으므로 그 점들을 봉으로 보는 곡선으로 복원 (차트 모양은 같다)
+        b = balance[lo:hi]
+        starts = np.flatnonzero(np.r_[True, b[1:] != b[:-1]])
+        curves.append(d1.EquityCurve(times[lo:hi], starts, b[starts], tz if isinstance(tz, str) else None))
+    results = results.set_index('run_id', drop=False).rename_axis(None)
+    results['equity_curve'] = curves
+
+    ledger = tables["trades"]
+    ledger['run_id'] = ledger['run_id'].astype(np.int32)
+    for col in ['strategy', 'asset', 'interval', 'reason']:
+        ledger[col] = ledger[col].astype('category')
+    ledger = ledger[d1.LEDGER_COLUMNS]
+
+    timing = tables.get("timing")
+    if timing is not None:
+        timing.attrs["wall_seconds"] = manifest.get("wall_seconds")
+    return manifest, results, ledger, timing
+
+# --- 실행 ---
+def run_batch(out_dir=BATCH_DIR, fmt="parquet", assets=None, intervals=None, strategies=None, refresh=True,
+              cache_dir=None, use_cache=True, pipelined=True, cpu_workers=None, progress_callback=None):
+    d1 = _analyzer()
+    assets = _pick(d1.ASSET_LIST, assets, [lambda a: a['name'], lambda a: a['ticker']], "자산")
+    strategies = _pick(d1.STRATEGIES, strategies, [lambda s: s['name']], "전략")
+    if intervals:
+        allowed = list(d1.INTERVALS) + d1.DERIVED_INTERVALS
+        for interval in intervals:
+            if interval not in allowed: raise ValueError(f"알 수 없는 봉 길이: {interval}")
+
+    cache = None
+    if use_cache: cache = d1.ResultCache(cache_dir) if cache_dir else d1.RESULT_CACHE
+    t0 = time.perf_counter()
+    results, timing = d1.get_d1_analysis(progress_callback, pipelined=pipelined, cpu_workers=cpu_workers, cache=cache,
+                                         profile=True, assets=assets, intervals=intervals, strategies=strategies, refresh=refresh)
+    tables = batch_tables(results)
+    tables["timing"] = timing
+    meta = {
+        "assets": [a['name'] for a in (assets or d1.ASSET_LIST)],
+        "intervals": list(intervals or d1.INTERVALS),
+        "strategies": [s['name'] for s in (strategies or d1.STRATEGIES)],
+        "refresh": refresh,
+        "wall_seconds": time.perf_counter() - t0,
+    }
+    return write_batch(tables, out_dir, fmt, meta)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="D1 분석 배치 실행 (결과를 Parquet/JSON 으로 저장)")
+    parser.add_argument("--assets", nargs="+", help="자산 이름 또는 티커 (기본: 전체)")
+    parser.add_argument("--intervals", nargs="+", help="봉 길이, 예: 5분 15분 1시간 (기본: INTERVALS)")
+    parser.add_argument("--strategies", nargs="+", help='전략 이름, 예: "Hybrid v1" (기본: 전체)')
+    parser.add_argument("--out", default=BATCH_DIR, help="결과 디렉터리")
+    parser.add_argument("--format", choices=FORMATS, default="parquet")
+    parser.add_argument("--no-refresh", action="store_true", help="다운로드 없이 저장된 봉만 사용")
+    parser.add_argument("--cache-dir", help="결과 캐시 디렉터리 (기본: D1_RESULT_CACHE_DIR)")
+    parser.add_argument("--no-cache", action="store_true", help="결과 캐시 없이 항상 다시 계산")
+    parser.add_argument("--serial", action="store_true", help="파이프라인 대신 순차 실행")
+    parser.add_argument("--cpu-workers", type=int, default=None)
+    parser.add_argument("--list", action="store_true", help="고를 수 있는 자산/봉 길이/전략 출력")
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        d1 = _analyzer()
+        print("자산:", ", ".join(f"{a['name']} ({a['ticker']})" for a in d1.ASSET_LIST))
+        print("봉 길이:", ", ".join(list(d1.INTERVALS) + [i for i in d1.DERIVED_INTERVALS if i not in d1.INTERVALS]))
+        print("전략:", ", ".join(s['name'] for s in d1.STRATEGIES))
+        return 0
+
+    progress = None if args.quiet else (lambda c, n, m: print(f"[{c}/{n}] {m}", file=sys.stderr))
+    try:
+        manifest = run_batch(args.out, args.format, args.assets, args.intervals, args.strategies, refresh=not args.no_refresh,
+                             cache_dir=args.cache_dir, use_cache=not args.no_cache, pipelined=not args.serial,
+                             cpu_workers=args.cpu_workers, progress_callback=progress)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"{manifest['runs']} 개 결과, {manifest['trades']} 건 거래 → {args.out} ({manifest['wall_seconds']:.1f}초)")
+    return 0 if manifest['runs'] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
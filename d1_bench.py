@@ -0,0 +1,205 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import d1_analyzer
+
+# --- 설정 ---
+# 네트워크 없이 합성 봉 데이터로 분석기 핵심 경로(지표/W패턴/시뮬레이션/수수료 집계)의 속도를 잰다
+SIZES = [2000, 20000, 200000, 1000000]
+STAGES = ["indicators", "w_pattern", "simulation", "fee_aggregation", "end_to_end"]
+BASELINE_PATH = os.environ.get("D1_BENCH_BASELINE", os.path.join(os.path.expanduser("~"), ".d1_backtest", "bench_baseline.json"))
+REGRESSION_TOLERANCE = 0.25  # 기준보다 25% 넘게 느려지면 회귀로 표시
+MIN_DELTA_SECONDS = 0.002     # 이보다 작은 차이는 측정 잡음으로 보고 무시
+MIN_STAGE_SECONDS = 0.2       # 짧은 단계는 최소 이만큼 반복해서 가장 빠른 값을 쓴다
+
+BENCH_STRATEGIES = [
+    ("Hybrid v1", d1_analyzer.HYBRID_V1_PARAMS),
+    ("Hybrid v2", d1_analyzer.HYBRID_V2_PARAMS),
+    ("Hybrid v3 (2%)", d1_analyzer.HYBRID_V3_PARAMS),
+]
+
+# --- 합성 OHLCV (시드 고정 로그 랜덤워크) ---
+def make_synthetic_ohlcv(n_bars, seed=0, volatility=0.004, freq="5min", start="2024-01-01", price=100.0):
+    rng = np.random.default_rng(seed)
+    close = price * np.exp(np.cumsum(rng.normal(0, volatility, n_bars)))
+    open_ = np.r_[price, close[:-1]]
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, volatility / 2, n_bars)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, volatility / 2, n_bars)))
+    volume = rng.integers(1, 1000, n_bars).astype(np.float64)
+    index = pd.date_range(start, periods=n_bars, freq=freq)
+    return pd.DataFrame({"open": open_, "high": high, "low": low, "close": close, "volume": volume}, index=index)
+
+# --- 측정 ---
+def _best_time(fn, repeat, min_seconds=0.0):
+    best = None
+    result = None
+    runs = 0
+    spent = 0.0
+    while runs < repeat or spent < min_seconds:
+        t0 = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+        runs += 1
+        spent += elapsed
+    return best, result
+
+def _peak_memory(fn):
+    # 시간 측정과 따로 한 번 더 돌려서 추적 오버헤드가 시간에 섞이지 않게
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+def bench_size(n_bars, seed=0, volatility=0.004, repeat=3):
+    df = make_synthetic_ohlcv(n_bars, seed=seed, volatility=volatility)
+    ind = d1_analyzer.compute_hybrid_indicators(df, cache=d1_analyzer.IndicatorCache())
+
+    def indicators():
+        out = {}
+        for name in ("rsi", "bbands", "sma"):
+            out.update(d1_analyzer.INDICATOR_FUNCS[name](df))
+        return out
+
+    def w_pattern():
+        return d1_analyzer.double_bottom_flags(ind['low'])
+
+    def simulation():
+        return [(name, d1_analyzer.simulate_hybrid(ind['close'], ind['low'], ind['rsi'], ind['bb_lower'], ind['bb_mid'],
+                                                   ind['sma_202'], df.index, params, w_pattern=ind['w_pattern']))
+                for name, params in BENCH_STRATEGIES]
+
+    _, strategy_results = _best_time(simulation, 1)
+    results = d1_analyzer._result_rows({"name": "SYNTH", "ticker": "SYNTH", "source": "upbit", "category": "코인"},
+                                       "5분", strategy_results)
+
+    def fee_aggregation():
+        ledger = d1_analyzer.build_trade_ledger(results)
+        return d1_analyzer.build_agg_cube(results, ledger)
+
+    def end_to_end():
+        # 지표 캐시를 매번 새로 만들어 처음 계산하는 비용까지 포함
+        cache = d1_analyzer.IndicatorCache()
+        ind_ = d1_analyzer.compute_hybrid_indicators(df, cache=cache)
+        return [d1_analyzer.simulate_hybrid(ind_['close'], ind_['low'], ind_['rsi'], ind_['bb_lower'], ind_['bb_mid'],
+                                            ind_['sma_202'], df.index, params, w_pattern=ind_['w_pattern'])
+                for _, params in BENCH_STRATEGIES]
+
+    records = []
+    for stage, fn in zip(STAGES, [indicators, w_pattern, simulation, fee_aggregation, end_to_end]):
+        seconds, _ = _best_time(fn, repeat, MIN_STAGE_SECONDS)
+        records.append({
+            "n_bars": n_bars,
+            "stage": stage,
+            "seconds": seconds,
+            "bars_per_sec": n_bars / seconds if seconds > 0 else float("inf"),
+            "peak_bytes": _peak_memory(fn),
+            "trades": sum(res["trades"] for _, res in strategy_results) if stage in ("simulation", "end_to_end") else None,
+        })
+    return records
+
+def run_benchmarks(sizes=SIZES, seed=0, volatility=0.004, repeat=3, progress_callback=None):
+    records = []
+    for k, n_bars in enumerate(sizes):
+        if progress_callback:
+            progress_callback(k, len(sizes), f"{n_bars:,} 봉 측정 중...")
+        records.extend(bench_size(n_bars, seed=seed, volatility=volatility, repeat=repeat))
+    if progress_callback:
+        progress_callback(len(sizes), len(sizes), "완료")
+    return records
+
+# --- 기준값 저장/비교 ---
+def environment_info():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+def save_baseline(records, path=BASELINE_PATH, seed=0, volatility=0.004):
+    doc = {
+        "created_at": datetime.now().isoformat(),
+        "seed": seed,
+        "volatility": volatility,
+        "environment": environment_info(),
+        "records": records,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(doc, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+def load_baseline(path=BASELINE_PATH):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def compare_to_baseline(records, baseline, tolerance=REGRESSION_TOLERANCE, min_delta=MIN_DELTA_SECONDS):
+    # (봉 개수, 단계) 별로 기준 대비 느려진 비율 계산, 허용치를 넘으면 회귀
+    base = {(r["n_bars"], r["stage"]): r for r in baseline.get("records", [])}
+    rows = []
+    for r in records:
+        b = base.get((r["n_bars"], r["stage"]))
+        if b is None: continue
+        ratio = r["seconds"] / b["seconds"] if b["seconds"] > 0 else float("inf")
+        rows.append({
+            "n_bars": r["n_bars"],
+            "stage": r["stage"],
+            "baseline_seconds": b["seconds"],
+            "seconds": r["seconds"],
+            "ratio": ratio,
+            "regression": ratio > 1 + tolerance and r["seconds"] - b["seconds"] > min_delta,
+        })
+    return rows
+
+def format_records(records):
+    lines = [f"{'bars':>10} {'stage':<16} {'seconds':>10} {'bars/sec':>14} {'peak MB':>9}"]
+    for r in records:
+        lines.append(f"{r['n_bars']:>10,} {r['stage']:<16} {r['seconds']:>10.4f} {r['bars_per_sec']:>14,.0f} {r['peak_bytes'] / 1e6:>9.1f}")
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="D1 분석기 오프라인 벤치마크")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--volatility", type=float, default=0.004)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save", action="store_true", help="이번 결과를 기준값으로 저장")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    records = run_benchmarks(args.sizes, seed=args.seed, volatility=args.volatility, repeat=args.repeat,
+                             progress_callback=lambda c, n, m: print(m, file=sys.stderr))
+    print(format_records(records))
+
+    status = 0
+    baseline = load_baseline(args.baseline)
+    if baseline is not None and not args.save:
+        for row in compare_to_baseline(records, baseline, args.tolerance):
+            flag = "REGRESSION" if row["regression"] else "ok"
+            print(f"{row['n_bars']:>10,} {row['stage']:<16} x{row['ratio']:.2f} {flag}")
+            if row["regression"]: status = 1
+    if args.save or baseline is None:
+        save_baseline(records, args.baseline, seed=args.seed, volatility=args.volatility)
+        print(f"기준값 저장: {args.baseline}")
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,10 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 from datetime import datetime
 import d1_analyzer
+import d1_batch
+import d1_bootstrap
 import altair as alt
 
 # --- 페이지 설정 ---
@@ -20,6 +23,11 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# --- 차트/표 크기 ---
+EQUITY_POINTS = 800       # 곡선 하나당 브라우저로 보내는 최대 점 수 (서버에서 LTTB 로 줄임)
+EQUITY_DEFAULT_RUNS = 5   # 처음에 겹쳐 그릴 결과 수 (수익률 상위)
+TRADE_PAGE_SIZE = 50
+
 # --- 데이터 로드 ---
 def load_data(progress_bar, status_text):
     def update_progress(current, total, message):
@@ -28,8 +36,105 @@ def load_data(progress_bar, status_text):
         progress_bar.progress(percent)
         status_text.text(f"진행률: {int(percent * 100)}% - {message}")
 
-    raw_data = d1_analyzer.get_d1_analysis(progress_callback=update_progress)
-    return pd.DataFrame(raw_data)
+    raw_data, timing = d1_analyzer.get_d1_analysis(progress_callback=update_progress, pipelined=True, profile=True)
+    ledger = d1_analyzer.build_trade_ledger(raw_data)
+    return prepare_results(pd.DataFrame(raw_data)), prepare_ledger(ledger), d1_analyzer.build_agg_cube(raw_data, ledger), timing
+
+def load_batch():
+    # d1_batch 가 남긴 결과 파일만 읽는다 (다운로드/백테스트 없음)
+    loaded = d1_batch.read_batch()
+    if loaded is None: return None
+    manifest, results, ledger, timing = loaded
+    cube = d1_analyzer.build_agg_cube(results.to_dict('records'), ledger)
+    return manifest, prepare_results(results), prepare_ledger(ledger), cube, timing
+
+def prepare_results(df):
+    sources = df['source'] if 'source' in df else ['upbit'] * len(df) # 기존 데이터 호환성
+    categories = df['category'] if 'category' in df else ['코인'] * len(df)
+    df['fee_rate'] = [d1_analyzer.get_fee_rate(s, c) for s, c in zip(sources, categories)]
+    return df
+
+def prepare_ledger(ledger):
+    # 월 필터용 키는 로드할 때 한 번만 계산 (거래마다 문자열 파싱하지 않도록)
+    ledger = ledger.copy()
+    ledger['entry_month'] = ledger['entry_ts'].dt.strftime("%Y-%m")
+    ledger['exit_month'] = ledger['exit_ts'].dt.strftime("%Y-%m")
+    return ledger
+
+def aggregate_runs(cube, filtered_df, target_months, initial_capital):
+    # 같은 필터 조합이면 이전 계산 결과를 그대로 사용
+    key = (tuple(filtered_df.index), tuple(target_months))
+    memo = st.session_state.setdefault('agg_memo', {})
+    if key in memo:
+        return memo[key].copy()
+
+    mask = cube['run_id'].isin(filtered_df.index)
+    if target_months:
+        mask &= cube['month'].isin(target_months)
+    per_run = cube[mask].groupby('run_id').agg(
+        trades=('trades', 'sum'), wins=('wins', 'sum'),
+        log_ret=('log_ret', 'sum'), log_ret_fee=('log_ret_fee', 'sum'))
+    per_run = per_run[per_run['trades'] > 0]
+
+    info = filtered_df.loc[per_run.index, ['strategy', 'asset', 'interval', 'last_price']]
+    balance_no_fee = initial_capital * np.exp(per_run['log_ret'])
+    balance_with_fee = initial_capital * np.exp(per_run['log_ret_fee'])
+    result_df = info.assign(
+        trades=per_run['trades'],
+        wins=per_run['wins'],
+        win_rate=per_run['wins'] / per_run['trades'] * 100,
+        **{'return': (balance_no_fee - initial_capital) / initial_capital * 100},
+        return_fee=(balance_with_fee - initial_capital) / initial_capital * 100,
+        final_balance=balance_with_fee,
+        balance_no_fee=balance_no_fee,
+    )
+
+    if len(memo) > 64: memo.clear()
+    memo[key] = result_df
+    return result_df.copy()
+
+def bootstrap_bands(ledger, filtered_df, run_ids, target_months):
+    # 선택된 실행/월의 청산 거래를 다시 뽑아 수익률/낙폭 구간 (필터 조합별로 한 번만)
+    key = ('bootstrap', tuple(run_ids), tuple(target_months))
+    memo = st.session_state.setdefault('agg_memo', {})
+    if key in memo:
+        return memo[key]
+
+    mask = ledger['run_id'].isin(run_ids)
+    if target_months:
+        mask &= ledger['exit_month'].isin(target_months)
+    bands = d1_bootstrap.bootstrap_ledger(ledger[mask], filtered_df['fee_rate'], run_ids=run_ids,
+                                          n_resamples=d1_bootstrap.INTERACTIVE_RESAMPLES)
+    memo[key] = bands
+    return bands
+
+def equity_frame(df, run_id):
+    # 결과 하나의 자산 곡선을 EQUITY_POINTS 개 이하로 줄여서 (로드마다 한 번만)
+    key = ('equity', run_id)
+    memo = st.session_state.setdefault('agg_memo', {})
+    if key not in memo:
+        curve = df.at[run_id, 'equity_curve'] if 'equity_curve' in df else None
+        if not isinstance(curve, d1_analyzer.EquityCurve) or len(curve) == 0:
+            memo[key] = None
+        else:
+            frame = curve.downsample(EQUITY_POINTS).reset_index()
+            if isinstance(frame['time'].dtype, pd.DatetimeTZDtype):
+                frame['time'] = frame['time'].dt.tz_localize(None)  # 자산마다 다른 tz 를 현지 시각으로 통일
+            memo[key] = frame
+    return memo[key]
+
+def equity_chart(df, runs):
+    # runs: [(라벨, run_id)]
+    frames = [frame.assign(run=label) for label, frame in ((label, equity_frame(df, r)) for label, r in runs) if frame is not None]
+    if not frames:
+        return None
+    data = pd.concat(frames, ignore_index=True)
+    return alt.Chart(data).mark_line(interpolate='step-after').encode(
+        x=alt.X('time:T', title=None),
+        y=alt.Y('balance:Q', title='잔고 (원)', scale=alt.Scale(zero=False)),
+        color=alt.Color('run:N', title=None, legend=alt.Legend(orient='bottom', columns=2)),
+        tooltip=[alt.Tooltip('run:N'), alt.Tooltip('time:T'), alt.Tooltip('balance:Q', format=',.0f')],
+    ).interactive(bind_y=False)
 
 def main():
     st.title("📈 하일수 하이브리드 전략 대시보드")
@@ -53,6 +158,12 @@ def main():
     col_btn, col_dummy = st.columns([1, 5])
     with col_btn:
         start_btn = st.button("🔄 데이터 분석 시작", type="primary")
+    batch_manifest = d1_batch.load_manifest()
+    batch_btn = False
+    if batch_manifest is not None:
+        with col_dummy:
+            batch_btn = st.button("📂 배치 결과 불러오기")
+            st.caption(f"배치 실행: {batch_manifest['created_at'][:19].replace('T', ' ')} · {batch_manifest['runs']}개 결과")
         
     status_text = st.empty()
     progress_bar = st.empty()
@@ -60,15 +171,57 @@ def main():
     # 데이터 로드 로직
     if start_btn:
         st.cache_data.clear()
-        df = load_data(progress_bar, status_text)
+        df, ledger, cube, timing = load_data(progress_bar, status_text)
         st.session_state['df'] = df
+        st.session_state['ledger'] = ledger
+        st.session_state['cube'] = cube
+        st.session_state['timing'] = timing
+        st.session_state['agg_memo'] = {}
         st.session_state['data_loaded'] = True
         st.rerun()
 
+    if batch_btn:
+        loaded = load_batch()
+        if loaded is None:
+            st.warning("배치 결과를 찾을 수 없습니다.")
+        else:
+            _, df, ledger, cube, timing = loaded
+            st.session_state['df'] = df
+            st.session_state['ledger'] = ledger
+            st.session_state['cube'] = cube
+            st.session_state['timing'] = timing
+            st.session_state['agg_memo'] = {}
+            st.session_state['data_loaded'] = True
+            st.rerun()
+
     if 'data_loaded' not in st.session_state:
         st.info("위의 '데이터 분석 시작' 버튼을 눌러 분석을 시작하세요.")
     else:
         df = st.session_state['df']
+        if 'cube' not in st.session_state:
+            records = df.to_dict('records')
+            raw_ledger = d1_analyzer.build_trade_ledger(records)
+            st.session_state['df'] = df = prepare_results(df)
+            st.session_state['ledger'] = prepare_ledger(raw_ledger)
+            st.session_state['cube'] = d1_analyzer.build_agg_cube(records, raw_ledger)
+        ledger = st.session_state['ledger']
+        cube = st.session_state['cube']
+
+        timing = st.session_state.get('timing')
+        if timing is not None and not timing.empty:
+            with st.expander("⏱️ 분석 시간 분석 (어디서 시간이 걸렸나)"):
+                wall = timing.attrs.get('wall_seconds')
+                if wall is not None:
+                    st.caption(f"전체 경과 시간: {wall:.2f}초 (다운로드/계산이 병렬로 돌아 단계 합계가 더 클 수 있음)")
+                summary = d1_analyzer.summarize_timing(timing)
+                st.dataframe(
+                    summary.style.format({'seconds': "{:.3f}", 'share': "{:.1f}%", 'bars': "{:,.0f}",
+                                          'bytes': "{:,.0f}", 'bars_per_sec': "{:,.0f}"}, na_rep="-"),
+                    use_container_width=True
+                )
+                by_job = timing.groupby(['asset', 'interval', 'stage'], sort=False)['seconds'].sum().unstack('stage', fill_value=0)
+                by_job['total'] = by_job.sum(axis=1)
+                st.dataframe(by_job.sort_values('total', ascending=False).style.format("{:.3f}"), use_container_width=True)
         
         # --- 사이드바 필터 ---
         # --- 사이드바 필터 (Form) ---
@@ -100,17 +253,7 @@ def main():
             sel_intervals = multiselect_checkbox("봉 길이", intervals, "int")
             
             # 4. 기간(월별) 필터
-            all_trades = []
-            for _, row in df.iterrows():
-                if row['trade_history']:
-                    for t in row['trade_history']:
-                        all_trades.append(t)
-            
-            if all_trades:
-                trade_dates = [pd.to_datetime(t['time']) for t in all_trades]
-                months = sorted(list(set([d.strftime("%Y-%m") for d in trade_dates])), reverse=True)
-            else:
-                months = []
+            months = sorted(set(ledger['entry_month'].dropna()) | set(ledger['exit_month'].dropna()), reverse=True)
                 
             sel_months = multiselect_checkbox("월(Month)", months, "month")
             
@@ -158,104 +301,24 @@ def main():
         else:
             filtered_df = filtered_df.iloc[0:0]
         
-        # 재계산된 결과를 담을 리스트
-        recalculated_results = []
-        
         initial_capital = 1000000
         
-        total_initial = 0
-        total_final_no_fee = 0
-        total_final_with_fee = 0
-        total_trades_count = 0
-        total_wins = 0
-        
         # 수수료율 정보를 수집하기 위한 세트
-        applied_fee_rates = set()
+        applied_fee_rates = set(filtered_df['fee_rate'])
 
-        for _, row in filtered_df.iterrows():
-            trades = row['trade_history']
-            
-            # 수수료율 결정
-            source = row.get('source', 'upbit') # 기존 데이터 호환성
-            category = row.get('category', '코인')
-            
-            if source == 'upbit':
-                fee_rate = d1_analyzer.FEE_RATES['upbit']
-            elif source == 'yahoo':
-                if category == 'ETF':
-                    fee_rate = d1_analyzer.FEE_RATES['yahoo_etf']
-                else:
-                    fee_rate = d1_analyzer.FEE_RATES['yahoo_future']
-            else:
-                fee_rate = 0.001 # 기본값
-            
-            applied_fee_rates.add(fee_rate)
+        # 선택된 실행(run_id)/월만 큐브에서 더해 성과 재계산 (필터 조합별로 한 번만)
+        result_df = aggregate_runs(cube, filtered_df, target_months, initial_capital)
+        bands = bootstrap_bands(ledger, filtered_df, list(result_df.index), target_months)
+        result_df = result_df.join(bands[['return_lo', 'return_hi', 'mdd_hi', 'p_loss']])
 
-            # 월별 필터링 (멀티 선택)
-            if target_months:
-                trades = [t for t in trades if pd.to_datetime(t['time']).strftime("%Y-%m") in target_months]
-            
-            # 해당 자산/기간의 성과 계산
-            balance_no_fee = initial_capital
-            balance_with_fee = initial_capital
-            wins = 0
-            
-            valid_trades = [] # 필터링된 거래만 담음
-            
-            for t in trades:
-                if t['type'] == 'Exit':
-                    pnl = t['pnl']
-                    balance_no_fee *= (1 + pnl)
-                    # 매수/매도 각각 수수료 적용 (간략화: 수익률에서 2배 차감 근사치 대신, 정확히 자산에서 차감)
-                    # 진입 시 수수료: balance * (1 - fee)
-                    # 청산 시 수수료: balance * (1 - fee)
-                    # 여기서는 PnL 계산 후 한 번에 적용하는 방식 유지하되, 왕복 고려
-                    
-                    # 방법 1: PnL에서 수수료 차감 (단순화)
-                    # net_pnl = pnl - (fee_rate * 2) 
-                    # balance_with_fee *= (1 + net_pnl)
-                    
-                    # 방법 2: 자산 자체 차감 (더 정확)
-                    # 진입: trade_amt = balance * (1 - fee)
-                    # 청산: result_amt = trade_amt * (1 + pnl) * (1 - fee)
-                    # result_amt = balance * (1 - fee) * (1 + pnl) * (1 - fee)
-                    # result_amt = balance * (1 + pnl) * (1 - fee)^2
-                    
-                    balance_with_fee *= (1 + pnl) * ((1 - fee_rate) ** 2)
-
-                    if pnl > 0: wins += 1
-                    valid_trades.append(t)
-                elif t['type'] == 'Entry':
-                        valid_trades.append(t)
-
-            trade_count = len([t for t in valid_trades if t['type'] == 'Exit'])
-            
-            if trade_count > 0:
-                win_rate = (wins / trade_count) * 100
-                ret_no_fee = (balance_no_fee - initial_capital) / initial_capital * 100
-                ret_with_fee = (balance_with_fee - initial_capital) / initial_capital * 100
-                
-                recalculated_results.append({
-                    'strategy': row['strategy'], # strategy 컬럼 추가
-                    'asset': row['asset'],
-                    'interval': row['interval'],
-                    'trades': trade_count,
-                    'win_rate': win_rate,
-                    'return': ret_no_fee,
-                    'return_fee': ret_with_fee,
-                    'final_balance': balance_with_fee,
-                    'trade_history': valid_trades,
-                    'last_price': row['last_price']
-                })
-                
-                total_initial += initial_capital
-                total_final_no_fee += balance_no_fee
-                total_final_with_fee += balance_with_fee
-                total_trades_count += trade_count
-                total_wins += wins
+        result_df = result_df.rename_axis('run_id').reset_index()
+
+        total_initial = initial_capital * len(result_df)
+        total_final_no_fee = result_df['balance_no_fee'].sum()
+        total_final_with_fee = result_df['final_balance'].sum()
+        total_trades_count = int(result_df['trades'].sum())
+        total_wins = int(result_df['wins'].sum())
         
-        # 결과 DataFrame 생성
-        result_df = pd.DataFrame(recalculated_results)
         
         # --- 결과 표시 ---
         month_str = ", ".join(target_months) if target_months else "All"
@@ -326,7 +389,10 @@ def main():
         if not result_df.empty:
             st.subheader("📋 자산별 성과 (수수료 적용)")
             
-            display_cols = ['strategy', 'asset', 'interval', 'return_fee', 'win_rate', 'trades', 'final_balance']
+            st.caption(f"수익률 구간/낙폭: 거래를 {d1_bootstrap.INTERACTIVE_RESAMPLES:,}번 다시 뽑은 {d1_bootstrap.CONFIDENCE:.0%} 구간 (수수료 적용), "
+                       "손실 확률: 다시 뽑은 순서 중 최종 손실로 끝난 비율")
+            display_cols = ['strategy', 'asset', 'interval', 'return_fee', 'return_lo', 'return_hi', 'mdd_hi', 'p_loss',
+                            'win_rate', 'trades', 'final_balance']
             display_df = result_df[display_cols].sort_values(by='return_fee', ascending=False)
             
             def color_return(val):
@@ -337,34 +403,58 @@ def main():
                 display_df.style.applymap(color_return, subset=['return_fee'])
                 .format({
                     'return_fee': "{:.2f}%", 
+                    'return_lo': "{:.2f}%",
+                    'return_hi': "{:.2f}%",
+                    'mdd_hi': "{:.2f}%",
+                    'p_loss': "{:.1f}%",
                     'win_rate': "{:.1f}%", 
                     'final_balance': "{:,.0f}"
                 }),
                 use_container_width=True
             )
             
-            # --- 상세 분석 (Expanders) ---
+            ranked = display_df.index.map(result_df['run_id']).tolist()
+            by_run = result_df.set_index('run_id')
+            labels = {r: f"{row.strategy} · {row.asset} ({row.interval})" for r, row in by_run.iterrows()}
+
+            # --- 자산 곡선 (고른 결과만, 서버에서 점 수를 줄여서) ---
+            st.subheader("📈 자산 곡선 (수수료 전)")
+            chosen = st.multiselect("표시할 결과", ranked, default=ranked[:EQUITY_DEFAULT_RUNS], format_func=labels.get)
+            chart = equity_chart(df, [(labels[r], r) for r in chosen])
+            if chart is not None:
+                st.altair_chart(chart, use_container_width=True)
+
+            # --- 상세 거래 기록 (고른 결과 하나만, 페이지 단위로 표 생성) ---
             st.subheader("📝 상세 거래 기록")
-                
-            for i, row in result_df.iterrows():
-                with st.expander(f"{row['asset']} ({row['interval']}) - 수익률: {row['return_fee']:.2f}%"):
-                    
-                    if row['trade_history']:
-                        history_df = pd.DataFrame(row['trade_history'])
-                        
-                        # 컬럼 정리
-                        cols_order = ['time', 'type', 'reason', 'price', 'pnl']
-                        history_df = history_df[[c for c in cols_order if c in history_df.columns]]
-                        
-                        # 스타일링 적용
-                        styler = history_df.style.format({'price': "{:,.2f}"})
-                        
-                        if 'pnl' in history_df.columns:
-                            styler = styler.applymap(lambda x: 'color: #4CAF50; font-weight: bold;' if x>0 else 'color: #FF5252; font-weight: bold;' if x<0 else '', subset=['pnl']).format({'pnl': "{:.2%}"})
-                        
-                        st.dataframe(styler, use_container_width=True)
-                    else:
-                        st.info("선택된 기간에 거래 기록이 없습니다.")
+            run_id = st.selectbox("결과 선택", ranked,
+                                  format_func=lambda r: f"{labels[r]} - 수익률: {by_run.at[r, 'return_fee']:.2f}%")
+
+            # 진입 또는 청산이 선택 월에 있는 거래
+            history_df = ledger[ledger['run_id'] == run_id]
+            if target_months:
+                history_df = history_df[history_df['entry_month'].isin(target_months) | history_df['exit_month'].isin(target_months)]
+
+            if not history_df.empty:
+                n_pages = -(-len(history_df) // TRADE_PAGE_SIZE)
+                page = 1
+                if n_pages > 1:
+                    page = st.number_input(f"페이지 (전체 {n_pages}쪽, {len(history_df)}건)", min_value=1, max_value=n_pages,
+                                           value=1, key=f"trade_page_{run_id}")
+                history_df = history_df.iloc[(page - 1) * TRADE_PAGE_SIZE:page * TRADE_PAGE_SIZE]
+
+                # 컬럼 정리
+                cols_order = ['entry_ts', 'exit_ts', 'reason', 'entry_price', 'exit_price', 'pnl']
+                history_df = history_df[[c for c in cols_order if c in history_df.columns]]
+
+                # 스타일링 적용 (현재 페이지만)
+                styler = history_df.style.format({'entry_price': "{:,.2f}", 'exit_price': "{:,.2f}"})
+
+                if 'pnl' in history_df.columns:
+                    styler = styler.applymap(lambda x: 'color: #4CAF50; font-weight: bold;' if x>0 else 'color: #FF5252; font-weight: bold;' if x<0 else '', subset=['pnl']).format({'pnl': "{:.2%}"})
+
+                st.dataframe(styler, use_container_width=True)
+            else:
+                st.info("선택된 기간에 거래 기록이 없습니다.")
         else:
             st.warning("선택한 조건에 맞는 거래 데이터가 없습니다.")
 
@@ -0,0 +1,668 @@
+import argparse
+import math
+import os
+import sys
+import tempfile
+import time
+import types
+import numpy as np
+import pandas as pd
+import d1_analyzer
+import d1_bootstrap
+import d1_store
+from d1_bench import make_synthetic_ohlcv
+
+# --- 설정 ---
+# 빠른 경로(명세 엔진/배열 시뮬레이터/스트리밍 등)가 원래의 봉 단위 루프와 똑같이 동작하는지 고정하는 차등 검증
+# 같은 봉 데이터(시드 고정 합성 + 저장된 실제 봉)에 기준 루프와 등록된 엔진을 모두 돌려
+# 거래 목록/잔고/자산 곡선을 비교하고, 처음 달라지는 봉을 보고한다
+REFERENCE_STRATEGIES = [
+    ("Hybrid v1", d1_analyzer.HYBRID_V1_PARAMS),
+    ("Hybrid v2", d1_analyzer.HYBRID_V2_PARAMS),
+    ("Hybrid v3 (2%)", d1_analyzer.HYBRID_V3_PARAMS),
+]
+SYNTHETIC_KINDS = ["walk", "revert", "ticks", "session", "rescue"]
+N_BARS = 3000
+N_SEEDS = 4
+RTOL = 1e-9   # 가격/수익률/잔고 상대 허용 오차
+ATOL = 1e-9
+TRADE_FIELDS = ['bar', 'type', 'reason', 'price', 'pnl', 'balance']
+REPORT_COLUMNS = ['fixture', 'check', 'engine', 'ok', 'first_bar', 'time', 'field', 'reference', 'candidate', 'seconds']
+
+# 수수료 계산 검증용: 소스/분류마다 수수료율이 다르게 적용되도록 픽스처별로 돌려 가며 붙인다
+FEE_ASSETS = [
+    {"source": "upbit", "category": "코인"},
+    {"source": "yahoo", "category": "ETF"},
+    {"source": "yahoo", "category": "선물"},
+]
+
+# --- 기준 구현 (원래 대시보드/분석기의 봉 단위 루프, v1/v2/v3 차이는 파라미터로) ---
+def reference_hybrid(df, params=d1_analyzer.HYBRID_V2_PARAMS):
+    # 구조대 모드는 봉을 넘어 유지, 청산 규칙은 위에서부터 하나만, 청산한 봉에서 바로 재진입 가능
+    if df is None or df.empty or len(df) < 202: return None
+    ta = d1_analyzer.ta
+    rsi = ta.rsi(df['close'], length=14)
+    bb = ta.bbands(df['close'], length=20, std=2)
+    bb_lower = bb[[c for c in bb.columns if c.startswith('BBL')][0]].tolist()
+    bb_mid = bb[[c for c in bb.columns if c.startswith('BBM')][0]].tolist()
+    sma_202 = ta.sma(df['close'], length=202).tolist()
+    close = df['close'].tolist()
+    rsi = rsi.tolist()
+
+    p = params
+    op = "<=" if p["rsi_entry_inclusive"] else "<"
+    rsi_txt = f"RSI {op} {p['rsi_entry']:g}"
+    target_reason = f"Target {p['target_profit']*100:g}% Reached"
+    stop_reason = f"Stop Loss (-{p['stop_loss']*100:g}%)"
+
+    balance = d1_analyzer.INITIAL_BALANCE
+    position = None
+    entry_price = 0
+    trades = []
+    equity_curve = []
+    rescue_mode = False
+
+    for i in range(len(df)):
+        equity_curve.append({'time': df.index[i], 'balance': balance})
+        if i < 202: continue
+
+        curr_close = close[i]
+        prev_close = close[i-1]
+        curr_time = str(df.index[i])
+        curr_rsi = rsi[i]
+
+        # Exit
+        if position == 'long':
+            pnl = (curr_close - entry_price) / entry_price
+            is_close = False; reason = ""
+            rsi_exit = curr_rsi >= p["rsi_exit"] if p["rsi_exit_inclusive"] else curr_rsi > p["rsi_exit"]
+
+            if pnl >= p["target_profit"]:
+                is_close = True; reason = target_reason; rescue_mode = False
+            elif pnl <= -p["stop_loss"]:
+                is_close = True; reason = stop_reason; rescue_mode = False
+            elif rsi_exit:
+                if pnl > 0: is_close = True; reason = "RSI > 70 Profit"; rescue_mode = False
+                else: rescue_mode = True
+            elif p["bb_mid_exit"] and curr_close >= bb_mid[i] and pnl > p["bb_mid_min_pnl"]:
+                is_close = True; reason = "BB Mid Touch Profit"; rescue_mode = False
+
+            if rescue_mode and pnl >= 0:
+                is_close = True; reason = "Rescue Exit (Breakeven)"; rescue_mode = False
+
+            if is_close:
+                balance *= (1 + pnl)
+                trades.append({'time': curr_time, 'type': 'Exit', 'pnl': pnl, 'reason': reason, 'price': curr_close, 'balance': balance})
+                position = None
+
+        # Entry
+        if position is None:
+            rsi_condition = curr_rsi <= p["rsi_entry"] if p["rsi_entry_inclusive"] else curr_rsi < p["rsi_entry"]
+            band_reversal = (prev_close < bb_lower[i-1]) and (curr_close > bb_lower[i])
+            w_pattern = p["w_pattern"] and d1_analyzer.check_double_bottom(df['low'], i)
+            dist_to_sma202 = (curr_close - sma_202[i]) / sma_202[i]
+            sma202_support = p["sma202_support"] and (dist_to_sma202 > 0) and (dist_to_sma202 < p["sma202_band"])
+
+            entry_reason = None
+            if band_reversal and rsi_condition:
+                entry_reason = f"Band Reversal + {rsi_txt}"
+            elif w_pattern and rsi_condition:
+                entry_reason = f"W-Pattern + {rsi_txt}"
+            elif sma202_support and rsi_condition:
+                entry_reason = f"202 SMA Support + {rsi_txt}"
+
+            if entry_reason:
+                position = 'long'
+                entry_price = curr_close
+                trades.append({'time': curr_time, 'type': 'Entry', 'reason': entry_reason, 'price': curr_close, 'balance': balance})
+
+    total_exits = [t for t in trades if t['type'] == 'Exit']
+    win_trades = [t for t in total_exits if t['pnl'] > 0]
+    return {
+        "return": (balance - d1_analyzer.INITIAL_BALANCE) / d1_analyzer.INITIAL_BALANCE * 100,
+        "win_rate": (len(win_trades) / len(total_exits) * 100) if total_exits else 0,
+        "trades": len(total_exits),
+        "trade_history": trades,
+        "equity_curve": equity_curve,
+        "last_price": close[-1],
+    }
+
+def reference_fee_math(results, target_months=None, initial_capital=1000000):
+    # 원래 대시보드의 실행별 수수료 반영 루프: run_id → (거래 수, 승 수, 수수료 전 잔고, 수수료 후 잔고)
+    out = {}
+    for run_id, row in enumerate(results):
+        fee_rate = d1_analyzer.get_fee_rate(row.get('source', 'upbit'), row.get('category', '코인'))
+        trades = row['trade_history']
+        if target_months:
+            trades = [t for t in trades if pd.to_datetime(t['time']).strftime("%Y-%m") in target_months]
+        balance_no_fee = initial_capital
+        balance_with_fee = initial_capital
+        count = wins = 0
+        for t in trades:
+            if t['type'] == 'Exit':
+                pnl = t['pnl']
+                balance_no_fee *= (1 + pnl)
+                balance_with_fee *= (1 + pnl) * ((1 - fee_rate) ** 2)
+                count += 1
+                if pnl > 0: wins += 1
+        if count > 0:
+            out[run_id] = (count, wins, balance_no_fee, balance_with_fee)
+    return out
+
+def cube_fee_math(cube, target_months=None, initial_capital=1000000):
+    # 대시보드 aggregate_runs 와 같은 계산 (build_agg_cube 의 로그 수익 합 → 잔고)
+    mask = np.ones(len(cube), dtype=bool)
+    if target_months: mask &= cube['month'].isin(target_months).to_numpy()
+    per_run = cube[mask].groupby('run_id').agg(trades=('trades', 'sum'), wins=('wins', 'sum'),
+                                               log_ret=('log_ret', 'sum'), log_ret_fee=('log_ret_fee', 'sum'))
+    per_run = per_run[per_run['trades'] > 0]
+    return {int(r): (int(t), int(w), initial_capital * math.exp(lr), initial_capital * math.exp(lf))
+            for r, t, w, lr, lf in zip(per_run.index, per_run['trades'], per_run['wins'], per_run['log_ret'], per_run['log_ret_fee'])}
+
+# --- 비교 대상 엔진 (이름 → func(df, params) → 결과 dict), 새 구현은 여기에 추가해서 같이 검증 ---
+def _engine_spec(df, params):
+    return d1_analyzer.run_strategy_spec(d1_analyzer.hybrid_spec("", params), df, cache=d1_analyzer.IndicatorCache())
+
+def _engine_hybrid(df, params):
+    if df is None or df.empty or len(df) < 202: return None
+    ind = d1_analyzer.compute_hybrid_indicators(df, cache=d1_analyzer.IndicatorCache())
+    return d1_analyzer.simulate_hybrid(ind['close'], ind['low'], ind['rsi'], ind['bb_lower'], ind['bb_mid'], ind['sma_202'],
+                                       df.index, params, w_pattern=ind['w_pattern'])
+
+def _engine_stream(df, params):
+    if df is None or df.empty or len(df) < 202: return None
+    return d1_analyzer.HybridStream.from_frame(df, params=params).result()
+
+ENGINES = {
+    "spec": _engine_spec,
+    "hybrid": _engine_hybrid,
+    "stream": _engine_stream,
+}
+
+# --- 픽스처 ---
+def _mean_reverting(n_bars, seed, volatility=0.01, freq="5min", start="2024-01-01", price=100.0, index=None):
+    # 약한 평균회귀 로그 가격: 진입/청산/구조대가 자주 일어나게
+    rng = np.random.default_rng(seed)
+    shocks = rng.normal(0, volatility, n_bars)
+    log_p = np.empty(n_bars)
+    x = 0.0
+    for i in range(n_bars):
+        x = x * 0.98 + shocks[i]
+        log_p[i] = x
+    close = price * np.exp(log_p)
+    open_ = np.r_[price, close[:-1]]
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, volatility / 2, n_bars)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, volatility / 2, n_bars)))
+    volume = rng.integers(1, 1000, n_bars).astype(np.float64)
+    if index is None: index = pd.date_range(start, periods=n_bars, freq=freq)
+    return pd.DataFrame({"open": open_, "high": high, "low": low, "close": close, "volume": volume}, index=index)
+
+def _rescue_episodes(n_bars, seed, volatility=0.0015, freq="5min", start="2024-01-01", price=100.0):
+    # 급락 → 밴드 복귀 진입 → 더 밀림 → 손실 중 급등(RSI > 70, 구조대 모드) → 완만히 본전 회복 을 반복
+    rng = np.random.default_rng(seed)
+    steps = []
+    while len(steps) < n_bars:
+        steps += list(rng.normal(0, volatility, rng.integers(40, 80)))
+        steps += list(rng.uniform(-0.008, -0.004, rng.integers(6, 10)))
+        steps += [rng.uniform(0.004, 0.008)]
+        steps += list(rng.normal(-0.0012, volatility, rng.integers(20, 35)))
+        steps += list(rng.uniform(0.002, 0.004, rng.integers(8, 12)))
+        steps += list(rng.normal(0.0006, volatility, rng.integers(40, 60)))
+    close = price * np.exp(np.cumsum(steps[:n_bars]))
+    open_ = np.r_[price, close[:-1]]
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, volatility / 2, n_bars)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, volatility / 2, n_bars)))
+    volume = rng.integers(1, 1000, n_bars).astype(np.float64)
+    index = pd.date_range(start, periods=n_bars, freq=freq)
+    return pd.DataFrame({"open": open_, "high": high, "low": low, "close": close, "volume": volume}, index=index)
+
+def _session_index(n_bars, start="2024-01-02"):
+    # 야후 분봉 모양: 뉴욕 장중 5분봉만 (밤/주말 공백, tz 있는 인덱스)
+    days = pd.bdate_range(start, periods=n_bars // 78 + 2)
+    stamps = [pd.Timestamp(d) + pd.Timedelta(hours=9, minutes=30) + pd.Timedelta(minutes=5 * k) for d in days for k in range(78)]
+    return pd.DatetimeIndex(stamps[:n_bars]).tz_localize("America/New_York")
+
+def synthetic_fixture(kind, seed, n_bars=N_BARS):
+    if kind == "walk":
+        return make_synthetic_ohlcv(n_bars, seed=seed, volatility=0.006)
+    if kind == "revert":
+        return _mean_reverting(n_bars, seed)
+    if kind == "ticks":
+        # 호가 단위로 반올림: 같은 가격/손익 0/기준선과 정확히 같은 값 등 경계 조건이 자주 생긴다
+        df = _mean_reverting(n_bars, seed, volatility=0.004)
+        tick = 0.05
+        for col in ['open', 'high', 'low', 'close']:
+            df[col] = np.round(df[col] / tick) * tick
+        df['low'] = np.minimum(df['low'], np.minimum(df['open'], df['close']))
+        df['high'] = np.maximum(df['high'], np.maximum(df['open'], df['close']))
+        return df
+    if kind == "session":
+        # 장중 공백 + 가격이 멈춘 구간 (RSI 0/0 → NaN, 밴드 폭 0)
+        df = _mean_reverting(n_bars, seed, index=_session_index(n_bars))
+        rng = np.random.default_rng(seed + 1)
+        for lo in rng.integers(210, max(n_bars - 40, 211), size=3):
+            df.iloc[lo:lo + 30, :4] = df['close'].iloc[lo - 1]
+        return df
+    if kind == "rescue":
+        return _rescue_episodes(n_bars, seed)
+    raise ValueError(f"알 수 없는 합성 픽스처: {kind}")
+
+def synthetic_fixtures(kinds=SYNTHETIC_KINDS, seeds=range(N_SEEDS), n_bars=N_BARS):
+    return {f"{kind}-{seed}": synthetic_fixture(kind, seed, n_bars) for kind in kinds for seed in seeds}
+
+def recorded_fixtures(assets=None, intervals=None, max_bars=N_BARS, store=None):
+    # 봉 저장소에 받아 둔 실제 봉 (없는 종목은 건너뜀, 다운로드 없음)
+    if assets is None: assets = d1_analyzer.ASSET_LIST
+    if intervals is None: intervals = d1_analyzer.INTERVALS
+    out = {}
+    for asset in assets:
+        for interval in intervals:
+            try:
+                df = d1_analyzer.read_bars(asset['source'], asset['ticker'], interval, max_bars=max_bars, store=store)
+            except Exception as e:
+                print(f"Error reading {asset['ticker']}: {e}", file=sys.stderr)
+                continue
+            if len(df) > d1_analyzer.WARMUP_BARS:
+                out[f"{asset['ticker']}-{interval}"] = df
+    return out
+
+def load_fixture_file(path, max_bars=None):
+    # 첫 컬럼(또는 인덱스)이 시각인 CSV/Parquet OHLCV
+    if path.endswith(".parquet"):
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_csv(path, index_col=0)
+    if not isinstance(df.index, pd.DatetimeIndex):
+        df.index = pd.to_datetime(df.index)
+    df = df[['open', 'high', 'low', 'close', 'volume']].astype(np.float64).sort_index()
+    return df.iloc[-max_bars:] if max_bars else df
+
+# --- 비교 ---
+def _trade_rows(res, positions):
+    rows = []
+    for t in res["trade_history"]:
+        rows.append({'bar': positions.get(t['time'], -1), 'type': t['type'], 'reason': t['reason'],
+                     'price': t['price'], 'pnl': t.get('pnl', math.nan), 'balance': t['balance']})
+    return rows
+
+def _equity(res):
+    curve = res["equity_curve"]
+    if isinstance(curve, d1_analyzer.EquityCurve): return curve.balance
+    return np.array([r['balance'] for r in curve], dtype=np.float64)
+
+def _same(a, b, rtol, atol):
+    if isinstance(a, float) or isinstance(b, float):
+        if a != a and b != b: return True  # 둘 다 NaN
+        return math.isclose(a, b, rel_tol=rtol, abs_tol=atol)
+    return a == b
+
+def first_divergence(ref, cand, index, rtol=RTOL, atol=ATOL):
+    # 반환: None (같음) 또는 {"bar", "field", "reference", "candidate"} (가장 먼저 달라지는 봉 기준)
+    if ref is None or cand is None:
+        if ref is None and cand is None: return None
+        return {"bar": None, "field": "result", "reference": ref is not None, "candidate": cand is not None}
+
+    found = []
+    positions = {str(t): i for i, t in enumerate(index)}
+    ref_trades, cand_trades = _trade_rows(ref, positions), _trade_rows(cand, positions)
+    for k in range(max(len(ref_trades), len(cand_trades))):
+        a = ref_trades[k] if k < len(ref_trades) else None
+        b = cand_trades[k] if k < len(cand_trades) else None
+        if a is None or b is None:
+            # 한쪽에만 있는 거래
+            found.append({"bar": (a or b)['bar'], "field": f"trade[{k}]", "reference": a and a['type'], "candidate": b and b['type']})
+            break
+        bad = [f for f in TRADE_FIELDS if not _same(a[f], b[f], rtol, atol)]
+        if bad:
+            found.append({"bar": min(a['bar'], b['bar']), "field": f"trade[{k}].{bad[0]}", "reference": a[bad[0]], "candidate": b[bad[0]]})
+            break
+
+    ref_eq, cand_eq = _equity(ref), _equity(cand)
+    if len(ref_eq) != len(cand_eq):
+        found.append({"bar": min(len(ref_eq), len(cand_eq)), "field": "equity.length", "reference": len(ref_eq), "candidate": len(cand_eq)})
+    else:
+        bad = ~np.isclose(ref_eq, cand_eq, rtol=rtol, atol=atol)
+        if bad.any():
+            i = int(bad.argmax())
+            found.append({"bar": i, "field": "equity", "reference": float(ref_eq[i]), "candidate": float(cand_eq[i])})
+
+    if not found:
+        for key in ['return', 'win_rate', 'trades', 'last_price']:
+            if not _same(ref[key], cand[key], rtol, atol):
+                return {"bar": None, "field": key, "reference": ref[key], "candidate": cand[key]}
+        return None
+    return min(found, key=lambda d: d["bar"])
+
+def _row(fixture, check, engine, div, index, seconds):
+    bar = div["bar"] if div else None
+    return {
+        "fixture": fixture, "check": check, "engine": engine, "ok": div is None,
+        "first_bar": bar,
+        "time": index[bar] if bar is not None and 0 <= bar < len(index) else None,
+        "field": div["field"] if div else None,
+        "reference": div["reference"] if div else None,
+        "candidate": div["candidate"] if div else None,
+        "seconds": seconds,
+    }
+
+def check_double_bottom_flags(df):
+    # check_double_bottom (봉 하나씩) 과 double_bottom_flags (전체 일괄) 가 같은 봉에서 참인지
+    low = df['low']
+    ref = np.array([d1_analyzer.check_double_bottom(low, i) for i in range(len(low))], dtype=bool)
+    t0 = time.perf_counter()
+    fast = d1_analyzer.double_bottom_flags(low.to_numpy(dtype=np.float64))
+    seconds = time.perf_counter() - t0
+    bad = ref != fast
+    if not bad.any(): return None, seconds
+    i = int(bad.argmax())
+    return {"bar": i, "field": "w_pattern", "reference": bool(ref[i]), "candidate": bool(fast[i])}, seconds
+
+def check_fee_math(results, rtol=RTOL, atol=ATOL):
+    # 원래의 거래별 수수료 루프 vs 로그 수익 큐브 집계, 전체 기간과 월별 필터 각각
+    cube = d1_analyzer.build_agg_cube(results)
+    months = sorted(set(cube['month'].astype(str)))
+    for target in [None] + [[m] for m in months] + ([months[::2]] if len(months) > 2 else []):
+        ref = reference_fee_math(results, target)
+        fast = cube_fee_math(cube, target)
+        for run_id in sorted(set(ref) | set(fast)):
+            a, b = ref.get(run_id), fast.get(run_id)
+            label = f"run[{run_id}] months={','.join(target) if target else 'all'}"
+            if a is None or b is None:
+                return {"bar": None, "field": label, "reference": a, "candidate": b}
+            for name, x, y in zip(['trades', 'wins', 'balance', 'balance_fee'], a, b):
+                if not _same(float(x), float(y), rtol, atol * 1e6):  # 잔고는 원 단위
+                    return {"bar": None, "field": f"{label} {name}", "reference": x, "candidate": y}
+    return None
+
+# --- 회귀 검사 (리뷰에서 잡힌 버그가 다시 생기지 않도록) ---
+# 이름 → 인자 없는 함수, 통과면 None, 실패면 {"field", "reference", "candidate"}
+def _check_fingerprint_tz():
+    # tz 있는 봉(야후)을 따로 만든 두 복사본의 지문이 같아야 지표/결과 캐시가 맞는다
+    df = synthetic_fixture("session", 0, 500)
+    a = d1_analyzer.frame_fingerprint(df.copy(deep=True))
+    b = d1_analyzer.frame_fingerprint(pd.DataFrame(df.to_dict("series")))
+    if a != b: return {"field": "frame_fingerprint", "reference": a, "candidate": b}
+    utc = d1_analyzer.frame_fingerprint(df.tz_convert("UTC"))
+    if utc == a: return {"field": "frame_fingerprint(tz)", "reference": a, "candidate": utc}
+    return None
+
+def _check_result_cache_hits():
+    # 저장된 봉으로 같은 분석을 다시 돌리면 (야후 tz 인덱스 포함) 모든 결과가 결과 캐시에서 나와야 한다
+    with tempfile.TemporaryDirectory() as root:
+        store = d1_store.BarStore(os.path.join(root, "bars"))
+        for k, asset in enumerate(d1_analyzer.ASSET_LIST):
+            kind = "session" if asset['source'] == "yahoo" else "revert"
+            store.append(asset['source'], asset['ticker'], d1_analyzer.BASE_INTERVAL, synthetic_fixture(kind, k, 1500))
+        cache = d1_analyzer.ResultCache(os.path.join(root, "results"))
+        prev, d1_analyzer.BAR_STORE = d1_analyzer.BAR_STORE, store
+        try:
+            expected = len(d1_analyzer.get_d1_analysis(cache=cache, refresh=False))
+            for label, kwargs in [("serial", {}), ("pipelined", {"pipelined": True, "cpu_workers": 0})]:
+                hits = cache.hits
+                results = d1_analyzer.get_d1_analysis(cache=cache, refresh=False, **kwargs)
+                if cache.hits - hits != expected or len(results) != expected:
+                    return {"field": f"cache hits ({label})", "reference": expected, "candidate": cache.hits - hits}
+        finally:
+            d1_analyzer.BAR_STORE = prev
+    return None
+
+def _check_upbit_history_end():
+    # 상장 이전(pyupbit 가 None 을 돌려주는 구간)까지 내려가도 받은 봉이 커밋되고, 실제 오류만 재시도해야 한다
+    df = synthetic_fixture("revert", 0, 1000)
+    calls = {"n": 0}
+
+    def fetch(ticker, interval, count, to):
+        calls["n"] += 1
+        if calls["n"] == 2: raise ConnectionError("일시 오류")
+        end = pd.Timestamp(to).tz_convert("Asia/Seoul").tz_localize(None) if to is not None else None
+        page = df if end is None else df[df.index < end]
+        return page.iloc[-count:] if len(page) else None
+
+    with tempfile.TemporaryDirectory() as root:
+        store = d1_store.BarStore(root)
+        start = df.index[0] - pd.Timedelta(days=30)
+        added = d1_analyzer.download_upbit_history("KRW-TEST", d1_analyzer.BASE_INTERVAL, start, store=store,
+                                                   limiter=d1_analyzer.TokenBucket(rate=1e6), fetch=fetch)
+        got = store.read("upbit", "KRW-TEST", d1_analyzer.BASE_INTERVAL)
+        if added != len(df) or not got.index.equals(df.index):
+            return {"field": "download_upbit_history", "reference": len(df), "candidate": len(got)}
+        if store.staged_first_timestamp("upbit", "KRW-TEST", d1_analyzer.BASE_INTERVAL) is not None:
+            return {"field": "download_upbit_history(staging)", "reference": None, "candidate": "남아 있음"}
+    return None
+
+def _check_bootstrap_segments():
+    # 평평한 배열 위의 재표본 통계 == 실행별 루프 (같은 거래를 여러 번 뽑아 크게 떨어지는 경로 포함)
+    rng = np.random.default_rng(0)
+    pnls = [rng.standard_t(3, size=n) * 0.05 for n in rng.integers(5, 80, size=12)]
+    pnls[3][7] = -0.9  # 큰 손실 한 번 → 그 거래만 반복해 뽑으면 원본 |수익| 합보다 훨씬 깊게 떨어진다
+    logs = [np.log1p(np.clip(p, -0.9, None)) for p in pnls]
+    log_ret = np.concatenate(logs)
+    for block in (None, 5):
+        layout = d1_bootstrap._layout([len(p) for p in pnls], block)
+        idx = d1_bootstrap._sample_index(rng, 200, layout, block)
+        # 실행마다 가장 나쁜/좋은 거래만 계속 뽑는 극단 경로
+        worst = layout["starts"] + np.array([np.argmin(x) for x in logs])
+        best = layout["starts"] + np.array([np.argmax(x) for x in logs])
+        idx = np.vstack([idx, worst[layout["seg"]], best[layout["seg"]]])
+        final, drawdown = d1_bootstrap._resample_stats(log_ret, layout, idx)
+        for r, (a, b) in enumerate(zip(layout["starts"], layout["ends"] + 1)):
+            path = np.concatenate([np.zeros((len(idx), 1)), np.cumsum(log_ret[idx[:, a:b]], axis=1)], axis=1)
+            ref_dd = (np.maximum.accumulate(path, axis=1) - path).max(axis=1)
+            if not np.allclose(final[:, r], path[:, -1]) or not np.allclose(drawdown[:, r], ref_dd):
+                bad = int(np.argmax(np.abs(drawdown[:, r] - ref_dd)))
+                return {"field": f"bootstrap drawdown(block={block}, run={r})", "reference": float(ref_dd[bad]),
+                        "candidate": float(drawdown[bad, r])}
+    return None
+
+def _check_store_tail_refresh():
+    # 마지막 봉을 다시 받는 갱신은 파일을 새로 쓰지 않고 끝부분만 덮어써야 한다 (결과는 전체 교체와 같아야 함)
+    df = synthetic_fixture("session", 0, 600)
+    with tempfile.TemporaryDirectory() as root:
+        store = d1_store.BarStore(root)
+        store.append("yahoo", "TEST", "5분", df.iloc[:500])
+        before = store.read("yahoo", "TEST", "5분")
+        path = os.path.join(store.path("yahoo", "TEST", "5분"), "close.f8")
+        inode = os.stat(path).st_ino
+        fresh = df.iloc[498:520].copy()
+        fresh["close"] += 1.0
+        store.append("yahoo", "TEST", "5분", fresh)
+        expected = pd.concat([df.iloc[:498], fresh])
+        got = store.read("yahoo", "TEST", "5분")
+        if os.stat(path).st_ino != inode:
+            return {"field": "BarStore.append(끝부분 겹침)", "reference": "덮어쓰기", "candidate": "전체 다시 쓰기"}
+        if not got.index.equals(expected.index) or not np.array_equal(got["close"].to_numpy(), expected["close"].to_numpy()):
+            return {"field": "BarStore.append(끝부분 겹침)", "reference": len(expected), "candidate": len(got)}
+        if len(before) != 500 or before["close"].iloc[-3] != df["close"].iloc[497]:
+            return {"field": "BarStore.read(이전 매핑)", "reference": float(df["close"].iloc[497]), "candidate": float(before["close"].iloc[-3])}
+    return None
+
+def _recent_bars(n_bars, tz=None, seed=0):
+    # 지금 시각에서 끝나는 연속 5분봉 (업비트는 KST 벽시계, 야후는 tz 포함)
+    now = pd.Timestamp.now(tz=tz or "Asia/Seoul").floor("5min")
+    if tz is None: now = now.tz_localize(None)
+    df = synthetic_fixture("revert", seed, n_bars)
+    df.index = pd.date_range(end=now, periods=n_bars, freq="5min")
+    return df
+
+def _gap(index):
+    # 저장된 봉 사이의 가장 긴 간격
+    return pd.DatetimeIndex(index).to_series().diff().max()
+
+def _check_refresh_after_pause():
+    # 갱신이 오래 밀려도 (업비트 REQ_COUNT 개 초과, 야후 분봉 제공 기간 초과) 저장소에 빈 구간이 생기면 안 된다
+    step = pd.Timedelta(minutes=5)
+    full = _recent_bars(d1_analyzer.REQ_COUNT * 2)
+    upbit = types.SimpleNamespace(get_ohlcv=lambda ticker, interval, count, to=None: full.iloc[-count:])
+    capped = types.SimpleNamespace(get_ohlcv=lambda ticker, interval, count, to=None: full.iloc[-min(count, 500):])
+    hourly = _recent_bars(120 * 288, tz="America/New_York")
+
+    def download(tickers, start=None, period=None, **kwargs):
+        recent = hourly[hourly.index >= hourly.index[-1] - pd.Timedelta(days=30)]
+        return (recent if start is None else hourly[hourly.index >= start]).rename(columns=str.capitalize)
+
+    with tempfile.TemporaryDirectory() as root:
+        store = d1_store.BarStore(root)
+        store.append("upbit", "KRW-X", "5분", full.iloc[:d1_analyzer.REQ_COUNT // 2])
+        store.append("upbit", "KRW-Y", "5분", full.iloc[:d1_analyzer.REQ_COUNT // 2])
+        store.append("yahoo", "T", "5분", hourly.iloc[:len(hourly) // 4])
+        prev = d1_analyzer.BAR_STORE, d1_analyzer.yf
+        d1_analyzer.BAR_STORE, d1_analyzer.yf = store, types.SimpleNamespace(download=download)
+        try:
+            d1_analyzer._refresh_upbit(upbit, "KRW-X", "5분")
+            errors = d1_analyzer._refresh_upbit(capped, "KRW-Y", "5분")
+            d1_analyzer._refresh_yahoo(["T"], "5분")
+        finally:
+            d1_analyzer.BAR_STORE, d1_analyzer.yf = prev
+        for ticker, source in [("KRW-X", "upbit"), ("KRW-Y", "upbit"), ("T", "yahoo")]:
+            got = store.read(source, ticker, "5분")
+            if _gap(got.index) != step:
+                return {"field": f"{source} {ticker} 최대 봉 간격", "reference": str(step), "candidate": str(_gap(got.index))}
+        if store.count("upbit", "KRW-X", "5분") != len(full):
+            return {"field": "upbit 밀린 갱신", "reference": len(full), "candidate": store.count("upbit", "KRW-X", "5분")}
+        if not errors:
+            return {"field": "upbit 일부만 받은 갱신", "reference": "오류", "candidate": "오류 없음"}
+        if store.last_timestamp("yahoo", "T", "5분") != hourly.index[-1]:
+            return {"field": "yahoo 밀린 갱신", "reference": str(hourly.index[-1]), "candidate": str(store.last_timestamp("yahoo", "T", "5분"))}
+    return None
+
+def _check_cold_start_span():
+    # 빈 저장소에서 상위 봉 길이를 요청해도 REQ_COUNT 개를 만들 만큼 받아야 한다 (업비트 15분 ← 5분, 야후 4시간 ← 1시간)
+    full = _recent_bars(d1_analyzer.REQ_COUNT * 4)
+    hourly = _recent_bars(d1_analyzer.REQ_COUNT * 8, tz="America/New_York")
+    hourly.index = pd.date_range(end=hourly.index[-1], periods=len(hourly), freq="1h")
+
+    def get_ohlcv(ticker, interval, count, to=None):
+        page = full if to is None else full[full.index < pd.Timestamp(to).tz_convert("Asia/Seoul").tz_localize(None)]
+        return page.iloc[-count:] if len(page) else None
+
+    def download(tickers, start=None, period=None, interval=None, **kwargs):
+        if interval != "1h": return pd.DataFrame()
+        return (hourly if start is None else hourly[hourly.index >= start]).rename(columns=str.capitalize)
+
+    jobs = [("KRW-X", "upbit", "5분"), ("KRW-X", "upbit", "15분"), ("T", "yahoo", "4시간")]
+    with tempfile.TemporaryDirectory() as root:
+        store = d1_store.BarStore(root)
+        prev = d1_analyzer.BAR_STORE, d1_analyzer.yf
+        d1_analyzer.BAR_STORE, d1_analyzer.yf = store, types.SimpleNamespace(download=download)
+        try:
+            for _, fn in d1_analyzer.bulk_refresh_tasks(jobs, types.SimpleNamespace(get_ohlcv=get_ohlcv)):
+                fn()
+        finally:
+            d1_analyzer.BAR_STORE, d1_analyzer.yf = prev
+        for ticker, source, interval in jobs:
+            got = d1_analyzer.read_bars(source, ticker, interval, store=store)
+            if len(got) < d1_analyzer.REQ_COUNT:
+                return {"field": f"{source} {ticker} {interval} 봉 수", "reference": d1_analyzer.REQ_COUNT, "candidate": len(got)}
+    return None
+
+REGRESSION_CHECKS = {
+    "fingerprint_tz": _check_fingerprint_tz,
+    "result_cache_hits": _check_result_cache_hits,
+    "upbit_history_end": _check_upbit_history_end,
+    "bootstrap_segments": _check_bootstrap_segments,
+    "store_tail_refresh": _check_store_tail_refresh,
+    "refresh_after_pause": _check_refresh_after_pause,
+    "cold_start_span": _check_cold_start_span,
+}
+
+def run_regression_checks(checks=None):
+    if checks is None: checks = REGRESSION_CHECKS
+    rows = []
+    for name, func in checks.items():
+        t0 = time.perf_counter()
+        try:
+            div = func()
+        except Exception as e:
+            div = {"field": "error", "reference": None, "candidate": f"{type(e).__name__}: {e}"}
+        if div is not None: div = {"bar": None, **div}
+        rows.append(_row("-", name, "regression", div, pd.RangeIndex(0), time.perf_counter() - t0))
+    return _report(rows)
+
+def _report(rows):
+    report = pd.DataFrame(rows, columns=REPORT_COLUMNS, dtype=object)  # 기준/후보 값은 종류가 섞여 있어 그대로 둔다
+    report['ok'] = report['ok'].astype(bool)
+    report['first_bar'] = report['first_bar'].astype('Int64')
+    report['seconds'] = report['seconds'].astype(np.float64)
+    return report
+
+# --- 실행 ---
+def run_equivalence(fixtures, engines=None, strategies=REFERENCE_STRATEGIES, rtol=RTOL, atol=ATOL,
+                    double_bottom=True, fee_math=True, progress_callback=None):
+    # fixtures: {이름: OHLCV df}, engines: {이름: func(df, params)} (기본 ENGINES 전체)
+    # 반환: 픽스처 × 검사 × 엔진 별 한 줄 (ok=False 면 처음 달라진 봉/항목/값)
+    if engines is None: engines = ENGINES
+    rows = []
+    fee_results = []
+    for k, (name, df) in enumerate(fixtures.items()):
+        if progress_callback:
+            progress_callback(k, len(fixtures), f"[{name}] 비교 중...")
+        for strat_name, params in strategies:
+            t0 = time.perf_counter()
+            ref = reference_hybrid(df, params)
+            rows.append(_row(name, strat_name, "reference", None, df.index, time.perf_counter() - t0))
+            for engine, func in engines.items():
+                t0 = time.perf_counter()
+                try:
+                    res = func(df, params)
+                except Exception as e:
+                    rows.append(_row(name, strat_name, engine, {"bar": None, "field": "error", "reference": None,
+                                                                "candidate": f"{type(e).__name__}: {e}"}, df.index, time.perf_counter() - t0))
+                    continue
+                seconds = time.perf_counter() - t0
+                rows.append(_row(name, strat_name, engine, first_divergence(ref, res, df.index, rtol, atol), df.index, seconds))
+                if fee_math and engine == "spec" and res:
+                    asset = {"name": name, "ticker": name, **FEE_ASSETS[k % len(FEE_ASSETS)]}
+                    fee_results.extend(d1_analyzer._result_rows(asset, "5분", [(strat_name, res)]))
+        if double_bottom:
+            div, seconds = check_double_bottom_flags(df)
+            rows.append(_row(name, "double_bottom", "double_bottom_flags", div, df.index, seconds))
+
+    if fee_math and fee_results:
+        t0 = time.perf_counter()
+        div = check_fee_math(fee_results, rtol, atol)
+        rows.append(_row("all", "fee_math", "build_agg_cube", div, pd.RangeIndex(0), time.perf_counter() - t0))
+    if progress_callback:
+        progress_callback(len(fixtures), len(fixtures), "완료")
+    return _report(rows)
+
+def format_report(report):
+    lines = []
+    checked = report[report['engine'] != 'reference']
+    for row in checked[~checked['ok']].itertuples():
+        where = f"봉 {row.first_bar} ({row.time})" if not pd.isna(row.first_bar) else "-"
+        lines.append(f"DIVERGED {row.fixture:<20} {row.check:<16} {row.engine:<20} {where}: {row.field} "
+                     f"기준={row.reference!r} 후보={row.candidate!r}")
+    timing = report.groupby('engine', sort=False)['seconds'].sum()
+    lines.append(f"{len(checked)} 개 비교, {int((~checked['ok']).sum())} 개 불일치 | "
+                 + ", ".join(f"{engine} {seconds:.2f}초" for engine, seconds in timing.items()))
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="D1 전략 기준 루프 vs 빠른 엔진 차등 검증")
+    parser.add_argument("--kinds", nargs="+", default=SYNTHETIC_KINDS, choices=SYNTHETIC_KINDS)
+    parser.add_argument("--seeds", type=int, default=N_SEEDS, help="합성 픽스처 종류별 시드 개수")
+    parser.add_argument("--bars", type=int, default=N_BARS)
+    parser.add_argument("--recorded", action="store_true", help="봉 저장소의 실제 봉도 포함")
+    parser.add_argument("--files", nargs="+", default=[], help="CSV/Parquet OHLCV 파일")
+    parser.add_argument("--engines", nargs="+", choices=list(ENGINES), help="비교할 엔진 (기본: 전체)")
+    parser.add_argument("--rtol", type=float, default=RTOL)
+    parser.add_argument("--atol", type=float, default=ATOL)
+    parser.add_argument("--no-checks", action="store_true", help="회귀 검사(REGRESSION_CHECKS) 생략")
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args(argv)
+
+    fixtures = synthetic_fixtures(args.kinds, range(args.seeds), args.bars)
+    if args.recorded: fixtures.update(recorded_fixtures(max_bars=args.bars))
+    for path in args.files:
+        fixtures[os.path.basename(path)] = load_fixture_file(path, args.bars)
+    engines = {name: ENGINES[name] for name in args.engines} if args.engines else ENGINES
+
+    progress = None if args.quiet else (lambda c, n, m: print(f"[{c}/{n}] {m}", file=sys.stderr))
+    report = run_equivalence(fixtures, engines, rtol=args.rtol, atol=args.atol, progress_callback=progress)
+    if not args.no_checks:
+        report = pd.concat([report, run_regression_checks()], ignore_index=True)
+    print(format_report(report))
+    return 0 if report['ok'].all() else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,246 @@
+import json
+import os
+import threading
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+# --- 설정 ---
+# 종목/봉 길이별 OHLCV 를 컬럼별 원시 배열 파일(int64 타임스탬프 + float64 값)로 저장하고
+# 읽을 때는 메모리 매핑해서 API 한 번 호출 분량보다 긴 기록도 부담 없이 다룬다
+DATA_DIR = os.environ.get("D1_DATA_DIR", os.path.join(os.path.expanduser("~"), ".d1_backtest", "bars"))
+
+TS_FILE = "ts.i8"
+META_FILE = "meta.json"
+STAGING_SUFFIX = ".staging"  # 과거 방향 페이지 다운로드를 임시로 쌓아 두는 디렉터리
+
+def _safe_name(name):
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in str(name))
+
+def _to_ns(index):
+    # tz 가 있으면 UTC 기준, 없으면 벽시계 시각 그대로 ns 정수로
+    return pd.DatetimeIndex(index).as_unit("ns").asi8
+
+def _from_ns(ts, meta):
+    index = pd.DatetimeIndex(np.asarray(ts).view("M8[ns]"), name=meta.get("index_name"))
+    if meta.get("tz"):
+        index = index.tz_localize("UTC").tz_convert(meta["tz"])
+    return index
+
+def _write_atomic(path, chunks):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        for chunk in chunks:
+            f.write(np.ascontiguousarray(chunk).tobytes())
+    os.replace(tmp, path)
+
+class BarStore:
+    def __init__(self, root=DATA_DIR):
+        self.root = root
+        self._lock = threading.RLock()
+
+    def path(self, source, ticker, interval):
+        return os.path.join(self.root, _safe_name(source), _safe_name(ticker), _safe_name(interval))
+
+    def _load_meta(self, d):
+        try:
+            with open(os.path.join(d, META_FILE), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _save_meta(self, d, meta):
+        tmp = os.path.join(d, META_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(d, META_FILE))
+
+    def _count(self, d, meta):
+        # 중간에 끊긴 쓰기가 있어도 모든 컬럼이 갖춘 길이까지만 유효
+        sizes = [os.path.getsize(os.path.join(d, name)) // 8 if os.path.exists(os.path.join(d, name)) else 0
+                 for name in [TS_FILE] + [c + ".f8" for c in meta["columns"]]]
+        return min(sizes)
+
+    def _column(self, d, name, n):
+        if n == 0: return np.empty(0, dtype=np.int64 if name == TS_FILE else np.float64)
+        dtype = np.int64 if name == TS_FILE else np.float64
+        return np.memmap(os.path.join(d, name), dtype=dtype, mode="r", shape=(n,))
+
+    def count(self, source, ticker, interval):
+        d = self.path(source, ticker, interval)
+        meta = self._load_meta(d)
+        return self._count(d, meta) if meta else 0
+
+    def last_timestamp(self, source, ticker, interval):
+        d = self.path(source, ticker, interval)
+        meta = self._load_meta(d)
+        if not meta: return None
+        n = self._count(d, meta)
+        if n == 0: return None
+        return _from_ns(self._column(d, TS_FILE, n)[n-1:n], meta)[0]
+
+    def first_timestamp(self, source, ticker, interval):
+        d = self.path(source, ticker, interval)
+        meta = self._load_meta(d)
+        if not meta: return None
+        n = self._count(d, meta)
+        if n == 0: return None
+        return _from_ns(self._column(d, TS_FILE, n)[:1], meta)[0]
+
+    def read(self, source, ticker, interval, start=None, max_bars=None):
+        d = self.path(source, ticker, interval)
+        # 매핑은 잠금 안에서 연다: append 가 겹침 구간을 새 파일로 바꾸는 도중이면
+        # 시각 컬럼은 예전 파일, 값 컬럼은 새 파일을 보게 되어 행이 어긋날 수 있다 (길이만 맞추는 _count 로는 못 막음)
+        with self._lock:
+            meta = self._load_meta(d)
+            if not meta: return pd.DataFrame()
+            n = self._count(d, meta)
+            ts = self._column(d, TS_FILE, n)
+            cols = {c: self._column(d, c + ".f8", n) for c in meta["columns"]}
+
+        lo = 0
+        if start is not None:
+            lo = int(np.searchsorted(ts, _to_ns(pd.DatetimeIndex([start]))[0], side="left"))
+        if max_bars:
+            lo = max(lo, n - max_bars)
+
+        data = {c: arr[lo:] for c, arr in cols.items()}
+        return pd.DataFrame(data, index=_from_ns(ts[lo:], meta), copy=False)
+
+    def append(self, source, ticker, interval, df):
+        # 새 봉을 저장: 겹치는 구간은 새 값으로 교체(중복 제거), 뒤에 붙는 경우는 파일 끝에 추가만 한다
+        if df is None or df.empty: return 0
+        df = df[~df.index.duplicated(keep="last")].sort_index()
+
+        with self._lock:
+            d = self.path(source, ticker, interval)
+            os.makedirs(d, exist_ok=True)
+            meta = self._load_meta(d)
+            if meta is None:
+                tz = pd.DatetimeIndex(df.index).tz
+                meta = {
+                    "columns": [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c])],
+                    "tz": str(tz) if tz is not None else None,
+                    "index_name": df.index.name,
+                }
+            n_old = self._count(d, meta)
+
+            new_cols = {TS_FILE: _to_ns(df.index)}
+            for c in meta["columns"]:
+                new_cols[c + ".f8"] = df[c].to_numpy(dtype=np.float64) if c in df.columns else np.full(len(df), np.nan)
+
+            ts_new = new_cols[TS_FILE]
+            head = tail = n_old
+            keep_mid = order = None
+            in_place = False
+            if n_old:
+                ts_old = self._column(d, TS_FILE, n_old)
+                head = int(np.searchsorted(ts_old, ts_new[0], side="left"))
+                tail = int(np.searchsorted(ts_old, ts_new[-1], side="right"))
+                # 갱신 때마다 다시 받는 마지막 (아직 만들어지는 중인) 봉처럼 끝부분만 같은 시각으로 겹치는 경우
+                in_place = tail == n_old and np.array_equal(ts_old[head:], ts_new[:n_old - head])
+                if head < n_old and not in_place:
+                    # 겹치는 구간의 기존 봉 중 새 데이터에 없는 봉은 남기고, 같은 시각은 새 값으로 교체
+                    mid_ts = np.asarray(ts_old[head:tail])
+                    keep_mid = ~np.isin(mid_ts, ts_new)
+                    order = np.argsort(np.concatenate([mid_ts[keep_mid], ts_new]), kind="stable")
+                del ts_old
+
+            for name, arr in new_cols.items():
+                path = os.path.join(d, name)
+                if head == n_old or in_place:
+                    # 순수 추가 / 끝부분 겹침: head 부터 덮어쓰고 이어 쓴다 (전체를 다시 쓰지 않음)
+                    # 파일은 n_old 아래로 줄이지 않는다 → 이미 열린 매핑은 유효하고, 겹친 봉의 값만 새 값으로 보인다
+                    with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+                        f.seek(head * 8)
+                        f.write(np.ascontiguousarray(arr).tobytes())
+                        f.truncate()  # 중간에 끊긴 쓰기가 남긴 꼬리 제거
+                else:
+                    # 겹침/앞쪽 삽입: 새 파일로 다시 써서 교체 (읽는 쪽 매핑은 이전 파일을 계속 본다)
+                    old = self._column(d, name, n_old)
+                    mid = np.concatenate([np.asarray(old[head:tail])[keep_mid], arr])[order]
+                    _write_atomic(path, [old[:head], mid, old[tail:]])
+                    del old
+
+            meta["updated_at"] = datetime.now().isoformat()
+            self._save_meta(d, meta)
+            return self._count(d, meta) - n_old
+
+    # --- 스테이징 (페이지 단위로 바로 디스크에 쓰고, 끊겨도 이어받을 수 있게) ---
+    def staging_path(self, source, ticker, interval):
+        return self.path(source, ticker, interval) + STAGING_SUFFIX
+
+    def stage_append(self, source, ticker, interval, df):
+        # 순서와 상관없이 파일 끝에 추가만 하고, 가장 오래된 시각을 이어받기 커서로 기록
+        if df is None or df.empty: return 0
+        with self._lock:
+            d = self.staging_path(source, ticker, interval)
+            os.makedirs(d, exist_ok=True)
+            meta = self._load_meta(d)
+            if meta is None:
+                tz = pd.DatetimeIndex(df.index).tz
+                meta = {
+                    "columns": [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c])],
+                    "tz": str(tz) if tz is not None else None,
+                    "index_name": df.index.name,
+                }
+            n_old = self._count(d, meta)
+
+            ts = _to_ns(df.index)
+            cols = {TS_FILE: ts}
+            for c in meta["columns"]:
+                cols[c + ".f8"] = df[c].to_numpy(dtype=np.float64) if c in df.columns else np.full(len(df), np.nan)
+            for name, arr in cols.items():
+                path = os.path.join(d, name)
+                if os.path.exists(path) and os.path.getsize(path) // 8 > n_old:
+                    with open(path, "r+b") as f: f.truncate(n_old * 8)
+                with open(path, "ab") as f:
+                    f.write(np.ascontiguousarray(arr).tobytes())
+
+            cursor = int(ts.min())
+            meta["cursor"] = min(meta.get("cursor", cursor), cursor)
+            self._save_meta(d, meta)
+            return len(ts)
+
+    def staged_first_timestamp(self, source, ticker, interval):
+        meta = self._load_meta(self.staging_path(source, ticker, interval))
+        if not meta or "cursor" not in meta: return None
+        return _from_ns(np.array([meta["cursor"]], dtype=np.int64), meta)[0]
+
+    def commit_staged(self, source, ticker, interval, chunk_bars=200000):
+        # 스테이징된 봉을 시간순으로 정렬/중복 제거해 본 저장소에 합친다 (컬럼 한 묶음씩 청크 단위로)
+        d = self.staging_path(source, ticker, interval)
+        with self._lock:
+            meta = self._load_meta(d)
+            if not meta:
+                return 0
+            n = self._count(d, meta)
+            ts = np.array(self._column(d, TS_FILE, n))
+            order = np.argsort(ts, kind="stable")
+            ts_sorted = ts[order]
+            order = order[np.r_[True, ts_sorted[1:] != ts_sorted[:-1]]] if n else order
+            del ts, ts_sorted
+
+            added = 0
+            for lo in range(0, len(order), chunk_bars):
+                idx = order[lo:lo + chunk_bars]
+                data = {c: self._column(d, c + ".f8", n)[idx] for c in meta["columns"]}
+                chunk = pd.DataFrame(data, index=_from_ns(self._column(d, TS_FILE, n)[idx], meta))
+                added += self.append(source, ticker, interval, chunk)
+
+            self._remove_dir(d)
+            return added
+
+    def discard_staged(self, source, ticker, interval):
+        with self._lock:
+            self._remove_dir(self.staging_path(source, ticker, interval))
+
+    def _remove_dir(self, d):
+        if os.path.isdir(d):
+            for name in os.listdir(d):
+                os.remove(os.path.join(d, name))
+            os.rmdir(d)
+
+    def delete(self, source, ticker, interval):
+        with self._lock:
+            self._remove_dir(self.path(source, ticker, interval))